@@ -1,21 +1,26 @@
 # admin.py - Admin interface for movie metadata entry
 from flask import Flask, render_template, request, jsonify, redirect, url_for
-import sqlite3
-from pathlib import Path
 import csv
 from io import TextIOWrapper
 
+import database
+
 app = Flask(__name__)
 DATABASE = "movies.db"
 MOVIES_TABLE = "movies_flat"
 
+# Shared with server.py: long-lived per-thread connections in WAL mode, so
+# admin writes no longer block the API's readers (see database.py)
 def get_db():
-    db_path = Path(DATABASE)
-    if not db_path.exists():
-        raise RuntimeError(f"Database file not found: {DATABASE}")
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
+    return database.connection(DATABASE)
+
+def get_read_db():
+    """Read-only connection for views that only display data."""
+    return database.connection(DATABASE, readonly=True)
+
+@app.teardown_appcontext
+def release_connection(exc):
+    database.release()
 
 #CSV Loader
 @app.route('/upload_csv', methods=['POST'])
@@ -62,7 +67,6 @@ def upload_csv():
             errors.append(f"Line {i}: {str(e)}")
 
     db.commit()
-    db.close()
 
     return jsonify({
         "status": "completed",
@@ -109,9 +113,8 @@ def index():
         sql += " WHERE " + " AND ".join(clauses)
     sql += " ORDER BY movie_title"
 
-    db = get_db()
+    db = get_read_db()
     movies = db.execute(sql, params).fetchall()
-    db.close()
     return render_template('admin_index.html', movies=movies)
 
 @app.route('/add', methods=['GET', 'POST'])
@@ -140,7 +143,6 @@ def add_movie():
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             """, (director, actor_1, actor_2, actor_3, genres, title, tags, title.lower()))
             db.commit()
-            db.close()
             # If the client posted JSON (AJAX), return JSON; otherwise redirect to index so
             # traditional form submissions update the dashboard immediately.
             if request.is_json:
@@ -155,9 +157,8 @@ def add_movie():
 @app.route('/edit/<int:movie_id>', methods=['GET', 'POST'])
 def edit_movie(movie_id):
     """Edit an existing movie."""
-    db = get_db()
+    db = get_read_db()
     movie = db.execute(f"SELECT rowid as id, * FROM {MOVIES_TABLE} WHERE rowid = ?", (movie_id,)).fetchone()
-    db.close()
     
     if not movie:
         return jsonify({'error': 'Movie not found'}), 404
@@ -185,7 +186,6 @@ def edit_movie(movie_id):
                 WHERE rowid = ?
             """, (director, actor_1, actor_2, actor_3, genres, title, tags, title.lower(), movie_id))
             db.commit()
-            db.close()
             # Return JSON for AJAX clients, otherwise redirect back to the index page
             if request.is_json:
                 return jsonify({'status': 'ok', 'message': f"Movie '{title}' updated successfully"}), 200
@@ -203,19 +203,16 @@ def delete_movie(movie_id):
     movie = db.execute(f"SELECT movie_title FROM {MOVIES_TABLE} WHERE rowid = ?", (movie_id,)).fetchone()
     
     if not movie:
-        db.close()
         return jsonify({'error': 'Movie not found'}), 404
     
     try:
         db.execute(f"DELETE FROM {MOVIES_TABLE} WHERE rowid = ?", (movie_id,))
         db.commit()
         title = movie['movie_title']
-        db.close()
         if request.is_json:
             return jsonify({'status': 'ok', 'message': f"Movie '{title}' deleted successfully"}), 200
         return redirect(url_for('index'))
     except Exception as e:
-        db.close()
         if request.is_json:
             return jsonify({'error': str(e)}), 500
         return (str(e), 500)
@@ -223,18 +220,16 @@ def delete_movie(movie_id):
 @app.route('/api/movies', methods=['GET'])
 def api_movies():
     """API endpoint to fetch all movies (for dashboard updates)."""
-    db = get_db()
+    db = get_read_db()
     movies = db.execute(f"SELECT rowid, * FROM {MOVIES_TABLE} ORDER BY movie_title").fetchall()
-    db.close()
     return jsonify([dict(m) for m in movies])
 
 
 @app.route('/reports', methods=['GET'])
 def reports():
     """Admin reports view - list stored bug reports."""
-    db = get_db()
+    db = get_read_db()
     rows = db.execute('SELECT report_id, user_id, subject, description, created_at FROM bug_reports ORDER BY created_at DESC').fetchall()
-    db.close()
     reports = [dict(r) for r in rows]
     return render_template('admin_reports.html', reports=reports)
 
@@ -244,17 +239,14 @@ def delete_report(report_id):
     db = get_db()
     row = db.execute('SELECT report_id FROM bug_reports WHERE report_id = ?', (report_id,)).fetchone()
     if not row:
-        db.close()
         return jsonify({'error': 'Report not found'}), 404
     try:
         db.execute('DELETE FROM bug_reports WHERE report_id = ?', (report_id,))
         db.commit()
-        db.close()
         if request.is_json:
             return jsonify({'status': 'ok', 'message': f'Report {report_id} deleted'}), 200
         return redirect(url_for('reports'))
     except Exception as e:
-        db.close()
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
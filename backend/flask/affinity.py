@@ -0,0 +1,221 @@
+# affinity.py - materialized per-user affinity profiles
+#
+# Scoring a user used to mean parsing users_preferences.preferences_json,
+# reading users_feedback and the watchlist tables, and the title lists of
+# profile_store.py, on every request.  user_affinity keeps all of
+# it in one row per user, maintained incrementally by the write endpoints:
+#
+#   prefs           the explicit preference lists (movies/directors/actors/genres...)
+#   weights         learned {(kind, token): weight} from interactions, decayed
+#                   exponentially with HALF_LIFE_DAYS; stored as of `as_of`
+#   ratings         {movie rowid: rating} - seen set and item-CF seeds
+#   watchlist       movie rowids on the user's DB watchlists
+#   seen_titles / watchlist_titles
+#                   normalized titles from the title-based /user/seen and
+#                   /user/watchlist endpoints (used by /recommend/user)
+#
+# Interactions teach the profile the director, actor and genre tokens of the
+# movie involved: a rating r contributes (r - 3) / 2 (1..5 -> -1..+1), a
+# favourite FAVOURITE_SIGNAL and a "seen" mark SEEN_SIGNAL, each scaled by
+# LEARN_RATE and the kind's preference weight.
+import json
+import os
+import time
+
+from features import (
+    FEATURE_COLUMNS, PREFERENCE_WEIGHTS, MovieFeatures, PreferenceProfile, load_movie_features, movie_keys
+)
+from item_cf import MIN_SEED_RATING, to_rating
+
+HALF_LIFE_DAYS = float(os.getenv('AFFINITY_HALF_LIFE_DAYS', 90))
+LEARN_RATE = 0.5
+FAVOURITE_SIGNAL = 1.0
+SEEN_SIGNAL = 0.25
+# learned weights smaller than this are dropped to keep rows compact
+MIN_WEIGHT = 0.01
+LEARNED_KINDS = ('director', 'actor', 'genre')
+
+
+def ensure_affinity_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_affinity (
+            user_id TEXT PRIMARY KEY,
+            profile_json TEXT,
+            as_of REAL,
+            updated_at REAL
+        )
+    ''')
+
+
+def rating_signal(rating):
+    return None if rating is None else (rating - 3.0) / 2.0
+
+
+def _key(kind_token):
+    kind, _, token = kind_token.partition(':')
+    return kind, token
+
+
+class Affinity:
+    __slots__ = ('user_id', 'prefs', 'weights', 'as_of', 'ratings', 'watchlist',
+                 'seen_titles', 'watchlist_titles')
+
+    def __init__(self, user_id, prefs=None, weights=None, as_of=None, ratings=None, watchlist=None,
+                 seen_titles=None, watchlist_titles=None):
+        self.user_id = user_id
+        self.prefs = prefs or {}
+        self.weights = weights or {}
+        self.as_of = as_of if as_of is not None else time.time()
+        self.ratings = ratings or {}
+        self.watchlist = watchlist or set()
+        self.seen_titles = seen_titles or set()
+        self.watchlist_titles = watchlist_titles or set()
+
+    # --- (de)serialization -------------------------------------------------
+    def to_json(self):
+        return json.dumps({
+            'prefs': self.prefs,
+            'weights': {f"{k}:{t}": round(w, 6) for (k, t), w in self.weights.items()},
+            'ratings': {str(m): r for m, r in self.ratings.items()},
+            'watchlist': sorted(self.watchlist),
+            'seen_titles': sorted(self.seen_titles),
+            'watchlist_titles': sorted(self.watchlist_titles),
+        })
+
+    @classmethod
+    def from_json(cls, user_id, profile_json, as_of):
+        data = json.loads(profile_json) if profile_json else {}
+        return cls(
+            user_id,
+            prefs=data.get('prefs') or {},
+            weights={_key(k): w for k, w in (data.get('weights') or {}).items()},
+            as_of=as_of,
+            ratings={int(m): r for m, r in (data.get('ratings') or {}).items()},
+            watchlist=set(data.get('watchlist') or []),
+            seen_titles=set(data.get('seen_titles') or []),
+            watchlist_titles=set(data.get('watchlist_titles') or []),
+        )
+
+    # --- reads ---------------------------------------------------------------
+    def decayed_weights(self, now=None):
+        now = time.time() if now is None else now
+        factor = 0.5 ** (max(0.0, now - self.as_of) / (HALF_LIFE_DAYS * 86400.0))
+        return {k: w * factor for k, w in self.weights.items()}
+
+    def profile(self, now=None):
+        """features.PreferenceProfile with the decayed learned weights."""
+        return PreferenceProfile(self.prefs, affinity=self.decayed_weights(now))
+
+    def has_preferences(self):
+        return bool(self.prefs)
+
+    def is_cold(self):
+        """No preferences, learned weights or CF seeds: nothing to score against."""
+        return not any((self.prefs or {}).values()) and not self.weights and not self.cf_seeds()
+
+    def exclude_rowids(self):
+        """Watchlist + rated movie ids as str, like get_user_watchlist_set/get_user_seen_set."""
+        return {str(m) for m in self.watchlist} | {str(m) for m, r in self.ratings.items() if r is not None}
+
+    def cf_seeds(self):
+        return {m: r for m, r in self.ratings.items() if r is not None and r >= MIN_SEED_RATING}
+
+    # --- updates -------------------------------------------------------------
+    def learn(self, movie, signal, now=None):
+        """Add `signal` on the director/actor/genre tokens of a MovieFeatures."""
+        if not signal or movie is None:
+            return
+        now = time.time() if now is None else now
+        weights = self.decayed_weights(now)
+        for key in movie_keys(movie, LEARNED_KINDS):
+            weights[key] = weights.get(key, 0.0) + signal * LEARN_RATE * PREFERENCE_WEIGHTS[key[0]]
+        self.weights = {k: w for k, w in weights.items() if abs(w) >= MIN_WEIGHT}
+        self.as_of = now
+
+    def set_rating(self, movie, rating, now=None):
+        """Record a new or changed rating of `movie` (MovieFeatures with rowid)."""
+        rating = to_rating(rating)
+        old = self.ratings.get(movie.rowid)
+        self.ratings[movie.rowid] = rating
+        delta = (rating_signal(rating) or 0.0) - (rating_signal(old) or 0.0)
+        self.learn(movie, delta, now)
+
+
+def load(db, user_id):
+    row = db.execute('SELECT profile_json, as_of FROM user_affinity WHERE user_id = ?', (user_id,)).fetchone()
+    return Affinity.from_json(user_id, row[0], row[1]) if row else None
+
+
+def load_many(db, user_ids):
+    out = {}
+    ids = list(user_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        for user_id, profile_json, as_of in db.execute(
+                f"SELECT user_id, profile_json, as_of FROM user_affinity WHERE user_id IN ({','.join('?' * len(chunk))})",
+                chunk):
+            out[user_id] = Affinity.from_json(user_id, profile_json, as_of)
+    return out
+
+
+def save(db, aff):
+    """Upsert the row (no commit)."""
+    now = time.time()
+    db.execute(
+        'INSERT INTO user_affinity (user_id, profile_json, as_of, updated_at) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT(user_id) DO UPDATE SET profile_json=excluded.profile_json, as_of=excluded.as_of, '
+        'updated_at=excluded.updated_at',
+        (aff.user_id, aff.to_json(), aff.as_of, now)
+    )
+
+
+def rebuild(db, user_id, memory=None):
+    """Assemble a profile from the source tables (first use, or after a schema change).
+
+    `memory` is the user's title lists from profile_store.py
+    (UserLists.as_memory()), if any: its seen/watchlist titles are carried
+    over, and its 'preferences', if given, are the fallback when
+    users_preferences has no row.
+    """
+    memory = memory or {}
+    aff = Affinity(user_id)
+    row = db.execute('SELECT preferences_json FROM users_preferences WHERE user_id = ?', (user_id,)).fetchone()
+    prefs = None
+    if row and row[0]:
+        try:
+            prefs = json.loads(row[0])
+        except ValueError:
+            prefs = {}
+    aff.prefs = prefs if prefs is not None else (memory.get('preferences') or {})
+
+    rated = db.execute(
+        'SELECT movie_rowid, rating, created_at FROM users_feedback WHERE user_id = ? AND rating IS NOT NULL '
+        'ORDER BY created_at', (user_id,)
+    ).fetchall()
+    movies = load_movie_features(db, {r[0] for r in rated})
+    # replay ratings in time order so older ones are decayed accordingly
+    for movie_rowid, rating, created_at in rated:
+        movie = movies.get(movie_rowid) or MovieFeatures(movie_rowid, None, None, None, None, None, None, None)
+        aff.set_rating(movie, rating, now=created_at or aff.as_of)
+    aff.watchlist = {r[0] for r in db.execute(
+        'SELECT m.movie_rowid FROM user_watchlist_map m JOIN users_watchlist w ON m.list_id = w.list_id '
+        'WHERE w.user_id = ?', (user_id,))}
+    aff.seen_titles = {t.strip().lower() for t in (memory.get('seen') or []) if t}
+    aff.watchlist_titles = {t.strip().lower() for t in (memory.get('watchlist') or []) if t}
+    return aff
+
+
+def get_or_build(db, user_id, memory=None):
+    """The user's profile; built from the source tables and saved on first use."""
+    aff = load(db, user_id)
+    if aff is None:
+        aff = rebuild(db, user_id, memory)
+        save(db, aff)
+    return aff
+
+
+def movie_by_title(db, title):
+    """MovieFeatures for the first movie whose title matches (case-insensitive), or None."""
+    row = db.execute(f"SELECT {FEATURE_COLUMNS} FROM movies_flat WHERE LOWER(movie_title) = ? LIMIT 1",
+                     ((title or '').strip().lower(),)).fetchone()
+    return MovieFeatures.from_row(row) if row else None
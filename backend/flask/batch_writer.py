@@ -0,0 +1,163 @@
+# batch_writer.py - background writer for append-only inserts
+#
+# recommendation_records, recommendation_hits and bug_reports rows are only
+# ever appended, yet every request used to INSERT and commit its own row,
+# paying a whole transaction and its disk sync on the request thread.
+# BatchWriter queues them instead: one thread writes whatever has queued up
+# in a single transaction, committed once it holds `max_rows` rows or
+# `max_delay` seconds after its first row, whichever comes first.
+#
+#   submit(sql, params)     queues the insert and returns a PendingWrite
+#   PendingWrite.result()   waits for the commit and returns the new rowid;
+#                           submit(..., urgent=True) commits without waiting
+#                           out max_delay, still sharing the transaction with
+#                           whatever else is queued (group commit)
+#
+# A PendingWrite passed as a parameter is replaced by its rowid when written,
+# so a row can refer to one queued before it (a hit to its record).  The
+# queue is bounded: submit() blocks while it is full rather than letting
+# memory grow, and close() writes everything still queued.
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import database
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class PendingWrite:
+    """One queued insert; `rowid` is set once its batch is committed."""
+    __slots__ = ('sql', 'params', 'urgent', 'rowid', 'error', '_done')
+
+    def __init__(self, sql, params, urgent=False):
+        self.sql, self.params, self.urgent = sql, params, urgent
+        self.rowid = None
+        self.error = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """The rowid of the inserted row; raises the error that failed it."""
+        if not self._done.wait(timeout):
+            raise TimeoutError('Batched write not committed in time')
+        if self.error is not None:
+            raise self.error
+        return self.rowid
+
+
+class BatchWriter:
+    """Single background thread committing queued inserts in batches."""
+
+    def __init__(self, db_path, max_rows=500, max_delay=0.02, max_queue=10000):
+        self.db_path = db_path
+        self.max_rows, self.max_delay = max_rows, max_delay
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._conn = None
+        self._closed = False
+
+    def submit(self, sql, params=(), urgent=False):
+        """Queue an INSERT; blocks while the queue is full."""
+        if self._closed:
+            raise RuntimeError('BatchWriter is closed')
+        item = PendingWrite(sql, tuple(params), urgent)
+        self._start()
+        self._queue.put(item)
+        return item
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far is committed."""
+        if self._thread is None:
+            return
+        self.submit(None, urgent=True).result(timeout)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='batch-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            urgent = item.urgent
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                try:
+                    # a waiting request only takes what is already queued
+                    remaining = 0 if urgent else deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                urgent = urgent or item.urgent
+            self._write(batch)
+        # submitted while closing: fail rather than leave their callers waiting
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                item.error = RuntimeError('BatchWriter is closed')
+                item._done.set()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            database.remove_orphaned_wal(self.db_path)
+
+    def _write(self, batch):
+        try:
+            if self._conn is None:
+                self._conn = database.connect(self.db_path)
+            conn = self._conn
+            for item in batch:
+                if item.sql is None:
+                    continue
+                params = [p.rowid if isinstance(p, PendingWrite) else p for p in item.params]
+                try:
+                    item.rowid = conn.execute(item.sql, params).lastrowid
+                except sqlite3.Error as e:
+                    # only this statement is rolled back; the rest of the batch goes on
+                    item.error = e
+                    logger.error("Batched insert failed: %s", e)
+            conn.commit()
+        except Exception as e:
+            logger.error("Batched write of %d rows failed: %s", len(batch), e)
+            for item in batch:
+                item.rowid = None
+                item.error = item.error or e
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        finally:
+            for item in batch:
+                item.params = None
+                item._done.set()
+
+    def close(self, timeout=5):
+        """Write everything still queued and stop the thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
@@ -0,0 +1,76 @@
+# bench_ann.py - recall@K / latency of the LSH index against exact search
+#
+# Usage:
+#   python bench_ann.py                       # 5k and 50k synthetic movies
+#   python bench_ann.py --sizes 5000 500000 --queries 200
+#
+# For every catalog size it builds the index once per parameter set and
+# reports build time, mean query latency for exact and approximate search,
+# mean candidates re-ranked, and recall@K (tie-aware, see ann_index.recall_at_k).
+import argparse
+import random
+import time
+
+from ann_index import LSHIndex, content_features, recall_at_k
+from bench_data import synthetic_movies
+from server import split_field
+
+PARAM_GRID = [
+    {'n_tables': 8, 'n_probes': 0},
+    {'n_tables': 16, 'n_probes': 0},
+    {'n_tables': 32, 'n_probes': 0},
+    {'n_tables': 32, 'n_probes': 1},
+    {'n_tables': 16, 'n_probes': 0, 'idf_power': 1.0},
+]
+
+
+def row_features(row):
+    director, a1, a2, a3, genres, _title, tags, _lower = row
+    actors = split_field(a1) + split_field(a2) + split_field(a3)
+    return content_features(director.strip().lower(), actors, split_field(genres), split_field(tags))
+
+
+def run(size, n_queries, k, seed):
+    rows = synthetic_movies(size, seed=seed)
+    items = [(i + 1, row_features(r)) for i, r in enumerate(rows)]
+    rng = random.Random(seed)
+    sample = rng.sample(items, min(n_queries, len(items)))
+    queries = [(feats, (mid,)) for mid, feats in sample]
+    print(f"\n== {size} movies, {len(queries)} queries, K={k}")
+    print(f"{'params':<40} {'build s':>8} {'exact ms':>9} {'ann ms':>8} {'cands':>7} {'recall':>7}")
+    for params in PARAM_GRID:
+        start = time.perf_counter()
+        index = LSHIndex(**params).build(items)
+        build_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for feats, excl in queries:
+            index.exact(feats, k=k, exclude=excl)
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        n_cands = 0
+        for feats, excl in queries:
+            index.query(feats, k=k, exclude=excl)
+            n_cands += len(index.candidates(feats)[0])
+        ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        recall = recall_at_k(index, queries, k=k)
+        label = ', '.join(f"{key}={val}" for key, val in params.items())
+        print(f"{label:<40} {build_s:>8.2f} {exact_ms:>9.2f} {ann_ms:>8.2f} "
+              f"{n_cands / len(queries):>7.0f} {recall:>7.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 50000])
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.queries, args.k, args.seed)
+
+
+if __name__ == '__main__':
+    main()
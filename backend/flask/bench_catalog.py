@@ -0,0 +1,104 @@
+# bench_catalog.py - memory and lookup latency of the in-memory catalog snapshot
+#
+# Usage:
+#   python bench_catalog.py                        # 100k synthetic movies
+#   python bench_catalog.py --sizes 100000 1000000 --queries 2000
+#
+# For every catalog size it reports the snapshot's load time and memory
+# (tracemalloc, total and per 100k movies) next to a plain list of row dicts
+# for reference, then the mean latency of the read paths with and without it:
+#   by rowid   /movies/<id>: SELECT by rowid + row_to_dict, or snapshot.movie
+#   by title   /movie: LOWER(TRIM(movie_title)) = ? scan, or the by_title map
+#   search     /search?title=...: LIKE scan with LIMIT, or snapshot.find
+import argparse
+import gc
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from bench_data import create_catalog_db
+from catalog_snapshot import Contains, load_catalog_snapshot
+
+
+def measure(build):
+    """(result, MB allocated by build(), seconds)."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size / 1e6, elapsed
+
+
+def per_call_ms(fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(a)
+    return (time.perf_counter() - start) / len(args) * 1000
+
+
+def run(size, n_queries, seed):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        create_catalog_db(path, size, seed).close()
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+
+        snapshot, snapshot_mb, load_s = measure(lambda: load_catalog_snapshot(conn))
+        dicts, dicts_mb, _ = measure(lambda: [dict(r) for r in conn.execute('SELECT rowid AS _rowid, * FROM movies_flat')])
+        del dicts
+        per_100k = 100000 / size
+        print(f"{size} movies: snapshot loaded in {load_s:.2f}s, {snapshot_mb:.1f} MB "
+              f"({snapshot_mb * per_100k:.1f} MB per 100k movies; row dicts {dicts_mb * per_100k:.1f} MB per 100k)")
+
+        rng = random.Random(seed)
+        rowids = [rng.randint(1, size) for _ in range(n_queries)]
+        titles = [snapshot.movie(snapshot.by_rowid[r])['movie_title'].upper() for r in rowids]
+        terms = [f"movie {rng.randrange(size)} " for _ in range(max(1, n_queries // 20))]
+
+        def sql_by_rowid(rowid):
+            row = conn.execute('SELECT rowid AS movie_id, * FROM movies_flat WHERE rowid = ?', (rowid,)).fetchone()
+            return dict({k: row[k] for k in row.keys()})
+
+        def sql_by_title(title):
+            return conn.execute('SELECT * FROM movies_flat WHERE LOWER(TRIM(movie_title)) = ? LIMIT 1',
+                                (title.strip().lower(),)).fetchone()
+
+        def sql_search(term):
+            return conn.execute('SELECT * FROM movies_flat WHERE LOWER(movie_title) LIKE ? LIMIT 100',
+                                (f"%{term.strip()}%",)).fetchall()
+
+        def snapshot_search(term):
+            return [snapshot.movie(p) for p in snapshot.find([Contains(('movie_title',), term)], 100)]
+
+        # the title scan is O(n) per query in SQLite; keep it to a sample
+        title_sample = titles[:max(1, n_queries // 20)]
+        print(f"  by rowid  sql {per_call_ms(sql_by_rowid, rowids):8.3f} ms  "
+              f"snapshot {per_call_ms(lambda r: snapshot.movie(snapshot.by_rowid[r], 'movie_id'), rowids):8.3f} ms")
+        print(f"  by title  sql {per_call_ms(sql_by_title, title_sample):8.3f} ms  "
+              f"snapshot {per_call_ms(lambda t: snapshot.movie(snapshot.find_title(t)), titles):8.3f} ms")
+        print(f"  search    sql {per_call_ms(sql_search, terms):8.3f} ms  "
+              f"snapshot {per_call_ms(snapshot_search, terms):8.3f} ms")
+        conn.close()
+    finally:
+        os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000])
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.queries, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# bench_data.py - synthetic movies_flat catalogs for the bench_*.py scripts
+#
+# The bundled movie_dataset.csv has ~5k rows; benchmarks need 50k-500k.  Names
+# are drawn from Zipf-like pools so popular directors/actors/genres recur the
+# way they do in the real dataset.
+import random
+import sqlite3
+
+GENRES = [
+    'Action', 'Adventure', 'Animation', 'Biography', 'Comedy', 'Crime', 'Documentary',
+    'Drama', 'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Musical', 'Mystery',
+    'Romance', 'Sci-Fi', 'Sport', 'Thriller', 'War', 'Western',
+]
+
+MOVIE_COLUMNS = ('director_name', 'actor_1_name', 'actor_2_name', 'actor_3_name',
+                 'genres', 'movie_title', 'tags', 'movie_title_lower')
+
+
+def _zipf_pick(rng, pool, skew=1.1):
+    # inverse-CDF sample of a truncated power law over the pool indices
+    u = rng.random()
+    idx = int(len(pool) * (u ** (skew * 2)))
+    return pool[min(idx, len(pool) - 1)]
+
+
+def synthetic_movies(n, seed=42):
+    """Return `n` row tuples in MOVIE_COLUMNS order."""
+    rng = random.Random(seed)
+    n_people = max(50, n // 4)
+    directors = [f"Director{i} Surname{i % 997}" for i in range(max(20, n // 6))]
+    actors = [f"Actor{i} Family{i % 1499}" for i in range(n_people)]
+    tag_words = [f"tag{i}" for i in range(max(100, n // 20))]
+    rows = []
+    for i in range(n):
+        director = _zipf_pick(rng, directors)
+        cast = [_zipf_pick(rng, actors) for _ in range(3)]
+        genres = ' '.join(sorted(set(rng.sample(GENRES, rng.randint(1, 3)))))
+        title = f"Movie {i} {rng.choice(tag_words)}"
+        tags = ' '.join([genres, title.lower()] + cast + [director] + rng.sample(tag_words, 3))
+        rows.append((director, cast[0], cast[1], cast[2], genres, title, tags, title.lower()))
+    return rows
+
+
+def create_catalog_db(path, n, seed=42):
+    """Create (or extend) a movies_flat table at `path` with `n` synthetic rows."""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS movies_flat (
+            rowid INTEGER PRIMARY KEY,
+            director_name TEXT,
+            actor_1_name TEXT,
+            actor_2_name TEXT,
+            actor_3_name TEXT,
+            genres TEXT,
+            movie_title TEXT,
+            tags TEXT,
+            movie_title_lower TEXT,
+            synopsis TEXT,
+            rating REAL,
+            platforms TEXT
+        )
+    ''')
+    conn.executemany(
+        f"INSERT INTO movies_flat ({', '.join(MOVIE_COLUMNS)}) VALUES ({', '.join('?' * len(MOVIE_COLUMNS))})",
+        synthetic_movies(n, seed)
+    )
+    conn.commit()
+    return conn
@@ -0,0 +1,137 @@
+# bench_scoring.py - latency of the user-recommendation scorers
+#
+# Usage:
+#   python bench_scoring.py                        # 5k, 50k and 500k synthetic movies
+#   python bench_scoring.py --sizes 50000 --queries 50
+#
+# For every catalog size it compares, per recommendation request:
+#   sql+dict  - the original path: SELECT * into dicts, split_field + score per row
+#   cached    - features.rank_by_preference over the pre-tokenized FeatureCache
+#   vector    - vector_scorer.VectorScorer.top (sparse mat-vec + argpartition)
+#   maxscore  - VectorScorer.top_maxscore (early-terminating posting-list walk)
+# checks that all of them return the same (score, rowid) ranking, and reports
+# how many posting entries the full scan reads versus what max-score visits.
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from bench_data import create_catalog_db
+from features import PreferenceProfile, load_feature_cache, rank_by_preference, split_field
+from vector_scorer import VectorScorer
+
+
+def legacy_top(conn, profile, top_n, excluded):
+    """The pre-cache compute_recommendations_for_user scoring loop."""
+    candidates = [dict(r) for r in conn.execute("SELECT rowid as movie_id, * FROM movies_flat").fetchall()]
+    scored = []
+    for m in candidates:
+        if str(m['movie_id']) in excluded:
+            continue
+        s = 0.0
+        if (m.get('movie_title') or '').strip().lower() in profile.movies:
+            s += 6.0
+        director = (m.get('director_name') or '').strip().lower()
+        if director and director in profile.directors:
+            s += 5.0
+        actors = set()
+        for col in ('actor_1_name', 'actor_2_name', 'actor_3_name'):
+            actors.update(split_field(m.get(col, '')))
+        s += 3.0 * len(actors.intersection(profile.actors))
+        s += 1.0 * len(set(split_field(m.get('genres', ''))).intersection(profile.genres))
+        if s > 0:
+            scored.append((s, m))
+    scored.sort(key=lambda x: (-x[0], x[1].get('movie_title') or ''))
+    return [(s, m['movie_id']) for s, m in scored[:top_n]]
+
+
+def random_profiles(movies, n, rng):
+    """Profiles shaped like real ones: a few favourite titles, directors, actors, genres."""
+    profiles = []
+    for _ in range(n):
+        picks = rng.sample(movies, 5)
+        profiles.append((PreferenceProfile({
+            'movies': [m.title for m in picks[:2]],
+            'directors': [m.director for m in picks[:3]],
+            'actors': [a for m in picks for a in sorted(m.actors)[:2]],
+            'genres': sorted(picks[0].genres),
+        }), {str(m.rowid) for m in rng.sample(movies, 20)}))
+    return profiles
+
+
+def timed(fn, queries):
+    start = time.perf_counter()
+    results = [fn(profile, excluded) for profile, excluded in queries]
+    return (time.perf_counter() - start) * 1000 / len(queries), results
+
+
+def run(size, n_queries, n_legacy, top_n, seed):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        create_catalog_db(path, size, seed).close()
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+
+        start = time.perf_counter()
+        catalog = load_feature_cache(conn)
+        cache_s = time.perf_counter() - start
+        start = time.perf_counter()
+        scorer = VectorScorer(catalog.movies)
+        matrix_s = time.perf_counter() - start
+
+        rng = random.Random(seed)
+        queries = random_profiles(catalog.movies, n_queries, rng)
+
+        legacy_ms, legacy = timed(lambda p, ex: legacy_top(conn, p, top_n, ex), queries[:n_legacy])
+        cached_ms, cached = timed(
+            lambda p, ex: [(s, m.rowid) for s, m in rank_by_preference(
+                catalog.movies, p, top_n, skip=lambda m: str(m.rowid) in ex)],
+            queries)
+        vector_ms, vector = timed(
+            lambda p, ex: [(s, m.rowid) for s, m in scorer.top(p, top_n, scorer.positions_for_rowids(ex))],
+            queries)
+        stats = []
+
+        def maxscore_top(p, ex):
+            st = {}
+            top = scorer.top_maxscore(p, top_n, scorer.positions_for_rowids(ex), stats=st)
+            stats.append(st)
+            return [(s, m.rowid) for s, m in top]
+        maxscore_ms, maxscore = timed(maxscore_top, queries)
+        same = vector == cached == maxscore and vector[:n_legacy] == legacy
+
+        print(f"\n== {size} movies, top {top_n}: feature cache {cache_s:.2f}s, "
+              f"matrix {matrix_s:.2f}s ({len(scorer.vocab)} features, {len(scorer.row_idx)} non-zeros)")
+        print(f"{'scorer':<10} {'ms/request':>11} {'speedup':>8}")
+        for name, ms in (('sql+dict', legacy_ms), ('cached', cached_ms), ('vector', vector_ms),
+                         ('maxscore', maxscore_ms)):
+            print(f"{name:<10} {ms:>11.2f} {legacy_ms / ms:>7.1f}x")
+        postings = sum(st['postings'] for st in stats) / len(stats)
+        visited = sum(st['visited'] for st in stats) / len(stats)
+        candidates = sum(st['candidates'] for st in stats) / len(stats)
+        print(f"posting entries/request: full scan {postings:.0f}, max-score visited {visited:.0f} "
+              f"({visited / max(postings, 1):.1%}), candidates {candidates:.0f}")
+        print(f"identical rankings: {same}")
+        conn.close()
+    finally:
+        os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 50000, 500000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--legacy-queries', type=int, default=3,
+                        help='requests timed on the slow sql+dict path')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.queries, min(args.legacy_queries, args.queries), args.top, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# bench_shards.py - throughput of scatter-gather scoring over shard processes
+#
+# Usage:
+#   python bench_shards.py                          # 300k movies, 1/2/4/8 shards
+#   python bench_shards.py --size 500000 --shards 1 2 4 --clients 16
+#
+# Fires the same recommendation requests from --clients concurrent threads
+# (like the threaded API server) at:
+#   in-process  - one VectorScorer over the whole catalog, in the request threads
+#   N shards    - shard_pool.ShardPool with N worker processes
+# and reports requests/s per setup.  All setups must return the same rankings.
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_data import create_catalog_db
+from bench_scoring import random_profiles
+from catalog import ensure_catalog_state, get_catalog_version
+from features import load_feature_cache
+from shard_pool import ShardPool
+from vector_scorer import VectorScorer
+
+
+def throughput(fn, queries, clients):
+    with ThreadPoolExecutor(clients) as ex:
+        list(ex.map(fn, queries[:clients]))  # warm up
+        start = time.perf_counter()
+        results = list(ex.map(fn, queries))
+    return len(queries) / (time.perf_counter() - start), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=300000)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        conn = create_catalog_db(path, args.size, args.seed)
+        ensure_catalog_state(conn.cursor())
+        conn.commit()
+        conn.row_factory = sqlite3.Row
+        version = get_catalog_version(conn)
+        movies = load_feature_cache(conn).movies
+        queries = random_profiles(movies, args.queries, random.Random(args.seed))
+        print(f"{args.size} movies, {args.queries} requests from {args.clients} client threads, "
+              f"{os.cpu_count()} CPUs")
+
+        scorer = VectorScorer(movies)
+        base_rps, expected = throughput(
+            lambda q: [(s, m.rowid) for s, m in scorer.top(q[0], args.top, scorer.positions_for_rowids(q[1]))],
+            queries, args.clients)
+        print(f"{'setup':<12} {'req/s':>8} {'scaling':>8} {'identical':>10}")
+        print(f"{'in-process':<12} {base_rps:>8.1f} {1.0:>7.2f}x {'-':>10}")
+
+        for n in args.shards:
+            pool = ShardPool(path, n, timeout=600)
+            try:
+                rps, got = throughput(
+                    lambda q: [(s, m.rowid) for s, m in pool.top(q[0], args.top, version, q[1])],
+                    queries, args.clients)
+            finally:
+                pool.close()
+            print(f"{f'{n} shards':<12} {rps:>8.1f} {rps / base_rps:>7.2f}x {str(got == expected):>10}")
+        conn.close()
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# bench_user_data.py - per-user lookups on large feedback/watchlist tables
+#
+# Usage:
+#   python bench_user_data.py                       # 2M feedback rows
+#   python bench_user_data.py --feedback 5000000 --users 500000
+#
+# Fills users_feedback and the watchlist tables with synthetic rows, then
+# times the per-user queries the API runs before and after
+# migrations.migrate():
+#   seen set     get_user_seen_set
+#   watchlist    get_user_watchlist_set (map joined to lists by user)
+#   rate         api_movie_feedback's write: select-then-update/insert
+#                before, the (user_id, movie_rowid) upsert after
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import migrations
+
+SEEN_SQL = 'SELECT movie_rowid FROM users_feedback WHERE user_id = ? AND rating IS NOT NULL'
+WATCHLIST_SQL = ('SELECT movie_rowid FROM user_watchlist_map m JOIN users_watchlist w ON m.list_id = w.list_id '
+                 'WHERE w.user_id = ?')
+
+
+def create_db(path, n_feedback, n_users, n_movies, seed):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE users_feedback (feedback_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT,
+            movie_rowid INTEGER, movie_title TEXT, rating REAL, text TEXT, created_at REAL);
+        CREATE TABLE users_watchlist (list_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, name TEXT,
+            created_at REAL);
+        CREATE TABLE user_watchlist_map (id INTEGER PRIMARY KEY AUTOINCREMENT, list_id INTEGER,
+            movie_rowid INTEGER, added_at REAL);
+    ''')
+    # distinct (user, movie) pairs, as the API writes them
+    pairs = set()
+    while len(pairs) < n_feedback:
+        pairs.add((f'user{rng.randrange(n_users)}', rng.randrange(1, n_movies + 1)))
+    conn.executemany('INSERT INTO users_feedback (user_id, movie_rowid, rating, created_at) VALUES (?, ?, ?, 0)',
+                     ((u, m, rng.randint(1, 5)) for u, m in pairs))
+    conn.executemany('INSERT INTO users_watchlist (user_id, name) VALUES (?, ?)',
+                     ((f'user{u}', 'default') for u in range(n_users)))
+    conn.executemany('INSERT INTO user_watchlist_map (list_id, movie_rowid) VALUES (?, ?)',
+                     ((rng.randrange(1, n_users + 1), rng.randrange(1, n_movies + 1)) for _ in range(n_feedback // 4)))
+    conn.commit()
+    return conn
+
+
+def per_call_ms(fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(a)
+    return (time.perf_counter() - start) / len(args) * 1000
+
+
+def rate_old(conn, user_id, movie_rowid, rating):
+    existing = conn.execute('SELECT feedback_id, rating FROM users_feedback WHERE user_id = ? AND movie_rowid = ? LIMIT 1',
+                            (user_id, movie_rowid)).fetchone()
+    if existing:
+        conn.execute('UPDATE users_feedback SET rating = ? WHERE feedback_id = ?', (rating, existing[0]))
+    else:
+        conn.execute('INSERT INTO users_feedback (user_id, movie_rowid, rating) VALUES (?, ?, ?)',
+                     (user_id, movie_rowid, rating))
+    conn.commit()
+
+
+def rate_upsert(conn, user_id, movie_rowid, rating):
+    conn.execute('SELECT rating FROM users_feedback WHERE user_id = ? AND movie_rowid = ?', (user_id, movie_rowid))
+    conn.execute('INSERT INTO users_feedback (user_id, movie_rowid, rating) VALUES (?, ?, ?) '
+                 'ON CONFLICT(user_id, movie_rowid) DO UPDATE SET rating=excluded.rating', (user_id, movie_rowid, rating))
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--feedback', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--movies', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=20, help='calls per timing without indexes')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        start = time.perf_counter()
+        conn = create_db(path, args.feedback, args.users, args.movies, args.seed)
+        print(f"{args.feedback} feedback rows, {args.users} users ({time.perf_counter() - start:.1f}s to build)")
+        rng = random.Random(args.seed + 1)
+        users = [f'user{rng.randrange(args.users)}' for _ in range(args.queries * 50)]
+        writes = [(u, rng.randrange(1, args.movies + 1), rng.randint(1, 5)) for u in users]
+
+        def timings(n, rate):
+            return (
+                per_call_ms(lambda u: conn.execute(SEEN_SQL, (u,)).fetchall(), users[:n]),
+                per_call_ms(lambda u: conn.execute(WATCHLIST_SQL, (u,)).fetchall(), users[:n]),
+                per_call_ms(lambda w: rate(conn, *w), writes[:n]),
+            )
+
+        before = timings(args.queries, rate_old)
+        start = time.perf_counter()
+        migrations.migrate(conn)
+        print(f"migrations applied in {time.perf_counter() - start:.1f}s")
+        after = timings(args.queries * 50, rate_upsert)
+
+        print(f"{'query':<12} {'before ms':>10} {'after ms':>10} {'speed-up':>9}")
+        for name, b, a in zip(('seen set', 'watchlist', 'rate'), before, after):
+            print(f"{name:<12} {b:>10.3f} {a:>10.3f} {b / a:>8.0f}x")
+        conn.close()
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# bitmap_index.py - per-genre and per-tag bitmaps for catalog filtering
+#
+# Every genre token, and each of the TOP_TAGS most frequent tag tokens, maps
+# to a Python int with bit `rowid` set for each movie carrying it.  A filter
+# such as "Action AND Thriller AND NOT Horror" is then `a & t & ~h` over
+# ints of catalog-size / 8 bytes, evaluated before any row is read; /search
+# and /movies/search fetch only the rowids left in the result
+# (iter_rowids) and apply their remaining SQL criteria to those.
+#
+# Tokens are the MovieFeatures tokens (features.split_field), so "Drama"
+# never matches "Melodrama" the way LIKE '%drama%' does.  The bitmaps follow
+# the catalog version like the other derived structures: the bits of the rows
+# changed since (catalog.changed_rowids) are cleared and set again from the
+# current rows, and only a bulk rewrite rebuilds.
+import heapq
+import threading
+from collections import Counter, defaultdict
+
+from catalog import changed_rowids, get_catalog_version
+from features import iter_movie_features, load_movie_features, split_field
+
+# tag tokens that get a bitmap; rarer ones are found with LIKE and checked as tokens (server.tag_bitmap)
+TOP_TAGS = 512
+
+
+def from_rowids(rowids):
+    """Bitmap with the bit of every rowid in `rowids` set."""
+    rowids = list(rowids)
+    if not rowids:
+        return 0
+    buf = bytearray(max(rowids) // 8 + 1)
+    for r in rowids:
+        buf[r >> 3] |= 1 << (r & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def iter_rowids(bitmap):
+    """Set rowids of `bitmap` in ascending order (lazy, so callers can stop early)."""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for i, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield (i << 3) + low.bit_length() - 1
+            byte ^= low
+
+
+class MovieBitmaps:
+    """Immutable genre/tag bitmaps for one catalog version."""
+    __slots__ = ('genres', 'tags', 'all', 'version', 'watermark')
+
+    def __init__(self, genres, tags, all_rowids, version, watermark):
+        self.genres, self.tags, self.all = genres, tags, all_rowids
+        self.version, self.watermark = version, watermark
+
+    @classmethod
+    def build(cls, movies, version, top_tags=TOP_TAGS):
+        """`movies` is a callable returning an iterable of MovieFeatures; it is read twice."""
+        counts = Counter(t for m in movies() for t in m.tags)
+        indexed = {t for t, _ in heapq.nlargest(top_tags, counts.items(), key=lambda x: (x[1], x[0]))}
+        genres, tags, everything = defaultdict(list), defaultdict(list), []
+        for m in movies():
+            everything.append(m.rowid)
+            for g in m.genres:
+                genres[g].append(m.rowid)
+            for t in m.tags & indexed:
+                tags[t].append(m.rowid)
+        return cls(
+            {g: from_rowids(ids) for g, ids in genres.items()},
+            {t: from_rowids(tags.get(t, ())) for t in indexed},
+            from_rowids(everything), version, max(everything, default=0),
+        )
+
+    def update(self, changed, movies, version):
+        """Copy with the bits of the `changed` rowids set from `movies` (those still in the catalog).
+
+        Tags that were not indexed stay unindexed.
+        """
+        genres, tags, present = defaultdict(list), defaultdict(list), []
+        for m in movies:
+            present.append(m.rowid)
+            for g in m.genres:
+                genres[g].append(m.rowid)
+            for t in m.tags:
+                if t in self.tags:
+                    tags[t].append(m.rowid)
+        keep = ~from_rowids(changed)
+
+        def merged(bitmaps, added):
+            out = {k: bm & keep for k, bm in bitmaps.items()}
+            for k, ids in added.items():
+                out[k] = out.get(k, 0) | from_rowids(ids)
+            return out
+        all_rowids = (self.all & keep) | from_rowids(present)
+        return MovieBitmaps(merged(self.genres, genres), merged(self.tags, tags), all_rowids, version,
+                            all_rowids.bit_length() - 1 if all_rowids else 0)
+
+    def genre(self, term):
+        """Movies with every token of `term`; a token that is not a genre matches the genres containing it."""
+        out = self.all
+        for token in split_field(term):
+            bm = self.genres.get(token)
+            if bm is None:
+                bm = 0
+                for g, bits in self.genres.items():
+                    if token in g:
+                        bm |= bits
+            out &= bm
+        return out
+
+    def tag(self, term):
+        """Movies with every token of `term`, or None when a token has no bitmap."""
+        out = self.all
+        for token in split_field(term):
+            bm = self.tags.get(token)
+            if bm is None:
+                return None
+            out &= bm
+        return out
+
+    def genre_filter(self, all_of=(), any_of=(), none_of=()):
+        """Bitmap for genre terms that must all / at least one / none match; None when no terms."""
+        if not (all_of or any_of or none_of):
+            return None
+        out = self.all
+        for term in all_of:
+            out &= self.genre(term)
+        if any_of:
+            either = 0
+            for term in any_of:
+                either |= self.genre(term)
+            out &= either
+        for term in none_of:
+            out &= ~self.genre(term)
+        return out
+
+
+_lock = threading.Lock()
+_bitmaps = None
+
+
+def get_bitmap_index(db, movies=None):
+    """Return the process-wide MovieBitmaps, kept in step with the catalog version.
+
+    `movies` is the FeatureCache movie list when the server keeps one;
+    otherwise the catalog is streamed from SQLite.
+    """
+    global _bitmaps
+    version = get_catalog_version(db)
+    bitmaps = _bitmaps
+    if bitmaps is not None and version is not None and bitmaps.version == version:
+        return bitmaps
+    with _lock:
+        bitmaps = _bitmaps
+        if bitmaps is not None and version is not None and bitmaps.version == version:
+            return bitmaps
+        changed = None
+        if bitmaps is not None:
+            changed = changed_rowids(db, bitmaps.version, version, bitmaps.watermark)
+        if changed is not None:
+            current = load_movie_features(db, changed)
+            bitmaps = bitmaps.update(changed, [current[r] for r in changed if r in current], version)
+        else:
+            bitmaps = MovieBitmaps.build(
+                (lambda: movies) if movies is not None else (lambda: iter_movie_features(db)), version)
+        _bitmaps = bitmaps
+        return bitmaps
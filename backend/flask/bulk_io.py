@@ -0,0 +1,218 @@
+# bulk_io.py - NDJSON import and export of user data
+#
+# Migrating users from another system used to mean replaying one
+# /user/watchlist, /movies/<id>/feedback or /user/preferences call, and one
+# commit, per item.  POST /users/import takes the same data as a stream of
+# JSON lines instead:
+#
+#   {"type": "watchlist", "user_id": "u1", "movie_id": 42}
+#   {"type": "seen", "user_id": "u1", "movie_id": 42}
+#   {"type": "feedback", "user_id": "u1", "movie_id": 42, "rating": 4, "text": "...", "created_at": 1700000000.0}
+#   {"type": "preferences", "user_id": "u1", "preferences": {"movies": [], "genres": [], "directors": [], "actors": []}}
+#
+# A preferences line carries the whole users_preferences blob, written and
+# exported as-is: besides the lists /user/preferences saves it may hold
+# favorites, exclude and the /users/<id>/settings keys.
+#
+# watchlist and seen lines go to the title lists (profile_store.py) and may
+# give a "movie" title in place of, or as well as, the movie_id.  Every
+# movie_id is checked against the catalog rowids, loaded once per import.
+# Valid lines are written with executemany, `batch_rows` lines per
+# transaction; invalid ones are skipped and reported by line number.
+# GET /users/export streams the same format.
+#
+# Derived state is updated once per batch rather than per line:
+# - each touched user's user_affinity row is dropped (rebuilt on next use);
+# - their recommendation versions are bumped (rec_cache.py);
+# - users with title-list lines get a new user_store_versions version.
+# Imported ratings are folded into the CF model by one item_cf.build() at
+# the end.
+import json
+import sqlite3
+import time
+
+import item_cf
+from profile_store import SEEN, WATCHLIST, title_key
+from rec_cache import bump_user_version
+from user_context import parse_preferences
+
+TYPES = ('watchlist', 'seen', 'feedback', 'preferences')
+PREFERENCE_KEYS = ('movies', 'genres', 'directors', 'actors')
+
+
+def normalize_preferences(prefs):
+    """The stored form of a preferences blob: every list present, nothing else."""
+    return {k: prefs.get(k) or [] for k in PREFERENCE_KEYS}
+
+
+def load_movie_titles(db):
+    """{rowid: movie_title} of the whole catalog, the ID set imports validate against."""
+    return dict(db.execute('SELECT rowid, movie_title FROM movies_flat'))
+
+
+def _timestamp(item, key, default):
+    value = item.get(key, default)
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise ValueError(f'{key} must be a timestamp')
+    return value
+
+
+def parse_line(line, movie_titles, now):
+    """(type, row to write) for one JSON line; raises ValueError with the reason."""
+    try:
+        item = json.loads(line)
+    except ValueError:
+        raise ValueError('invalid JSON')
+    if not isinstance(item, dict):
+        raise ValueError('expected a JSON object')
+    kind = item.get('type')
+    if kind not in TYPES:
+        raise ValueError(f"type must be one of {', '.join(TYPES)}")
+    user_id = item.get('user_id')
+    if not isinstance(user_id, str) or not user_id.strip():
+        raise ValueError('user_id required')
+
+    if kind == 'preferences':
+        prefs = item.get('preferences')
+        if not isinstance(prefs, dict):
+            raise ValueError('preferences must be an object')
+        return kind, (user_id, json.dumps(prefs), now)
+
+    movie_id = item.get('movie_id')
+    if movie_id is not None and (not isinstance(movie_id, int) or isinstance(movie_id, bool)
+                                 or movie_id not in movie_titles):
+        raise ValueError(f'unknown movie_id {movie_id!r}')
+    if kind == 'feedback':
+        if movie_id is None:
+            raise ValueError('movie_id required')
+        rating, text = item.get('rating'), item.get('text')
+        if rating is not None and item_cf.to_rating(rating) is None:
+            raise ValueError('rating must be a number')
+        if text is not None and not isinstance(text, str):
+            raise ValueError('text must be a string')
+        return kind, (user_id, movie_id, movie_titles[movie_id], rating, text,
+                       _timestamp(item, 'created_at', now))
+
+    title = item.get('movie')
+    if title is None and movie_id is not None:
+        title = movie_titles[movie_id]
+    if not isinstance(title, str) or not title_key(title):
+        raise ValueError('movie_id or movie required')
+    list_name = WATCHLIST if kind == 'watchlist' else SEEN
+    return kind, (user_id, list_name, title_key(title), title, _timestamp(item, 'added_at', now))
+
+
+def write_batch(db, rows, now):
+    """Write parsed lines ({type: [row]}) and invalidate what derives from them (no commit)."""
+    titles = rows['watchlist'] + rows['seen']
+    db.executemany('INSERT OR IGNORE INTO user_titles (user_id, list_name, title_key, title, added_at) '
+                   'VALUES (?, ?, ?, ?, ?)', titles)
+    db.executemany(
+        'INSERT INTO users_feedback (user_id, movie_rowid, movie_title, rating, text, created_at) VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT(user_id, movie_rowid) DO UPDATE SET rating=excluded.rating, text=excluded.text, '
+        'created_at=excluded.created_at', rows['feedback'])
+    db.executemany(
+        'INSERT INTO users_preferences (user_id, preferences_json, updated_at) VALUES (?, ?, ?) '
+        'ON CONFLICT(user_id) DO UPDATE SET preferences_json=excluded.preferences_json, updated_at=excluded.updated_at',
+        rows['preferences'])
+
+    users = sorted({r[0] for kind_rows in rows.values() for r in kind_rows})
+    db.executemany('INSERT OR IGNORE INTO users_basic (user_id, created_at) VALUES (?, ?)', [(u, now) for u in users])
+    db.executemany('DELETE FROM user_affinity WHERE user_id = ?', [(u,) for u in users])
+    for user_id in users:
+        bump_user_version(db, user_id, prefs=True, activity=True)
+    db.executemany('INSERT INTO user_store_versions (user_id, version) VALUES (?, 1) '
+                   'ON CONFLICT(user_id) DO UPDATE SET version = version + 1',
+                   [(u,) for u in sorted({r[0] for r in titles})])
+    return users
+
+
+def import_ndjson(db, lines, movie_titles, batch_rows=10000, max_errors=1000, cf_neighbours=50):
+    """Import JSON lines (str or bytes) into `db`; returns the report for the response.
+
+    Commits every `batch_rows` valid lines.  At most `max_errors` errors are
+    listed; error_count has them all.
+    """
+    now = time.time()
+    report = {'lines': 0, 'imported': dict.fromkeys(TYPES, 0), 'users': 0, 'error_count': 0, 'errors': []}
+    users = set()
+
+    def error(line_numbers, reason):
+        for n in line_numbers:
+            report['error_count'] += 1
+            if len(report['errors']) < max_errors:
+                report['errors'].append({'line': n, 'error': reason})
+
+    def flush(batch):
+        rows = {kind: [row for _, k, row in batch if k == kind] for kind in TYPES}
+        try:
+            touched = write_batch(db, rows, now)
+            db.commit()
+        except sqlite3.Error as e:
+            db.rollback()
+            error([n for n, _, _ in batch], f'write failed: {e}')
+            return
+        users.update(touched)
+        for kind in TYPES:
+            report['imported'][kind] += len(rows[kind])
+
+    batch = []
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        if not line.strip():
+            continue
+        report['lines'] += 1
+        try:
+            kind, row = parse_line(line, movie_titles, now)
+        except ValueError as e:
+            error([number], str(e))
+            continue
+        batch.append((number, kind, row))
+        if len(batch) >= batch_rows:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    if report['imported']['feedback']:
+        # one rebuild instead of an incremental update per rating
+        item_cf.build(db, cf_neighbours)
+    report['users'] = len(users)
+    return report
+
+
+def export_ndjson(db, types=TYPES, user_id=None, chunk_size=1000):
+    """Yield the user data as JSON lines in the format import_ndjson reads."""
+    user_clause, user_params = ('user_id = ?', (user_id,)) if user_id else ('1', ())
+
+    def rows(sql, params=()):
+        cur = db.execute(sql, params + user_params)
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk:
+                return
+            yield from chunk
+
+    for list_name in (WATCHLIST, SEEN):
+        if list_name not in types:
+            continue
+        # movie_id of the first catalog movie with the title, when there is one
+        for uid, title, added_at, movie_id in rows(
+                'SELECT user_id, title, added_at, (SELECT MIN(rowid) FROM movies_flat WHERE movie_title_lower = t.title_key) '
+                f'FROM user_titles t WHERE list_name = ? AND {user_clause} ORDER BY user_id, added_at, rowid',
+                (list_name,)):
+            item = {'type': list_name, 'user_id': uid, 'movie': title, 'added_at': added_at}
+            if movie_id is not None:
+                item['movie_id'] = movie_id
+            yield json.dumps(item) + '\n'
+    if 'feedback' in types:
+        for uid, movie_id, rating, text, created_at in rows(
+                'SELECT user_id, movie_rowid, rating, text, created_at FROM users_feedback '
+                f'WHERE user_id IS NOT NULL AND {user_clause} ORDER BY user_id, movie_rowid'):
+            yield json.dumps({'type': 'feedback', 'user_id': uid, 'movie_id': movie_id, 'rating': rating,
+                              'text': text, 'created_at': created_at}) + '\n'
+    if 'preferences' in types:
+        for uid, prefs_json in rows(
+                f'SELECT user_id, preferences_json FROM users_preferences WHERE {user_clause} ORDER BY user_id'):
+            yield json.dumps({'type': 'preferences', 'user_id': uid, 'preferences': parse_preferences(prefs_json)}) + '\n'
@@ -0,0 +1,178 @@
+# catalog.py - catalog version tracking shared by the API and admin processes
+#
+# movies_flat is written by admin.py (port 5001), by import_sqlite.py and by
+# tests, while server.py keeps in-memory structures derived from it.  Its
+# schema is created here (ensure_movies_table) for both the API and the
+# importer.  Triggers
+# on movies_flat bump a single-row counter table so any process can cheaply
+# tell whether its derived structures are stale.
+#
+# The same triggers append the rowid of every inserted, updated or deleted
+# movie to catalog_changes, a change log.  A process holding structures built
+# at an older version reads the rowids changed since then (changed_rowids),
+# re-reads just those rows and patches its structures in place of a rebuild.
+# The log keeps the last CHANGES_KEPT entries; a process that falls further
+# behind rebuilds.
+
+MOVIES_TABLE = "movies_flat"
+
+# catalog_changes entries kept; older ones are pruned as new ones arrive
+CHANGES_KEPT = 100000
+
+# the movies_flat triggers created by ensure_catalog_state
+CATALOG_TRIGGERS = tuple(f'{MOVIES_TABLE}_{kind}_{event}' for kind in ('version', 'changes') for event in ('ai', 'au', 'ad'))
+
+
+def ensure_movies_table(cur):
+    """Create movies_flat and its indexes if missing."""
+    cur.execute(f'''
+        CREATE TABLE IF NOT EXISTS {MOVIES_TABLE} (
+            rowid INTEGER PRIMARY KEY,
+            director_name TEXT,
+            actor_1_name TEXT,
+            actor_2_name TEXT,
+            actor_3_name TEXT,
+            genres TEXT,
+            movie_title TEXT,
+            tags TEXT,
+            movie_title_lower TEXT,
+            synopsis TEXT,
+            rating REAL,
+            platforms TEXT
+        )
+    ''')
+    # favourite-title lookups (two-stage recommendation candidates)
+    cur.execute(f'CREATE INDEX IF NOT EXISTS idx_movies_flat_title_lower ON {MOVIES_TABLE}(movie_title_lower)')
+
+
+def ensure_catalog_state(cur):
+    """Create the catalog_state row, the catalog_changes log and the movies_flat triggers.
+
+    `version` changes on every insert/update/delete; `rewrite_version` only on
+    updates and deletes.  Every change also logs the movie's rowid (both
+    rowids when an update changes it) to catalog_changes.
+    """
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            instance_id TEXT,
+            version INTEGER NOT NULL DEFAULT 0,
+            rewrite_version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cur.execute(
+        "INSERT OR IGNORE INTO catalog_state (id, instance_id, version, rewrite_version) "
+        "VALUES (1, lower(hex(randomblob(8))), 0, 0)"
+    )
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {MOVIES_TABLE}_version_ai AFTER INSERT ON {MOVIES_TABLE}
+        BEGIN
+            UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+        END
+    ''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {MOVIES_TABLE}_version_au AFTER UPDATE ON {MOVIES_TABLE}
+        BEGIN
+            UPDATE catalog_state SET version = version + 1, rewrite_version = rewrite_version + 1 WHERE id = 1;
+        END
+    ''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {MOVIES_TABLE}_version_ad AFTER DELETE ON {MOVIES_TABLE}
+        BEGIN
+            UPDATE catalog_state SET version = version + 1, rewrite_version = rewrite_version + 1 WHERE id = 1;
+        END
+    ''')
+    # AUTOINCREMENT: change ids are never reused, so a gap means pruned entries
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            movie_rowid INTEGER NOT NULL,
+            changed_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+        )
+    ''')
+    for suffix, event, entries in (
+        ('ai', 'INSERT', [("'I'", 'NEW.rowid', '')]),
+        ('au', 'UPDATE', [("'U'", 'OLD.rowid', ''), ("'U'", 'NEW.rowid', ' WHERE NEW.rowid != OLD.rowid')]),
+        ('ad', 'DELETE', [("'D'", 'OLD.rowid', '')]),
+    ):
+        body = ''.join(f"INSERT INTO catalog_changes (op, movie_rowid) SELECT {op}, {rowid}{where}; "
+                       for op, rowid, where in entries)
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {MOVIES_TABLE}_changes_{suffix} AFTER {event} ON {MOVIES_TABLE}
+            BEGIN
+                {body}
+            END
+        ''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS catalog_changes_prune AFTER INSERT ON catalog_changes
+        WHEN NEW.change_id % 1000 = 0
+        BEGIN
+            DELETE FROM catalog_changes WHERE change_id <= NEW.change_id - {CHANGES_KEPT};
+        END
+    ''')
+
+
+def begin_bulk_load(cur):
+    """Drop the movies_flat triggers before rewriting the whole table in the current transaction.
+
+    A bulk load would otherwise bump the version and log a change per row.
+    Call end_bulk_load() in the same transaction.
+    """
+    for name in CATALOG_TRIGGERS:
+        cur.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def end_bulk_load(cur):
+    """Recreate the triggers and give the catalog a new instance_id.
+
+    Nothing was logged for the rewritten rows, so every process must rebuild
+    what it derived from the old catalog, as it does for a swapped database.
+    """
+    ensure_catalog_state(cur)
+    cur.execute('UPDATE catalog_state SET instance_id = lower(hex(randomblob(8))), version = version + 1, '
+                'rewrite_version = rewrite_version + 1 WHERE id = 1')
+
+
+def get_catalog_version(db):
+    """Return (instance_id, version, rewrite_version, last_change_id) for the catalog in `db`.
+
+    instance_id is random per database file, so a swapped or re-imported
+    database never looks like the same catalog.  last_change_id is the
+    newest catalog_changes entry (0 when empty).  Returns None when the state
+    tables are missing (schema not initialized yet).
+    """
+    try:
+        row = db.execute(
+            'SELECT instance_id, version, rewrite_version, '
+            '(SELECT COALESCE(MAX(change_id), 0) FROM catalog_changes) FROM catalog_state WHERE id = 1'
+        ).fetchone()
+    except Exception:
+        return None
+    if not row:
+        return None
+    return (row[0], row[1], row[2], row[3])
+
+
+def changed_rowids(db, prev, version, size=0):
+    """Sorted rowids inserted, updated or deleted between catalog versions `prev` and `version`.
+
+    Returns None when a structure built at `prev` has to be rebuilt instead:
+    no previous version, a different database, log entries already pruned,
+    or more rowids changed than half the structure's `size` (at least
+    1000): a bulk rewrite is cheaper to reload than to patch.
+    """
+    limit = max(1000, size // 2)
+    if prev is None or version is None or prev[0] != version[0]:
+        return None
+    since, until = prev[3], version[3]
+    if until < since:
+        return None
+    count = db.execute('SELECT COUNT(*) FROM catalog_changes WHERE change_id > ? AND change_id <= ?',
+                       (since, until)).fetchone()[0]
+    if count != until - since:
+        return None
+    rowids = [r[0] for r in db.execute(
+        'SELECT DISTINCT movie_rowid FROM catalog_changes WHERE change_id > ? AND change_id <= ? '
+        'ORDER BY movie_rowid LIMIT ?', (since, until, limit + 1))]
+    return rowids if len(rowids) <= limit else None
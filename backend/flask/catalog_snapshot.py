@@ -0,0 +1,334 @@
+# catalog_snapshot.py - immutable in-memory copy of movies_flat for the read endpoints
+#
+# /movie, /movies/<id>, /directors/movies, /search and /movies/search used to
+# query movies_flat on every request, turn each sqlite3.Row into a dict with
+# row_to_dict and then copy that dict again before enrichment.
+# CatalogSnapshot holds the whole table column by column: one list per
+# column, in rowid order, with every string interned so that a director or
+# genre string shared by many movies is stored once.  The lookup maps
+# (rowid -> position, normalized title -> position) and the normalized keys
+# the search filters match on are built at load time.  A request therefore
+# runs no SQL against movies_flat and allocates one dict per movie it returns.
+#
+# Like features.get_feature_cache, the snapshot is replaced, never modified.
+# get_catalog_snapshot() builds a new one when the catalog version
+# (catalog.get_catalog_version) changes and swaps it in with one assignment,
+# so a request keeps the snapshot it started with.  A new version copies the
+# old columns and re-reads only the rows changed since (catalog_changes, see
+# catalog.py): updated rows are overwritten at their position, deleted ones
+# become dead positions, appended ones are added at the end.  A bulk
+# rewrite, or more dead than live positions, reloads.  bench_catalog.py
+# reports the memory used per 100k movies.
+import itertools
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+from catalog import MOVIES_TABLE, changed_rowids, get_catalog_version
+from features import SPLIT_RE
+
+# columns with normalized (stripped, lowercased) keys for the filters below;
+# other columns (tags) are lowercased while matching rather than stored twice
+KEY_COLUMNS = ('movie_title', 'director_name', 'actor_1_name', 'actor_2_name', 'actor_3_name')
+ACTOR_COLUMNS = ('actor_1_name', 'actor_2_name', 'actor_3_name')
+
+
+def _intern(value):
+    return sys.intern(value) if value.__class__ is str else value
+
+
+def _key(value):
+    if value.__class__ is not str:
+        return None
+    key = value.strip().lower()
+    # most tags and many titles are stored normalized already: share the string
+    return value if key == value else sys.intern(key)
+
+
+class Contains:
+    """Any of `columns` contains `term`, case-insensitively (LOWER(col) LIKE '%term%')."""
+    __slots__ = ('columns', 'term')
+
+    def __init__(self, columns, term):
+        self.columns = tuple(columns)
+        self.term = term.strip().lower()
+
+    def sql(self):
+        clause = ' OR '.join(f"LOWER({c}) LIKE ?" for c in self.columns)
+        return (f"({clause})" if len(self.columns) > 1 else clause), [f"%{self.term}%"] * len(self.columns)
+
+    def matcher(self, snapshot):
+        term, columns = self.term, [snapshot.key_column(c) for c in self.columns]
+        if not term:
+            # LIKE '%%' matches every non-NULL value
+            return lambda pos: any(keys[pos] is not None for keys in columns)
+        if len(columns) == 1:
+            keys = columns[0]
+            return lambda pos: term in (keys[pos] or '')
+        return lambda pos: any(term in (keys[pos] or '') for keys in columns)
+
+
+class Equals:
+    """`column`, stripped and lowercased, equals `value` (LOWER(TRIM(col)) = ?)."""
+    __slots__ = ('column', 'value')
+
+    def __init__(self, column, value):
+        self.column = column
+        self.value = value.strip().lower()
+
+    def sql(self):
+        return f"LOWER(TRIM({self.column})) = ?", [self.value]
+
+    def matcher(self, snapshot):
+        keys, value = snapshot.key_column(self.column), self.value
+        return lambda pos: keys[pos] == value
+
+
+class Excludes:
+    """None of `columns`, stripped and lowercased, is in `values` (NULL counts as '')."""
+    __slots__ = ('columns', 'values', '_set')
+
+    def __init__(self, columns, values):
+        self.columns = tuple(columns)
+        self.values = sorted({v.strip().lower() for v in values if v and v.strip()})
+        self._set = frozenset(self.values)
+
+    def sql(self):
+        marks = ','.join('?' * len(self.values))
+        return (' AND '.join(f"LOWER(TRIM(COALESCE({c}, ''))) NOT IN ({marks})" for c in self.columns),
+                self.values * len(self.columns))
+
+    def matcher(self, snapshot):
+        excluded, columns = self._set, [snapshot.key_column(c) for c in self.columns]
+        return lambda pos: not any((keys[pos] or '') in excluded for keys in columns)
+
+
+class _KeyView:
+    """Normalized values of a column without keys, computed per access."""
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, pos):
+        value = self.values[pos]
+        return value.strip().lower() if value.__class__ is str else None
+
+
+class CatalogSnapshot:
+    """movies_flat in rowid order, one list per column; never modified once built.
+
+    `columns` are the movies_flat column names (SELECT * order) and
+    `values[i]` the list of column i.  `keys` maps each KEY_COLUMNS column to
+    its normalized values (None for NULL).  Positions in `dead` are deleted
+    movies: all their values are None and by_rowid does not list them.
+    """
+    __slots__ = ('version', 'columns', 'rowids', 'values', 'keys', 'by_rowid', 'by_title', 'watermark', 'dead',
+                 '_options')
+
+    def __init__(self, columns, rows, version, base=None):
+        """`rows` are (rowid, *values) tuples in rowid order, appended to `base` if given."""
+        self.version = version
+        self.columns = tuple(columns)
+        if base is not None:
+            self.rowids = array('q', base.rowids)
+            self.values = [list(col) for col in base.values]
+            self.keys = {c: list(col) for c, col in base.keys.items()}
+            self.by_rowid = dict(base.by_rowid)
+            self.by_title = dict(base.by_title)
+            self.dead = base.dead
+        else:
+            self.rowids = array('q')
+            self.values = [[] for _ in self.columns]
+            self.keys = {c: [] for c in KEY_COLUMNS if c in self.columns}
+            self.by_rowid = {}
+            self.by_title = {}
+            self.dead = frozenset()
+        start = len(self.rowids)
+        # column by column: (rowid, *values) rows transposed
+        added = list(zip(*rows)) or [()] * (len(self.columns) + 1)
+        self.rowids.extend(added[0])
+        self.by_rowid.update(zip(added[0], range(start, len(self.rowids))))
+        for name, col, new in zip(self.columns, self.values, added[1:]):
+            col.extend(map(_intern, new))
+            if name in self.keys:
+                self.keys[name].extend(map(_key, col[start:]))
+        if 'movie_title' in self.keys:
+            titles = self.keys['movie_title']
+            for pos in range(start, len(titles)):
+                self.by_title.setdefault(titles[pos], pos)
+        self.by_title.pop(None, None)
+        self.watermark = self.rowids[-1] if self.rowids else 0
+        self._options = None
+
+    def __len__(self):
+        return len(self.rowids) - len(self.dead)
+
+    def patched(self, changed, rows, version):
+        """Copy with the `changed` rowids (sorted) set from `rows`, their current (rowid, *values).
+
+        Changed rowids missing from `rows` were deleted.  Returns None when a
+        row has no place: inserted below the last rowid at a rowid never seen.
+        """
+        rows = {r[0]: r for r in rows}
+        snapshot = CatalogSnapshot(self.columns, [rows[r] for r in changed if r > self.watermark and r in rows],
+                                   version, base=self)
+        dead, titles, retitled = set(self.dead), snapshot.keys.get('movie_title'), set()
+        for rowid in changed:
+            if rowid > self.watermark:
+                continue
+            pos = bisect_left(snapshot.rowids, rowid)
+            if pos == len(snapshot.rowids) or snapshot.rowids[pos] != rowid:
+                if rowid in rows:
+                    return None
+                continue
+            row = rows.get(rowid)
+            if row is None:
+                dead.add(pos)
+                snapshot.by_rowid.pop(rowid, None)
+                row = (rowid,) + (None,) * len(self.columns)
+            else:
+                dead.discard(pos)
+                snapshot.by_rowid[rowid] = pos
+            if titles is not None:
+                retitled.add(titles[pos])
+            for name, col, value in zip(self.columns, snapshot.values, row[1:]):
+                col[pos] = _intern(value)
+                if name in snapshot.keys:
+                    snapshot.keys[name][pos] = _key(col[pos])
+            if titles is not None:
+                retitled.add(titles[pos])
+        # the first live movie with each title that moved, in one pass
+        retitled.discard(None)
+        first = {}
+        if retitled:
+            for pos, key in enumerate(titles):
+                if key in retitled and key not in first:
+                    first[key] = pos
+                    if len(first) == len(retitled):
+                        break
+        for key in retitled:
+            if key in first:
+                snapshot.by_title[key] = first[key]
+            else:
+                snapshot.by_title.pop(key, None)
+        snapshot.dead = frozenset(dead)
+        return snapshot
+
+    def movie(self, pos, id_key=None):
+        """A new dict of the movie at `pos`, like row_to_dict of `SELECT rowid AS <id_key>, *`."""
+        movie = {id_key: self.rowids[pos]} if id_key else {}
+        for name, col in zip(self.columns, self.values):
+            movie[name] = col[pos]
+        return movie
+
+    def key_column(self, name):
+        """Normalized values of column `name` (None for NULL), computed if not kept in `keys`."""
+        keys = self.keys.get(name)
+        if keys is None:
+            keys = _KeyView(self.values[self.columns.index(name)])
+        return keys
+
+    def positions(self, rowids):
+        """Positions of the `rowids` present in the snapshot, in the given order."""
+        by_rowid = self.by_rowid
+        return [by_rowid[r] for r in rowids if r in by_rowid]
+
+    def find(self, filters, limit, positions=None):
+        """Up to `limit` positions, in rowid (or `positions`) order, matching every filter."""
+        if positions is None:
+            positions = range(len(self.rowids))
+            if self.dead:
+                positions = (pos for pos in positions if pos not in self.dead)
+        matchers = [f.matcher(self) for f in filters]
+        if len(matchers) == 1:
+            positions = filter(matchers[0], positions)
+        elif matchers:
+            positions = (pos for pos in positions if all(m(pos) for m in matchers))
+        return list(itertools.islice(positions, max(limit, 0)))
+
+    def find_title(self, title):
+        """Position of the first movie titled `title` (normalized), else the first containing it."""
+        key = title.strip().lower()
+        pos = self.by_title.get(key)
+        if pos is None:
+            found = self.find([Contains(('movie_title',), key)], 1)
+            pos = found[0] if found else None
+        return pos
+
+    def options(self):
+        """The distinct movies, directors, actors and genres listed by /catalog/options."""
+        if self._options is None:
+            def column(name):
+                return self.values[self.columns.index(name)] if name in self.columns else []
+            actors = set()
+            for name in ACTOR_COLUMNS:
+                actors.update(v for v in column(name) if v)
+            genres = set()
+            for value in column('genres'):
+                if value:
+                    genres.update(t.strip() for t in SPLIT_RE.split(value) if t.strip())
+            # built at most a few times per snapshot; all builds are equal
+            self._options = {
+                'movies': sorted({v for v in column('movie_title') if v is not None}),
+                'directors': sorted({v for v in column('director_name') if v}),
+                'actors': sorted(actors),
+                'genres': sorted(genres),
+            }
+        return self._options
+
+
+def load_catalog_snapshot(db, version=None):
+    """Read movies_flat into a new snapshot."""
+    cur = db.execute(f"SELECT rowid AS _rowid, * FROM {MOVIES_TABLE} ORDER BY rowid")
+    return CatalogSnapshot([d[0] for d in cur.description][1:], cur, version)
+
+
+def update_catalog_snapshot(db, snapshot, changed, version):
+    """`snapshot` patched with the current rows of the `changed` rowids; None if it must be reloaded."""
+    rows = []
+    for i in range(0, len(changed), 500):
+        chunk = changed[i:i + 500]
+        cur = db.execute(f"SELECT rowid AS _rowid, * FROM {MOVIES_TABLE} WHERE rowid IN ({','.join('?' * len(chunk))})",
+                         chunk)
+        if tuple(d[0] for d in cur.description[1:]) != snapshot.columns:
+            return None  # the table was altered
+        rows.extend(cur)
+    patched = snapshot.patched(changed, rows, version)
+    if patched is not None and len(patched.dead) > len(patched):
+        return None
+    return patched
+
+
+_lock = threading.Lock()
+_current = (None, None)  # (catalog version, snapshot or None when too large)
+
+
+def get_catalog_snapshot(db, max_movies=None):
+    """Return the process-wide CatalogSnapshot, replaced if the catalog changed.
+
+    Returns None when the catalog has more than `max_movies` rows (MAX(rowid)
+    as the estimate); callers then query SQLite.  The only query made while
+    the catalog is unchanged is the catalog version check.
+    """
+    global _current
+    version = get_catalog_version(db)
+    prev, snapshot = _current
+    if version is not None and prev == version:
+        return snapshot
+    with _lock:
+        prev, snapshot = _current
+        if version is not None and prev == version:
+            return snapshot
+        size = db.execute(f"SELECT MAX(rowid) FROM {MOVIES_TABLE}").fetchone()[0] or 0
+        if max_movies is not None and size > max_movies:
+            snapshot = None
+        else:
+            changed = changed_rowids(db, prev, version, len(snapshot)) if snapshot is not None else None
+            if changed is not None:
+                snapshot = update_catalog_snapshot(db, snapshot, changed, version)
+            if snapshot is None or changed is None:
+                snapshot = load_catalog_snapshot(db, version)
+        _current = (version, snapshot)
+        return snapshot
@@ -0,0 +1,199 @@
+# cold_start.py - precomputed top lists for users with too little signal
+#
+# Usage:
+#   python cold_start.py                    # rebuild the lists in movies.db
+#   python cold_start.py --db other.db --size 200
+#
+# A user with no preferences, ratings or learned weights has nothing the
+# recommenders can score against.  Instead of scanning the catalog for them,
+# build() ranks every movie that has evidence once: a Bayesian average of its
+# users_feedback ratings, shrunk towards a prior of PRIOR_WEIGHT ratings at
+# the movie's stored external score (movies_flat.rating, IMDb-style 0-10,
+# when the column exists) or else at the global mean rating.  It stores the
+# global top list plus one list per genre token in cold_start_lists, each as
+# a packed array of rowids.
+#
+# The server keeps the lists in memory (reloaded when a rebuild lands) and
+# rebuilds them on a background thread once they are older than max_age.
+import argparse
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from catalog import MOVIES_TABLE
+from features import load_movie_features
+from item_cf import to_rating
+
+logger = logging.getLogger(__name__)
+
+# weight, in ratings, of the prior each movie's average is shrunk towards
+PRIOR_WEIGHT = 5.0
+# movies kept per list
+LIST_SIZE = 100
+GLOBAL_LIST = '*'
+
+
+def ensure_cold_start_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS cold_start_lists (
+            list_key TEXT PRIMARY KEY,
+            built_at REAL,
+            rowids BLOB
+        )
+    ''')
+
+
+def pack(rowids):
+    return array('q', rowids).tobytes()
+
+
+def unpack(blob):
+    out = array('q')
+    out.frombytes(blob or b'')
+    return out.tolist()
+
+
+def _external_scores(conn):
+    """{rowid: score on the 1-5 rating scale} from movies_flat.rating, if the column exists."""
+    columns = {r[1] for r in conn.execute(f'PRAGMA table_info({MOVIES_TABLE})')}
+    if 'rating' not in columns:
+        return {}
+    out = {}
+    for rowid, rating in conn.execute(f'SELECT rowid, rating FROM {MOVIES_TABLE} WHERE rating IS NOT NULL'):
+        rating = to_rating(rating)
+        if rating is not None and rating > 0:
+            out[rowid] = min(rating, 10.0) / 2.0
+    return out
+
+
+def movie_scores(conn, prior_weight=PRIOR_WEIGHT):
+    """{rowid: Bayesian-average score} for every movie with ratings or an external score."""
+    counts, sums = defaultdict(int), defaultdict(float)
+    for movie_rowid, rating in conn.execute('SELECT movie_rowid, rating FROM users_feedback WHERE rating IS NOT NULL'):
+        rating = to_rating(rating)
+        if rating is not None:
+            counts[movie_rowid] += 1
+            sums[movie_rowid] += rating
+    external = _external_scores(conn)
+    total = sum(counts.values())
+    mean = sum(sums.values()) / total if total else 3.0
+    scores = {}
+    for rowid in set(counts) | set(external):
+        prior = external.get(rowid, mean)
+        scores[rowid] = (prior_weight * prior + sums[rowid]) / (prior_weight + counts[rowid])
+    return scores
+
+
+def build(conn, size=LIST_SIZE, prior_weight=PRIOR_WEIGHT):
+    """Rebuild every list; returns the number of lists written."""
+    scores = movie_scores(conn, prior_weight)
+    movies = load_movie_features(conn, scores)
+    ranked = sorted((rowid for rowid in scores if rowid in movies), key=lambda r: (-scores[r], r))
+    lists = {GLOBAL_LIST: ranked[:size]}
+    by_genre = defaultdict(list)
+    for rowid in ranked:  # best first, so each genre list is already ordered
+        for genre in movies[rowid].genres:
+            if len(by_genre[genre]) < size:
+                by_genre[genre].append(rowid)
+    lists.update(by_genre)
+    now = time.time()
+    with conn:
+        conn.execute('DELETE FROM cold_start_lists')
+        conn.executemany('INSERT INTO cold_start_lists (list_key, built_at, rowids) VALUES (?, ?, ?)',
+                         [(key, now, pack(ids)) for key, ids in lists.items()])
+    return len(lists)
+
+
+class ColdStartLists:
+    """Immutable in-memory copy of cold_start_lists."""
+
+    def __init__(self, lists, built_at):
+        self.lists, self.built_at = lists, built_at
+
+    def top(self, n, genres=(), exclude=()):
+        """Best `n` rowids: the lists of `genres` interleaved (best first), or the global list."""
+        sources = [self.lists[g] for g in sorted(genres) if g in self.lists] if genres else \
+            [self.lists.get(GLOBAL_LIST, [])]
+        merged, seen = [], set()
+        for rowid in (r for rank in _interleave(sources) for r in rank):
+            if rowid not in seen and str(rowid) not in exclude:
+                seen.add(rowid)
+                merged.append(rowid)
+                if len(merged) == n:
+                    break
+        return merged
+
+
+def _interleave(sources):
+    """Rank-by-rank tuples across the lists: (a[0], b[0]), (a[1], b[1]), ..."""
+    for i in range(max((len(s) for s in sources), default=0)):
+        yield tuple(s[i] for s in sources if i < len(s))
+
+
+_lock = threading.Lock()
+_lists = None
+_building = False
+
+
+def get_lists(conn):
+    """The current lists, reloaded when a newer build is in the table."""
+    global _lists
+    row = conn.execute('SELECT MAX(built_at) FROM cold_start_lists').fetchone()
+    built_at = row[0] if row else None
+    lists = _lists
+    if lists is not None and lists.built_at == built_at:
+        return lists
+    with _lock:
+        loaded = {key: unpack(blob) for key, blob in conn.execute('SELECT list_key, rowids FROM cold_start_lists')}
+        _lists = ColdStartLists(loaded, built_at)
+        return _lists
+
+
+def refresh_if_stale(db_path, built_at, max_age):
+    """Rebuild on a background thread when the lists are missing or older than max_age."""
+    global _building
+    if built_at is not None and time.time() - built_at < max_age:
+        return False
+    with _lock:
+        if _building:
+            return False
+        _building = True
+
+    def run():
+        global _building
+        try:
+            conn = sqlite3.connect(db_path)
+            conn.row_factory = sqlite3.Row
+            try:
+                ensure_cold_start_schema(conn.cursor())
+                build(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error('Cold-start list rebuild failed: %s', e)
+        finally:
+            _building = False
+
+    threading.Thread(target=run, name='cold-start-build', daemon=True).start()
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the cold-start recommendation lists')
+    parser.add_argument('--db', default='movies.db')
+    parser.add_argument('--size', type=int, default=LIST_SIZE, help='movies kept per list')
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    ensure_cold_start_schema(conn.cursor())
+    start = time.perf_counter()
+    n = build(conn, args.size)
+    print(f"cold start: {n} lists in {time.perf_counter() - start:.2f}s")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# database.py - shared SQLite connections for server.py and admin.py
+#
+# Both apps used to open a new connection for every request (admin.py for
+# every view) with SQLite's defaults: a rollback journal, so a write from the
+# admin process blocked every reader in the API process, and a cold page
+# cache on each connect.  connection() instead hands out one long-lived
+# connection per thread and database file, set up with:
+#
+#   journal_mode=WAL      readers and the writer no longer block each other
+#                         (recorded in the file, so every process gets it)
+#   synchronous=NORMAL    no fsync per commit; in WAL mode a power loss can
+#                         drop the last commits but never corrupts the file
+#   cache_size            page cache kept warm across requests
+#   mmap_size             reads served from a memory map of the file
+#   busy timeout          writers wait for the write lock instead of failing
+#                         with "database is locked"
+#
+# connection(path, readonly=True) is a second per-thread connection opened
+# with mode=ro for GET endpoints: it can never take the write lock, so reads
+# scale with the number of workers while a write is in progress.
+#
+# Connections outlive the request; release() at request teardown rolls back
+# anything a request left uncommitted, as closing the connection used to.
+# They do not outlive their thread: the development server runs every request
+# on a new thread, so a thread's connections are closed when it ends instead
+# of piling up (two file descriptors and a cache and memory map each).
+import atexit
+import os
+import sqlite3
+import threading
+import weakref
+from pathlib import Path
+
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536))
+SQLITE_MMAP_SIZE_MB = int(os.getenv('SQLITE_MMAP_SIZE_MB', 256))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+_local = threading.local()
+_open = {}  # every cached connection -> path, closed at exit so the WAL is checkpointed
+_open_lock = threading.Lock()
+
+
+def connect(path, readonly=False):
+    """A new tuned connection to the existing database file `path` (rows as sqlite3.Row)."""
+    uri = f"{Path(path).resolve().as_uri()}?mode={'ro' if readonly else 'rw'}"
+    # check_same_thread=False only so that close_all() can run from another
+    # thread; connection() never shares a connection between threads
+    conn = sqlite3.connect(uri, uri=True, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    if not readonly:
+        conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}')
+    return conn
+
+
+def _file_id(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def _close(conn):
+    with _open_lock:
+        path = _open.pop(conn, None)
+    try:
+        conn.close()
+    except Exception:
+        pass
+    if path is not None:
+        remove_orphaned_wal(path)
+
+
+def _close_each(conns):
+    for _, conn in list(conns.values()):
+        _close(conn)
+    conns.clear()
+
+
+class _ThreadConnections:
+    """One thread's connections, {(path, readonly): (file_id, conn)}, closed when the thread ends."""
+
+    def __init__(self):
+        self.conns = {}
+        # threading.local drops this object with its thread; the finalizer
+        # holds only the dict, not the object
+        weakref.finalize(self, _close_each, self.conns)
+
+
+def _thread_conns():
+    holder = getattr(_local, 'connections', None)
+    if holder is None:
+        holder = _local.connections = _ThreadConnections()
+    return holder.conns
+
+
+def connection(path, readonly=False):
+    """This thread's connection to `path`, opened on first use.
+
+    Reopened when the file has been replaced (a re-imported database);
+    raises RuntimeError when it does not exist.
+    """
+    file_id = _file_id(path)
+    if file_id is None:
+        raise RuntimeError(f"Database file not found: {path}. Create it first.")
+    conns = _thread_conns()
+    key = (path, readonly)
+    entry = conns.get(key)
+    if entry is not None and entry[0] == file_id:
+        return entry[1]
+    # drop this thread's connections to files that were removed or replaced
+    for other, (other_id, conn) in list(conns.items()):
+        if other == key or _file_id(other[0]) != other_id:
+            del conns[other]
+            _close(conn)
+    conn = connect(path, readonly)
+    conns[key] = (file_id, conn)
+    with _open_lock:
+        _open[conn] = path
+    return conn
+
+
+def remove_orphaned_wal(path):
+    """Delete the -wal and -shm files left beside a database file that was removed.
+
+    SQLite keeps them when the database is unlinked while connected; a stale
+    WAL must never be picked up by a new database created at the same path.
+    """
+    if _file_id(path) is not None:
+        return
+    for suffix in ('-wal', '-shm'):
+        try:
+            os.remove(f'{path}{suffix}')
+        except FileNotFoundError:
+            pass
+
+
+def release():
+    """Roll back whatever this thread's connections left uncommitted (request teardown)."""
+    for _, conn in _thread_conns().values():
+        if conn.in_transaction:
+            conn.rollback()
+
+
+@atexit.register
+def close_all():
+    with _open_lock:
+        conns = list(_open)
+    for conn in conns:
+        _close(conn)
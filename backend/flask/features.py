@@ -0,0 +1,249 @@
+# features.py - pre-tokenized per-movie features shared by the scoring loops
+#
+# /similar and both user recommenders used to run split_field (regex split +
+# lowercasing) over the director/actor/genre/tag columns of every candidate on
+# every request.  The FeatureCache below tokenizes each movie once into
+# interned frozensets and is refreshed only when the catalog version
+# (catalog.get_catalog_version) changes, so scoring is plain set intersection.
+# A refresh re-tokenizes only the rows logged in catalog_changes since.
+import heapq
+import re
+import sys
+import threading
+
+from catalog import MOVIES_TABLE, changed_rowids, get_catalog_version
+
+# separators for genres/tags/actor fields (handles spaces, '|', ',', ';', '/', '&', and the word 'and')
+SPLIT_RE = re.compile(r'(?:\s+|[|,;/&]|\band\b)', re.IGNORECASE)
+
+# user-preference weights per feature kind (see preference_score)
+PREFERENCE_WEIGHTS = {
+    'title': 6.0,
+    'director': 5.0,
+    'actor': 3.0,
+    'genre': 1.0,
+}
+
+FEATURE_COLUMNS = "rowid AS movie_id, movie_title, director_name, actor_1_name, actor_2_name, actor_3_name, genres, tags"
+
+
+def split_field(s):
+    if s is None:
+        return []
+    s = str(s).strip()
+    if s == "":
+        return []
+    return [part.strip().lower() for part in SPLIT_RE.split(s) if part.strip()]
+
+
+def _tokens(*values):
+    return frozenset(sys.intern(t) for v in values for t in split_field(v))
+
+
+class MovieFeatures:
+    """Tokenized view of one movies_flat row.
+
+    title is the raw movie_title (used for tie-breaking); title_key and
+    director are stripped + lowercased; the rest are frozensets of tokens.
+    """
+    __slots__ = ('rowid', 'title', 'title_key', 'director', 'actors', 'genres', 'tags')
+
+    def __init__(self, rowid, title, director, actor_1, actor_2, actor_3, genres, tags):
+        self.rowid = rowid
+        self.title = title
+        self.title_key = sys.intern((title or '').strip().lower())
+        self.director = sys.intern((director or '').strip().lower())
+        self.actors = _tokens(actor_1, actor_2, actor_3)
+        self.genres = _tokens(genres)
+        self.tags = _tokens(tags)
+
+    @classmethod
+    def from_row(cls, row, rowid=None):
+        """Build from a movies_flat row/dict (`rowid` overrides a movie_id column)."""
+        def col(name):
+            try:
+                return row[name]
+            except (KeyError, IndexError):
+                return None
+        return cls(
+            col('movie_id') if rowid is None else rowid,
+            col('movie_title'), col('director_name'),
+            col('actor_1_name'), col('actor_2_name'), col('actor_3_name'),
+            col('genres'), col('tags'),
+        )
+
+
+def movie_keys(movie, kinds=('title', 'director', 'actor', 'genre')):
+    """(kind, token) pairs a movie is scored on by preference_score."""
+    if 'title' in kinds:
+        yield 'title', movie.title_key
+    if 'director' in kinds and movie.director:
+        yield 'director', movie.director
+    if 'actor' in kinds:
+        for a in movie.actors:
+            yield 'actor', a
+    if 'genre' in kinds:
+        for g in movie.genres:
+            yield 'genre', g
+
+
+def similarity_score(target, candidate):
+    """/similar weights: director +5, each shared actor token +3, genre +1, tag +0.5."""
+    s = 0.0
+    if candidate.director and target.director and candidate.director == target.director:
+        s += 5.0
+    s += 3.0 * len(candidate.actors & target.actors)
+    s += 1.0 * len(candidate.genres & target.genres)
+    s += 0.5 * len(candidate.tags & target.tags)
+    return s
+
+
+class PreferenceProfile:
+    """A user's preference lists normalized to frozensets for scoring.
+
+    `affinity` ({(kind, token): weight}, see affinity.py) holds weights learned
+    from ratings and other interactions, added on top of the explicit lists.
+    """
+    __slots__ = ('movies', 'directors', 'actors', 'genres', 'affinity')
+
+    def __init__(self, prefs, affinity=None):
+        prefs = prefs or {}
+        self.movies = frozenset(m.lower().strip() for m in (prefs.get('movies') or []))
+        self.directors = frozenset(d.lower().strip() for d in (prefs.get('directors') or []))
+        self.actors = frozenset(a.lower().strip() for a in (prefs.get('actors') or []))
+        self.genres = frozenset(g.lower().strip() for g in (prefs.get('genres') or []))
+        self.affinity = affinity or {}
+
+
+def preference_score(movie, profile):
+    """User-preference weights: favourite title +6, director +5, actor token +3, genre +1."""
+    s = 0.0
+    if movie.title_key in profile.movies:
+        s += 6.0
+    if movie.director and movie.director in profile.directors:
+        s += 5.0
+    s += 3.0 * len(movie.actors & profile.actors)
+    s += 1.0 * len(movie.genres & profile.genres)
+    if profile.affinity:
+        learned = profile.affinity
+        s += sum(learned.get(k, 0.0) for k in movie_keys(movie))
+    return s
+
+
+def rank_by_preference(movies, profile, top_n, skip=None, bonus=None):
+    """Top `top_n` (score, movie) with score > 0, ordered (-score, title).
+
+    `movies` may be any iterable (e.g. iter_movie_features); only a heap of
+    `top_n` entries is kept, never the full scored list.  `skip(movie)` drops
+    excluded movies before scoring; `bonus` ({rowid: score}) is added to the
+    preference score.  Pure-Python reference for vector_scorer.VectorScorer.top.
+    """
+    def scored():
+        for m in movies:
+            if skip is not None and skip(m):
+                continue
+            sc = preference_score(m, profile)
+            if bonus:
+                sc += bonus.get(m.rowid, 0.0)
+            if sc > 0:
+                yield sc, m
+    # nsmallest is a bounded heap and stable, i.e. sorted(...)[:top_n]
+    return heapq.nsmallest(top_n, scored(), key=lambda x: (-x[0], x[1].title or ''))
+
+
+class FeatureCache:
+    """Immutable snapshot: movies in rowid order plus a rowid lookup."""
+
+    def __init__(self, movies, version):
+        self.movies = movies
+        self.by_rowid = {m.rowid: m for m in movies}
+        self.version = version
+
+    def __len__(self):
+        return len(self.movies)
+
+    def get(self, rowid, row=None):
+        """Features for `rowid`; tokenizes `row` on a miss (row newer than the cache)."""
+        f = self.by_rowid.get(rowid)
+        if f is None and row is not None:
+            f = MovieFeatures.from_row(row, rowid=rowid)
+        return f
+
+
+def iter_movie_features(db, chunk_size=1000):
+    """Stream MovieFeatures in rowid order, `chunk_size` rows per fetchmany.
+
+    Used instead of the FeatureCache when the catalog is too large to keep
+    tokenized in every worker; nothing is retained between chunks.
+    """
+    cur = db.execute(f"SELECT {FEATURE_COLUMNS} FROM {MOVIES_TABLE} ORDER BY rowid")
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        for r in rows:
+            yield MovieFeatures.from_row(r)
+
+
+def apply_changes(movies, changed, fresh):
+    """`movies` (in rowid order) with the `changed` rowids replaced by `fresh`, in rowid order.
+
+    `fresh` holds the changed movies still in the catalog, in rowid order;
+    the others were deleted.  Pure appends keep `movies` as a prefix.
+    """
+    if not changed:
+        return movies
+    if not movies or changed[0] > movies[-1].rowid:
+        return movies + fresh
+    changed = set(changed)
+    kept = [m for m in movies if m.rowid not in changed]
+    return list(heapq.merge(kept, fresh, key=lambda m: m.rowid))
+
+
+def load_movie_features(db, rowids):
+    """{rowid: MovieFeatures} for the given rowids, read in chunks of 500."""
+    out = {}
+    ids = list(rowids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        for r in db.execute(f"SELECT {FEATURE_COLUMNS} FROM {MOVIES_TABLE} WHERE rowid IN ({','.join('?' * len(chunk))})",
+                            chunk):
+            out[r[0]] = MovieFeatures.from_row(r)
+    return out
+
+
+_cache_lock = threading.Lock()
+_cache = None
+
+
+def load_feature_cache(db, version=None):
+    rows = db.execute(f"SELECT {FEATURE_COLUMNS} FROM {MOVIES_TABLE} ORDER BY rowid").fetchall()
+    return FeatureCache([MovieFeatures.from_row(r) for r in rows], version)
+
+
+def get_feature_cache(db):
+    """Return the process-wide FeatureCache, refreshed if the catalog changed.
+
+    Only the rows changed since the cache's version (catalog.changed_rowids,
+    e.g. admin.py adds, edits and deletes) are re-tokenized; a different
+    database or a bulk rewrite rebuilds.  The returned object is never
+    mutated, so callers can iterate it without holding the lock.
+    """
+    global _cache
+    version = get_catalog_version(db)
+    cache = _cache
+    if cache is not None and version is not None and cache.version == version:
+        return cache
+    with _cache_lock:
+        cache = _cache
+        if cache is not None and version is not None and cache.version == version:
+            return cache
+        changed = changed_rowids(db, cache.version, version, len(cache)) if cache is not None else None
+        if changed is not None:
+            fresh = load_movie_features(db, changed)
+            cache = FeatureCache(apply_changes(cache.movies, changed, [fresh[r] for r in changed if r in fresh]),
+                                 version)
+        else:
+            cache = load_feature_cache(db, version)
+        _cache = cache
+        return cache
@@ -1,8 +1,337 @@
-import pandas as pd
-from sqlalchemy import create_engine
-
-df = pd.read_csv('movie_dataset.csv', sep=None, engine='python')  # auto-detects delim
-df = df.fillna('')  # optional cleaning
-engine = create_engine('sqlite:///movies.db')   # creates movies.db in current folder
-df.to_sql('movies_flat', engine, if_exists='replace', index=False)
-print("Imported", len(df), "rows into movies.db -> movies_flat")
\ No newline at end of file
+# import_sqlite.py - load movie_dataset.csv into movies_flat
+#
+# Usage:
+#   python import_sqlite.py                                # movie_dataset.csv -> movies.db
+#   python import_sqlite.py --csv big.csv --db movies.db --workers 4
+#   python import_sqlite.py --force                        # reload an unchanged file
+#   python import_sqlite.py --sync                         # apply only what changed
+#
+# run.sh runs this on every start.  It used to read the CSV with pandas'
+# sniffing Python parser and write it with to_sql(if_exists='replace'),
+# which dropped movies_flat together with its indexes, extra columns and
+# catalog triggers.  Now, with only the standard library:
+#
+# - The file's SHA-256 is compared with the last import (catalog_imports);
+#   an unchanged file is not loaded again, so a restart costs a hash.
+# - The delimiter is sniffed from the first 64 KB (quoting is RFC 4180);
+#   rows are parsed with the csv module and written with executemany,
+#   `batch_rows` at a time, in one transaction that also deletes the old rows: readers see either the old
+#   catalog or the new one.  CSV columns that movies_flat does not have are
+#   ignored; movie_title_lower is derived when the file lacks it.
+# - The movies_flat indexes and catalog triggers are dropped for the load
+#   and created once at the end, and the catalog gets a new instance_id
+#   (catalog.end_bulk_load): the API rebuilds its in-memory structures once.
+# - With --workers N, files of PARALLEL_MIN_BYTES or more are cut at record
+#   boundaries (a newline preceded by an even number of quotes, so quoted
+#   newlines stay inside their record) into ~CHUNK_BYTES ranges parsed by N
+#   processes; rows are still written in file order.
+# - With --sync, a loaded table is not rewritten: rows are matched to movies
+#   by title and director and compared by a hash of their values, and only
+#   the inserts, updates and deletes are applied with the catalog triggers
+#   on.  Movies keep their rowids (users_feedback, user_watchlist_map), and
+#   the API patches its caches and indexes from the change log.
+#
+# Rows whose field count differs from the header are skipped and counted.
+import argparse
+import csv
+import hashlib
+import io
+import mmap
+import os
+import sqlite3
+import time
+from itertools import islice
+from multiprocessing import Pool
+
+import database
+from catalog import MOVIES_TABLE, begin_bulk_load, end_bulk_load, ensure_catalog_state, ensure_movies_table
+
+BATCH_ROWS = 10000
+CHUNK_BYTES = 4 * 1024 * 1024
+PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+SNIFF_BYTES = 64 * 1024
+
+
+def ensure_import_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_imports (
+            import_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT,
+            sha256 TEXT,
+            rows INTEGER,
+            skipped INTEGER,
+            seconds REAL,
+            imported_at REAL
+        )
+    ''')
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def sniff_format(path):
+    """(csv.reader keyword arguments, header fields, byte offset of the first data record)."""
+    with open(path, 'rb') as f:
+        sample = f.read(SNIFF_BYTES).decode('utf-8-sig', 'replace')
+        try:
+            # only the delimiter: the sniffer's doublequote guess is wrong
+            # for fields like "Tip ""T.I."" Harris"
+            fmt = {'delimiter': csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter}
+        except csv.Error:
+            fmt = {'delimiter': ','}
+        f.seek(0)
+        header = next(csv.reader([f.readline().decode('utf-8-sig')], **fmt), [])
+        return fmt, [h.strip() for h in header], f.tell()
+
+
+def record_ranges(path, start, chunk_bytes):
+    """(start, end) byte ranges of whole records, about `chunk_bytes` each, from `start` to the end."""
+    size = os.path.getsize(path)
+    if start >= size:
+        return []
+    ranges = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        begin = start
+        while begin < size:
+            end = begin + chunk_bytes
+            if end >= size:
+                ranges.append((begin, size))
+                break
+            quotes = mm[begin:end].count(b'"')
+            while True:
+                nl = mm.find(b'\n', end)
+                if nl < 0:
+                    end = size
+                    break
+                quotes += mm[end:nl].count(b'"')
+                end = nl + 1
+                # an odd count means the newline is inside a quoted field
+                if quotes % 2 == 0:
+                    break
+            ranges.append((begin, end))
+            begin = end
+    return ranges
+
+
+class RowMapper:
+    """Turns csv records into movies_flat rows (`columns` order)."""
+
+    def __init__(self, header, table_columns):
+        self.n_fields = len(header)
+        picked = [(c, i) for i, c in enumerate(header) if c in table_columns and c != 'rowid']
+        self.columns = [c for c, _ in picked]
+        self.fields = [i for _, i in picked]
+        # movie_title_lower derived from the title when the file lacks it
+        self.lower_from = None
+        if 'movie_title_lower' not in self.columns and 'movie_title' in self.columns:
+            self.lower_from = header.index('movie_title')
+            self.columns.append('movie_title_lower')
+
+    def rows(self, records):
+        """(rows, records skipped for a wrong field count)."""
+        out, skipped = [], 0
+        n, fields, lower_from = self.n_fields, self.fields, self.lower_from
+        for rec in records:
+            if len(rec) != n:
+                if rec:  # blank lines are not records
+                    skipped += 1
+                continue
+            row = [rec[i] for i in fields]
+            if lower_from is not None:
+                row.append(rec[lower_from].lower())
+            out.append(row)
+        return out, skipped
+
+
+def _parse_range(task):
+    path, start, end, fmt, mapper = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    return mapper.rows(csv.reader(io.StringIO(text, newline=''), **fmt))
+
+
+def iter_batches(path, fmt, data_start, mapper, batch_rows=BATCH_ROWS, workers=1):
+    """Yield (rows, skipped) in file order, streaming or parsed by `workers` processes."""
+    if workers > 1 and os.path.getsize(path) >= PARALLEL_MIN_BYTES:
+        tasks = [(path, start, end, fmt, mapper) for start, end in record_ranges(path, data_start, CHUNK_BYTES)]
+        with Pool(workers) as pool:
+            yield from pool.imap(_parse_range, tasks)
+        return
+    with open(path, 'rb') as raw:
+        raw.seek(data_start)
+        records = csv.reader(io.TextIOWrapper(raw, encoding='utf-8', newline=''), **fmt)
+        while True:
+            chunk = list(islice(records, batch_rows))
+            if not chunk:
+                return
+            yield mapper.rows(chunk)
+
+
+def row_key(title, director):
+    """The stable identity of a movie across imports: its normalised title and director."""
+    return (title or '').strip().lower(), (director or '').strip().lower()
+
+
+def row_digest(row):
+    """Content hash of a movies_flat row's imported column values."""
+    text = '\x1f'.join('' if v is None else str(v) for v in row)
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class KeyedRows:
+    """Assigns row_key()s, numbering repeats of a key in order so that duplicates stay distinct."""
+
+    def __init__(self, columns):
+        self.title = columns.index('movie_title')
+        self.director = columns.index('director_name') if 'director_name' in columns else None
+        self.seen = {}
+
+    def key(self, row):
+        base = row_key(row[self.title], row[self.director] if self.director is not None else '')
+        n = self.seen.get(base, 0)
+        self.seen[base] = n + 1
+        return base + (n,)
+
+
+def bulk_load(cur, csv_path, fmt, data_start, mapper, batch_rows, workers):
+    """Replace every movies_flat row with the file's; returns (rows, skipped)."""
+    # indexes are rebuilt once at the end instead of updated per row
+    indexes = cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                          "AND sql IS NOT NULL", (MOVIES_TABLE,)).fetchall()
+    for name, _ in indexes:
+        cur.execute(f'DROP INDEX "{name}"')
+    begin_bulk_load(cur)
+    cur.execute(f'DELETE FROM {MOVIES_TABLE}')
+    insert = (f"INSERT INTO {MOVIES_TABLE} ({', '.join(mapper.columns)}) "
+              f"VALUES ({', '.join('?' * len(mapper.columns))})")
+    rows = skipped = 0
+    for batch, bad in iter_batches(csv_path, fmt, data_start, mapper, batch_rows, workers):
+        cur.executemany(insert, batch)
+        rows += len(batch)
+        skipped += bad
+    for _, sql in indexes:
+        cur.execute(sql)
+    end_bulk_load(cur)
+    return rows, skipped
+
+
+def sync_rows(cur, csv_path, fmt, data_start, mapper, batch_rows, workers):
+    """Apply only the differences between the file and movies_flat; returns a counts dict.
+
+    Rows are matched by KeyedRows keys and compared by row_digest() over the
+    columns the file provides, so matched movies keep their rowid and the
+    columns the file lacks (synopsis, rating, platforms).  The catalog
+    triggers stay on: each change is logged and the API patches its
+    structures instead of rebuilding them.  A movie whose title or director
+    changed is deleted and inserted again under a new rowid.
+    """
+    columns = mapper.columns
+    existing = {}
+    keys = KeyedRows(columns)
+    for row in cur.execute(f"SELECT rowid, {', '.join(columns)} FROM {MOVIES_TABLE} ORDER BY rowid"):
+        existing[keys.key(row[1:])] = (row[0], row_digest(row[1:]))
+
+    insert = f"INSERT INTO {MOVIES_TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    update = f"UPDATE {MOVIES_TABLE} SET {', '.join(c + ' = ?' for c in columns)} WHERE rowid = ?"
+    counts = {'rows': 0, 'skipped': 0, 'inserted': 0, 'updated': 0, 'deleted': 0}
+    keys = KeyedRows(columns)
+    for batch, bad in iter_batches(csv_path, fmt, data_start, mapper, batch_rows, workers):
+        inserts, updates = [], []
+        for row in batch:
+            match = existing.pop(keys.key(row), None)
+            if match is None:
+                inserts.append(row)
+            elif match[1] != row_digest(row):
+                updates.append(row + [match[0]])
+        cur.executemany(insert, inserts)
+        cur.executemany(update, updates)
+        counts['rows'] += len(batch)
+        counts['skipped'] += bad
+        counts['inserted'] += len(inserts)
+        counts['updated'] += len(updates)
+    # whatever was not matched is gone from the file
+    cur.executemany(f'DELETE FROM {MOVIES_TABLE} WHERE rowid = ?', sorted((rowid,) for rowid, _ in existing.values()))
+    counts['deleted'] = len(existing)
+    return counts
+
+
+def import_csv(db_path, csv_path, force=False, batch_rows=BATCH_ROWS, workers=1, sync=False):
+    """Load `csv_path` into movies_flat unless it was the last file imported; returns a report dict.
+
+    With `sync`, only the rows that differ are written (sync_rows); an empty
+    table is still bulk loaded.
+    """
+    start = time.perf_counter()
+    if not os.path.exists(db_path):
+        sqlite3.connect(db_path).close()
+    conn = database.connect(db_path)
+    conn.isolation_level = None  # transactions are explicit below
+    try:
+        cur = conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            ensure_movies_table(cur)
+            ensure_catalog_state(cur)
+            ensure_import_schema(cur)
+            sha = file_sha256(csv_path)
+            last = cur.execute('SELECT sha256 FROM catalog_imports ORDER BY import_id DESC LIMIT 1').fetchone()
+            loaded = cur.execute(f'SELECT 1 FROM {MOVIES_TABLE} LIMIT 1').fetchone() is not None
+            if not force and last is not None and last[0] == sha and loaded:
+                cur.execute('COMMIT')
+                return {'status': 'unchanged', 'rows': None, 'skipped': 0, 'seconds': time.perf_counter() - start}
+
+            fmt, header, data_start = sniff_format(csv_path)
+            table_columns = {r[1] for r in cur.execute(f'PRAGMA table_info({MOVIES_TABLE})')}
+            mapper = RowMapper(header, table_columns)
+            if 'movie_title' not in mapper.columns:
+                raise ValueError(f'{csv_path}: no movie_title column in {header}')
+
+            if sync and loaded:
+                report = {'status': 'synced'}
+                report.update(sync_rows(cur, csv_path, fmt, data_start, mapper, batch_rows, workers))
+            else:
+                rows, skipped = bulk_load(cur, csv_path, fmt, data_start, mapper, batch_rows, workers)
+                report = {'status': 'imported', 'rows': rows, 'skipped': skipped}
+            report['seconds'] = time.perf_counter() - start
+            cur.execute('INSERT INTO catalog_imports (source, sha256, rows, skipped, seconds, imported_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?)', (os.path.basename(csv_path), sha, report['rows'],
+                                                      report['skipped'], report['seconds'], time.time()))
+            cur.execute('COMMIT')
+        except BaseException:
+            cur.execute('ROLLBACK')
+            raise
+        return report
+    finally:
+        conn.close()
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--csv', default=os.path.join(here, 'movie_dataset.csv'))
+    parser.add_argument('--db', default=os.getenv('MOVIES_DB', os.path.join(here, 'movies.db')))
+    parser.add_argument('--force', action='store_true', help='reload even if the file is unchanged')
+    parser.add_argument('--sync', action='store_true', help='write only the rows that changed, keeping rowids')
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS)
+    parser.add_argument('--workers', type=int, default=1, help='parse processes for large files')
+    args = parser.parse_args()
+    report = import_csv(args.db, args.csv, args.force, args.batch_rows, args.workers, args.sync)
+    if report['status'] == 'unchanged':
+        print(f"{os.path.basename(args.csv)} unchanged since the last import ({report['seconds'] * 1000:.1f} ms)")
+    elif report['status'] == 'synced':
+        print(f"Synced {report['rows']} rows into {os.path.basename(args.db)} -> {MOVIES_TABLE} "
+              f"in {report['seconds']:.2f}s: {report['inserted']} inserted, {report['updated']} updated, "
+              f"{report['deleted']} deleted ({report['skipped']} malformed rows skipped)")
+    else:
+        print(f"Imported {report['rows']} rows into {os.path.basename(args.db)} -> {MOVIES_TABLE} "
+              f"in {report['seconds']:.2f}s ({report['skipped']} malformed rows skipped)")
+
+
+if __name__ == '__main__':
+    main()
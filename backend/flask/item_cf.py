@@ -0,0 +1,287 @@
+# item_cf.py - item-item collaborative filtering from users_feedback ratings
+#
+# Two movies are similar when the same users rated them: with r_u the vector
+# of ratings user u gave, sim(i, j) = dot(i, j) / sqrt(norm_i * norm_j) where
+# dot(i, j) = sum_u r_ui * r_uj and norm_i = sum_u r_ui ** 2 (cosine over the
+# item columns of the user x item rating matrix).
+#
+# The sparse matrix lives in SQLite so every worker shares it:
+#   item_norms        movie_rowid -> norm_sq, n_ratings
+#   item_cooccurrence (item_a, item_b) -> dot, stored in both directions
+#   item_neighbours   top-K (neighbour, sim) per movie - what queries read
+#
+# build() recomputes everything from users_feedback (batch job, see main()).
+# apply_rating() folds one new or changed rating in: it adjusts the movie's
+# norm and its co-occurrence with every other movie the user rated, then
+# refreshes the movie's own neighbour list and its entry in the list of every
+# movie it co-occurs with (its norm changed, so all of those similarities
+# did).  A list that held the movie at a higher score is recomputed from its
+# co-occurrence row instead, since the movie may now fall out of its top k
+# and the next-best neighbour is only found there.  Like build() it counts
+# only a user's MAX_ITEMS_PER_USER newest ratings, so a rating can also
+# retire the user's oldest one.  No other similarity depends on the rating,
+# so the model stays equal to a fresh build() (up to the order of equal
+# scores at the k-th place).
+#
+# A rating changes the CF bonus of every user who rated a co-rated movie,
+# but only the rater's recommendation version is bumped: other users'
+# cached lists (rec_cache.py, precompute.py) keep the bonus they were
+# computed with until their own inputs or the catalog change.
+import argparse
+import math
+import sqlite3
+import time
+from collections import defaultdict
+
+# default weight of the CF signal when blended with preference scores
+DEFAULT_WEIGHT = 3.0
+# ratings below this are not used as seeds when scoring a user
+MIN_SEED_RATING = 3.0
+# a user's ratings beyond this many (most recent first) are ignored by build()
+MAX_ITEMS_PER_USER = 500
+
+
+def ensure_item_cf_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS item_norms (
+            movie_rowid INTEGER PRIMARY KEY,
+            norm_sq REAL NOT NULL DEFAULT 0,
+            n_ratings INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS item_cooccurrence (
+            item_a INTEGER,
+            item_b INTEGER,
+            dot REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (item_a, item_b)
+        ) WITHOUT ROWID
+    ''')
+    # popularity (number of ratings) for the two-stage pipeline's candidates
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_item_norms_popularity ON item_norms(n_ratings)')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS item_neighbours (
+            movie_rowid INTEGER,
+            neighbour_rowid INTEGER,
+            score REAL,
+            PRIMARY KEY (movie_rowid, neighbour_rowid)
+        ) WITHOUT ROWID
+    ''')
+
+
+def to_rating(value):
+    """Feedback ratings arrive as JSON numbers or strings; None if unusable."""
+    try:
+        rating = float(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if math.isfinite(rating) else None
+
+
+def _cosine(dot, norm_a, norm_b):
+    if dot <= 0 or norm_a <= 0 or norm_b <= 0:
+        return 0.0
+    return dot / math.sqrt(norm_a * norm_b)
+
+
+def build(conn, k=50):
+    """Rebuild norms, co-occurrence and top-`k` neighbour lists from users_feedback."""
+    by_user = defaultdict(list)
+    rows = conn.execute(
+        'SELECT user_id, movie_rowid, rating FROM users_feedback WHERE rating IS NOT NULL '
+        'ORDER BY user_id, created_at DESC, movie_rowid DESC'
+    )
+    for user_id, movie_rowid, rating in rows:
+        rating = to_rating(rating)
+        if rating is not None and len(by_user[user_id]) < MAX_ITEMS_PER_USER:
+            by_user[user_id].append((movie_rowid, rating))
+
+    norms = defaultdict(float)
+    counts = defaultdict(int)
+    dots = defaultdict(lambda: defaultdict(float))
+    for items in by_user.values():
+        for a, ra in items:
+            norms[a] += ra * ra
+            counts[a] += 1
+            row = dots[a]
+            for b, rb in items:
+                if b != a:
+                    row[b] += ra * rb
+
+    conn.execute('DELETE FROM item_norms')
+    conn.execute('DELETE FROM item_cooccurrence')
+    conn.execute('DELETE FROM item_neighbours')
+    conn.executemany('INSERT INTO item_norms (movie_rowid, norm_sq, n_ratings) VALUES (?, ?, ?)',
+                     [(m, norms[m], counts[m]) for m in norms])
+    conn.executemany('INSERT INTO item_cooccurrence (item_a, item_b, dot) VALUES (?, ?, ?)',
+                     [(a, b, d) for a, row in dots.items() for b, d in row.items()])
+    neighbours = []
+    for a, row in dots.items():
+        sims = [(b, _cosine(d, norms[a], norms[b])) for b, d in row.items()]
+        sims = sorted((s for s in sims if s[1] > 0), key=lambda s: -s[1])[:k]
+        neighbours.extend((a, b, s) for b, s in sims)
+    conn.executemany('INSERT INTO item_neighbours (movie_rowid, neighbour_rowid, score) VALUES (?, ?, ?)',
+                     neighbours)
+    conn.commit()
+    return len(norms), len(neighbours)
+
+
+def _norm(db, movie_rowid):
+    row = db.execute('SELECT norm_sq FROM item_norms WHERE movie_rowid = ?', (movie_rowid,)).fetchone()
+    return row[0] if row else 0.0
+
+
+def refresh_neighbours(db, movie_rowid, k=50):
+    """Recompute one movie's top-k list; returns [(other, sim)] for its whole co-occurrence row."""
+    norm = _norm(db, movie_rowid)
+    rows = db.execute(
+        'SELECT c.item_b, c.dot, n.norm_sq FROM item_cooccurrence c '
+        'JOIN item_norms n ON n.movie_rowid = c.item_b WHERE c.item_a = ?', (movie_rowid,)
+    ).fetchall()
+    sims = [(b, _cosine(dot, norm, nb)) for b, dot, nb in rows]
+    top = sorted((s for s in sims if s[1] > 0), key=lambda s: -s[1])[:k]
+    db.execute('DELETE FROM item_neighbours WHERE movie_rowid = ?', (movie_rowid,))
+    db.executemany('INSERT INTO item_neighbours (movie_rowid, neighbour_rowid, score) VALUES (?, ?, ?)',
+                   [(movie_rowid, b, s) for b, s in top])
+    return sims
+
+
+def _set_reverse_entries(db, movie_rowid, sims, k):
+    """Put sim(other, movie) into each other's list, keeping each list at k.
+
+    A list where the movie's score dropped is recomputed (refresh_neighbours):
+    its new k-th neighbour may not be in the list yet.
+    """
+    listed, others = {}, [b for b, _ in sims]
+    for i in range(0, len(others), 500):
+        chunk = others[i:i + 500]
+        listed.update(db.execute(
+            f"SELECT movie_rowid, score FROM item_neighbours WHERE neighbour_rowid = ? "
+            f"AND movie_rowid IN ({','.join('?' * len(chunk))})", (movie_rowid, *chunk)))
+    dropped = {b for b, s in sims if b in listed and s < listed[b]}
+    for b in dropped:
+        refresh_neighbours(db, b, k)
+    sims = [(b, s) for b, s in sims if b not in dropped]
+    db.executemany('DELETE FROM item_neighbours WHERE movie_rowid = ? AND neighbour_rowid = ?',
+                   [(b, movie_rowid) for b, s in sims if s <= 0])
+    kept = [(b, movie_rowid, s) for b, s in sims if s > 0]
+    db.executemany(
+        'INSERT INTO item_neighbours (movie_rowid, neighbour_rowid, score) VALUES (?, ?, ?) '
+        'ON CONFLICT(movie_rowid, neighbour_rowid) DO UPDATE SET score = excluded.score',
+        kept
+    )
+    db.executemany(
+        'DELETE FROM item_neighbours WHERE movie_rowid = ? AND neighbour_rowid NOT IN '
+        '(SELECT neighbour_rowid FROM item_neighbours WHERE movie_rowid = ? ORDER BY score DESC LIMIT ?)',
+        [(b, b, k) for b, _, _ in kept]
+    )
+
+
+def _window(rated):
+    """{movie: rating} of the MAX_ITEMS_PER_USER newest of `rated` [(movie, rating, created_at)], as build() keeps them."""
+    # build()'s ORDER BY created_at DESC, movie_rowid DESC: NULL times last
+    newest = sorted(rated, key=lambda x: (x[2] is not None, x[2] or 0, x[0]), reverse=True)
+    return {m: r for m, r, _ in newest[:MAX_ITEMS_PER_USER]}
+
+
+def apply_rating(db, user_id, movie_rowid, rating, old_rating=None, k=50):
+    """Fold one user's new (or changed) rating of `movie_rowid` into the model.
+
+    Call before users_feedback is updated: the rating becomes the user's
+    newest, and a user at MAX_ITEMS_PER_USER loses the contribution of the
+    oldest rating kept so far, as in build().  Does not commit.
+    """
+    new, old = to_rating(rating), to_rating(old_rating)
+    others, old_created = [], None
+    for m, r, created in db.execute(
+            'SELECT movie_rowid, rating, created_at FROM users_feedback WHERE user_id = ? AND rating IS NOT NULL',
+            (user_id,)):
+        if m == movie_rowid:
+            old_created = created
+        else:
+            r = to_rating(r)
+            if r is not None:
+                others.append((m, r, created))
+    before = _window(others + ([(movie_rowid, old, old_created)] if old is not None else []))
+    after = _window(others + ([(movie_rowid, new, math.inf)] if new is not None else []))
+    changed = [m for m in dict.fromkeys(list(before) + list(after)) if before.get(m) != after.get(m)]
+    if not changed:
+        return
+
+    db.executemany(
+        'INSERT INTO item_norms (movie_rowid, norm_sq, n_ratings) VALUES (?, ?, ?) '
+        'ON CONFLICT(movie_rowid) DO UPDATE SET norm_sq = norm_sq + excluded.norm_sq, '
+        'n_ratings = n_ratings + excluded.n_ratings',
+        [(m, after.get(m, 0.0) ** 2 - before.get(m, 0.0) ** 2, int(m in after) - int(m in before)) for m in changed]
+    )
+    # every pair with a changed movie: r_a * r_b after minus before
+    pairs, done = [], set()
+    for a in changed:
+        done.add(a)
+        for b in dict.fromkeys(list(before) + list(after)):
+            if b in done:
+                continue
+            delta = after.get(a, 0.0) * after.get(b, 0.0) - before.get(a, 0.0) * before.get(b, 0.0)
+            if delta:
+                pairs.append((a, b, delta))
+    db.executemany('INSERT INTO item_cooccurrence (item_a, item_b, dot) VALUES (?, ?, ?) '
+                   'ON CONFLICT(item_a, item_b) DO UPDATE SET dot = dot + excluded.dot',
+                   pairs + [(b, a, d) for a, b, d in pairs])
+
+    for m in changed:
+        _set_reverse_entries(db, m, refresh_neighbours(db, m, k), k)
+
+
+def user_seeds(db, user_id):
+    """{movie_rowid: rating} of the user's ratings usable as CF seeds."""
+    seeds = {}
+    for movie_rowid, rating in db.execute(
+            'SELECT movie_rowid, rating FROM users_feedback WHERE user_id = ? AND rating IS NOT NULL', (user_id,)):
+        rating = to_rating(rating)
+        if rating is not None and rating >= MIN_SEED_RATING:
+            seeds[movie_rowid] = rating
+    return seeds
+
+
+def cf_scores(db, seeds, weight=1.0):
+    """{movie_rowid: score} from the cached neighbour lists of `seeds`.
+
+    Each seed contributes weight * sim * rating / 5 to its neighbours; one
+    indexed query for all seeds.
+    """
+    if not seeds or not weight:
+        return {}
+    scores = defaultdict(float)
+    ids = list(seeds)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        for movie_rowid, neighbour, sim in db.execute(
+                f"SELECT movie_rowid, neighbour_rowid, score FROM item_neighbours "
+                f"WHERE movie_rowid IN ({','.join('?' * len(chunk))})", chunk):
+            scores[neighbour] += weight * sim * seeds[movie_rowid] / 5.0
+    return dict(scores)
+
+
+def popular_movies(db, limit):
+    """[(movie_rowid, n_ratings)] of the `limit` most-rated movies."""
+    return db.execute(
+        'SELECT movie_rowid, n_ratings FROM item_norms WHERE n_ratings > 0 ORDER BY n_ratings DESC LIMIT ?',
+        (limit,)
+    ).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the item-item CF model from users_feedback')
+    parser.add_argument('--db', default='movies.db')
+    parser.add_argument('-k', type=int, default=50, help='neighbours kept per movie')
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db)
+    ensure_item_cf_schema(conn.cursor())
+    start = time.perf_counter()
+    movies, pairs = build(conn, args.k)
+    print(f"item CF: {movies} rated movies, {pairs} neighbour entries in {time.perf_counter() - start:.2f}s")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
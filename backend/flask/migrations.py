@@ -0,0 +1,89 @@
+# migrations.py - versioned schema changes for existing databases
+#
+# init_db_schema() creates missing tables with CREATE TABLE IF NOT EXISTS,
+# which cannot change a table that already exists (add an index, a unique
+# constraint, clean up rows that would violate it).  Such changes are listed
+# here as numbered migrations; migrate() applies the ones a database has not
+# seen yet, in order, each in its own transaction, and records them in
+# schema_migrations.  Never edit or renumber a released migration - add a
+# new one.
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _user_data_indexes(db):
+    # get_user_watchlist_set / affinity.rebuild: lists of a user
+    db.execute('CREATE INDEX IF NOT EXISTS idx_users_watchlist_user ON users_watchlist(user_id, list_id)')
+
+
+def _unique_feedback(db):
+    # one rating per user and movie: keep the latest row of any duplicates
+    removed = db.execute(
+        'DELETE FROM users_feedback WHERE user_id IS NOT NULL AND movie_rowid IS NOT NULL '
+        'AND feedback_id NOT IN (SELECT MAX(feedback_id) FROM users_feedback GROUP BY user_id, movie_rowid)'
+    ).rowcount
+    if removed:
+        logger.warning("Removed %d duplicate users_feedback rows", removed)
+    # serves the (user_id, movie_rowid) upsert and every per-user scan
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_users_feedback_user_movie ON users_feedback(user_id, movie_rowid)')
+
+
+def _unique_watchlist_entries(db):
+    db.execute('DELETE FROM user_watchlist_map WHERE id NOT IN '
+               '(SELECT MIN(id) FROM user_watchlist_map GROUP BY list_id, movie_rowid)')
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_user_watchlist_map_list_movie '
+               'ON user_watchlist_map(list_id, movie_rowid)')
+
+
+# (version, name, fn(db)); append only
+MIGRATIONS = [
+    (1, 'user_data_indexes', _user_data_indexes),
+    (2, 'unique_feedback_per_user_movie', _unique_feedback),
+    (3, 'unique_watchlist_entries', _unique_watchlist_entries),
+]
+
+
+def ensure_migrations_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at REAL
+        )
+    ''')
+
+
+def current_version(db):
+    return db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations').fetchone()[0]
+
+
+def migrate(db, migrations=MIGRATIONS):
+    """Apply pending migrations in order; returns the versions applied.
+
+    Expects the tables they touch to exist (init_db_schema creates them
+    first).  Commits any open transaction of `db`.
+    """
+    ensure_migrations_schema(db.cursor())
+    db.commit()
+    applied = []
+    for version, name, fn in migrations:
+        if version <= current_version(db):
+            continue
+        # the write lock first, so concurrent workers starting up apply each migration once
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= current_version(db):
+                db.rollback()
+                continue
+            fn(db)
+            db.execute('INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+                       (version, name, time.time()))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        logger.info("Applied migration %d (%s)", version, name)
+        applied.append(version)
+    return applied
@@ -0,0 +1,269 @@
+# precompute.py - offline top-N recommendations for every user
+#
+# Usage:
+#   python precompute.py                      # all users, top 20, one worker per CPU
+#   python precompute.py --workers 4 --top 20 --batch-size 500
+#   python precompute.py --resume             # continue the last unfinished run
+#
+# The catalog is tokenized and turned into a VectorScorer once, in the parent,
+# before the process pool forks, so every worker scores against the same
+# copy-on-write catalog instead of loading its own.  The parent reads users in
+# user_id order, one batch at a time (their affinity rows in one query, see
+# affinity.py), hands the batch to the pool, and writes the results plus a
+# checkpoint in one transaction.  A run interrupted at any point can be
+# resumed from its last checkpoint.
+#
+# Each precomputed row stores the user's rec versions and the catalog version
+# it was computed against (see rec_cache.py / catalog.py); /recommendations
+# only serves it while those still match and it is younger than max_age.
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+
+import affinity
+import item_cf
+import profile_store
+from catalog import get_catalog_version
+from features import load_feature_cache, rank_by_preference
+from rec_cache import ensure_rec_cache_schema
+
+try:
+    from vector_scorer import VectorScorer
+except ImportError:  # numpy not installed: workers use the per-movie loop
+    VectorScorer = None
+
+
+def ensure_precompute_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS precomputed_recommendations (
+            user_id TEXT PRIMARY KEY,
+            computed_at REAL,
+            top_n INTEGER,
+            prefs_version INTEGER,
+            activity_version INTEGER,
+            catalog_version TEXT,
+            recommendations_json TEXT
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS precompute_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at REAL,
+            finished_at REAL,
+            top_n INTEGER,
+            last_user_id TEXT,
+            users_done INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def encode_catalog_version(version):
+    return json.dumps(list(version)) if version is not None else None
+
+
+def load_fresh_precomputed(db, user_id, top_n, user_versions, max_age):
+    """Precomputed movie ids for `user_id`, or None if missing or stale.
+
+    Fresh means: at least `top_n` were computed, the row is younger than
+    `max_age` seconds, and neither the user's rec versions nor the catalog
+    version have moved since.
+    """
+    row = db.execute(
+        'SELECT computed_at, top_n, prefs_version, activity_version, catalog_version, recommendations_json '
+        'FROM precomputed_recommendations WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    if not row or row[1] < top_n or time.time() - row[0] > max_age:
+        return None
+    if (row[2], row[3]) != tuple(user_versions):
+        return None
+    if row[4] != encode_catalog_version(get_catalog_version(db)):
+        return None
+    return json.loads(row[5])[:top_n]
+
+
+# -----------------------
+# Worker side: the catalog is a module global so a forked pool inherits it
+# -----------------------
+_catalog = None
+_scorer = None
+
+
+def load_catalog(db_path):
+    global _catalog, _scorer
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        _catalog = load_feature_cache(conn, get_catalog_version(conn))
+    finally:
+        conn.close()
+    _scorer = VectorScorer(_catalog.movies) if VectorScorer is not None else None
+    return _catalog
+
+
+def _init_worker(db_path):
+    # spawn-based platforms (Windows) do not inherit the parent's catalog
+    if _catalog is None:
+        load_catalog(db_path)
+
+
+def score_batch(batch):
+    """[(user_id, PreferenceProfile, excluded rowid strs, cf bonus, top_n)] -> [(user_id, [rowid, ...])]."""
+    out = []
+    for user_id, profile, excluded, bonus, top_n in batch:
+        if _scorer is not None:
+            ranked = _scorer.top(profile, top_n, exclude=_scorer.positions_for_rowids(excluded),
+                                 bonus=_scorer.bonus_vector(bonus))
+        else:
+            ranked = rank_by_preference(_catalog.movies, profile, top_n,
+                                        skip=lambda m: str(m.rowid) in excluded, bonus=bonus)
+        out.append((user_id, [m.rowid for _, m in ranked]))
+    return out
+
+
+# -----------------------
+# Parent side
+# -----------------------
+def _placeholders(n):
+    return ','.join('?' * n)
+
+
+def read_user_batch(conn, after_user_id, batch_size, top_n, cf_weight=item_cf.DEFAULT_WEIGHT):
+    users = [r[0] for r in conn.execute(
+        'SELECT user_id FROM users_basic WHERE user_id > ? ORDER BY user_id LIMIT ?',
+        (after_user_id, batch_size)
+    ).fetchall()]
+    if not users:
+        return [], {}
+    ph = _placeholders(len(users))
+    # versions first: a write racing with the reads below then leaves the row
+    # stamped with an older version, i.e. stale rather than wrongly fresh
+    versions = {u: (0, 0) for u in users}
+    for user_id, pv, av in conn.execute(
+            f'SELECT user_id, prefs_version, activity_version FROM user_rec_versions WHERE user_id IN ({ph})', users):
+        versions[user_id] = (pv, av)
+    profiles = affinity.load_many(conn, users)
+    for u in users:
+        if u not in profiles:
+            # with the stored title lists, as server.user_memory passes them
+            profiles[u] = affinity.rebuild(conn, u, profile_store.load_user_lists(conn, u).as_memory())
+            affinity.save(conn, profiles[u])
+    now = time.time()
+    batch = []
+    for u in users:
+        aff = profiles[u]
+        # item-item CF signal, as blended by compute_recommendations_for_user
+        bonus = item_cf.cf_scores(conn, aff.cf_seeds(), cf_weight)
+        batch.append((u, aff.profile(now), aff.exclude_rowids(), bonus, top_n))
+    return batch, versions
+
+
+def _chunks(items, n):
+    size = max(1, -(-len(items) // n))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def run(db_path, top_n=20, workers=None, batch_size=500, resume=False, max_users=None,
+        cf_weight=item_cf.DEFAULT_WEIGHT, log=print):
+    """Precompute recommendations for every user in users_basic.
+
+    Returns (run_id, users_done_this_call, elapsed_seconds).  `max_users`
+    stops early (the run stays resumable).
+    """
+    workers = workers or os.cpu_count() or 1
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    ensure_rec_cache_schema(cur)
+    ensure_precompute_schema(cur)
+    item_cf.ensure_item_cf_schema(cur)
+    affinity.ensure_affinity_schema(cur)
+    profile_store.ensure_profile_store_schema(cur)
+    conn.commit()
+
+    run_row = None
+    if resume:
+        run_row = conn.execute(
+            'SELECT run_id, top_n, last_user_id FROM precompute_runs WHERE finished_at IS NULL '
+            'ORDER BY run_id DESC LIMIT 1'
+        ).fetchone()
+    if run_row:
+        run_id, top_n, last_user_id = run_row[0], run_row[1], run_row[2] or ''
+        log(f"resuming run {run_id} after user {last_user_id!r}")
+    else:
+        run_id = cur.execute('INSERT INTO precompute_runs (started_at, top_n, last_user_id) VALUES (?, ?, ?)',
+                             (time.time(), top_n, '')).lastrowid
+        conn.commit()
+        last_user_id = ''
+
+    start = time.perf_counter()
+    catalog = load_catalog(db_path)
+    catalog_version = encode_catalog_version(catalog.version)
+    log(f"catalog loaded: {len(catalog)} movies in {time.perf_counter() - start:.2f}s")
+
+    pool = None
+    if workers > 1:
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        pool = ctx.Pool(workers, initializer=_init_worker, initargs=(db_path,))
+
+    done = 0
+    start = time.perf_counter()
+    try:
+        while max_users is None or done < max_users:
+            limit = batch_size if max_users is None else min(batch_size, max_users - done)
+            batch, versions = read_user_batch(conn, last_user_id, limit, top_n, cf_weight)
+            if not batch:
+                conn.execute('UPDATE precompute_runs SET finished_at = ? WHERE run_id = ?', (time.time(), run_id))
+                conn.commit()
+                break
+            if pool is not None:
+                results = [r for part in pool.map(score_batch, _chunks(batch, workers)) for r in part]
+            else:
+                results = score_batch(batch)
+            now = time.time()
+            conn.executemany(
+                'INSERT INTO precomputed_recommendations (user_id, computed_at, top_n, prefs_version, activity_version, '
+                'catalog_version, recommendations_json) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET computed_at=excluded.computed_at, top_n=excluded.top_n, '
+                'prefs_version=excluded.prefs_version, activity_version=excluded.activity_version, '
+                'catalog_version=excluded.catalog_version, recommendations_json=excluded.recommendations_json',
+                [(u, now, top_n, versions[u][0], versions[u][1], catalog_version, json.dumps(ids))
+                 for u, ids in results]
+            )
+            last_user_id = batch[-1][0]
+            done += len(batch)
+            conn.execute('UPDATE precompute_runs SET last_user_id = ?, users_done = users_done + ? WHERE run_id = ?',
+                         (last_user_id, len(batch), run_id))
+            conn.commit()
+            elapsed = time.perf_counter() - start
+            log(f"{done} users, {done / elapsed:.1f} users/s")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    log(f"run {run_id}: {done} users in {elapsed:.2f}s ({done / elapsed if elapsed else 0:.1f} users/s)")
+    return run_id, done, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', default='movies.db')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--max-users', type=int, default=None)
+    parser.add_argument('--cf-weight', type=float, default=float(os.getenv('CF_WEIGHT', item_cf.DEFAULT_WEIGHT)))
+    args = parser.parse_args()
+    run(args.db, top_n=args.top, workers=args.workers, batch_size=args.batch_size,
+        resume=args.resume, max_users=args.max_users, cf_weight=args.cf_weight)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+# profile_store.py - shared store for the title-based user lists
+#
+# /user/watchlist, /user/seen and /user/feedback used to keep their state in
+# server.user_profiles, a dict private to one process: with several workers
+# a user's writes were invisible to the others, and the dict never shrank.
+# The lists now live in SQLite:
+#
+#   user_titles          one row per (user, list, normalized title), in the
+#                        order the titles were added
+#   user_notes           free-text feedback, '__anonymous__' for anonymous
+#   user_store_versions  a counter per user, bumped by every flushed batch
+#
+# Each process fronts them with a bounded LRU of UserLists.  Reads validate
+# the cached entry with one primary-key lookup of the user's version, so a
+# write flushed by any worker is seen by every other on its next read.
+# Writes update the cached entry at once (read-your-writes in the writing
+# process) and are queued; a background thread applies the queue in one
+# transaction every `flush_interval` seconds.  Until then other workers see
+# the previous state.  Operations are idempotent inserts and deletes rather
+# than whole-list overwrites, so concurrent writers never lose each other's
+# changes.  A batch stays visible to reads until its transaction commits,
+# after which its users' entries are reloaded from the database.  A batch
+# that fails MAX_FLUSH_ATTEMPTS times in a row is dropped (and logged) rather
+# than queued forever.  server.py closes the store at exit, flushing the queue.
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+WATCHLIST = 'watchlist'
+SEEN = 'seen'
+ANONYMOUS = '__anonymous__'
+# consecutive failed flushes before the queued operations are dropped
+MAX_FLUSH_ATTEMPTS = 5
+
+
+def ensure_profile_store_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_titles (
+            user_id TEXT NOT NULL,
+            list_name TEXT NOT NULL,
+            title_key TEXT NOT NULL,
+            title TEXT,
+            added_at REAL,
+            PRIMARY KEY (user_id, list_name, title_key)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            movie TEXT,
+            rating REAL,
+            text TEXT,
+            created_at REAL
+        )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_user_notes_user ON user_notes(user_id, id)')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_store_versions (
+            user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def title_key(title):
+    return (title or '').strip().lower()
+
+
+class UserLists:
+    """One user's watchlist and seen titles (in insertion order) and feedback entries."""
+    __slots__ = ('watchlist', 'seen', 'feedback')
+
+    def __init__(self, watchlist=None, seen=None, feedback=None):
+        self.watchlist = watchlist or []
+        self.seen = seen or []
+        self.feedback = feedback or []
+
+    def copy(self):
+        return UserLists(list(self.watchlist), list(self.seen), list(self.feedback))
+
+    def titles(self, list_name):
+        return self.watchlist if list_name == WATCHLIST else self.seen
+
+    def is_empty(self):
+        return not (self.watchlist or self.seen or self.feedback)
+
+    def as_memory(self):
+        """The shape affinity.rebuild expects for a user's in-process state."""
+        return {'watchlist': list(self.watchlist), 'seen': list(self.seen)}
+
+    def apply(self, op):
+        kind = op[0]
+        if kind == 'add':
+            _, _, list_name, title, _ = op
+            titles = self.titles(list_name)
+            if title_key(title) not in {title_key(t) for t in titles if t}:
+                titles.append(title)
+        elif kind == 'remove':
+            _, _, list_name, key = op
+            titles = self.titles(list_name)
+            titles[:] = [t for t in titles if title_key(t) != key]
+        elif kind == 'note':
+            _, _, movie, rating, text, _ = op
+            self.feedback.append({'movie': movie, 'rating': rating, 'text': text})
+
+
+def load_user_lists(db, user_id):
+    lists = UserLists()
+    for list_name, title in db.execute(
+            'SELECT list_name, title FROM user_titles WHERE user_id = ? ORDER BY added_at, rowid', (user_id,)):
+        lists.titles(list_name).append(title)
+    lists.feedback = [{'movie': m, 'rating': r, 'text': t} for m, r, t in db.execute(
+        'SELECT movie, rating, text FROM user_notes WHERE user_id = ? ORDER BY id', (user_id,))]
+    return lists
+
+
+def store_version(db, user_id):
+    row = db.execute('SELECT version FROM user_store_versions WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def apply_ops(db, ops):
+    """Write queued operations and bump each touched user's version (no commit).
+
+    Returns {user_id: version after this batch}.
+    """
+    for op in ops:
+        kind, user_id = op[0], op[1]
+        if kind == 'add':
+            _, _, list_name, title, at = op
+            db.execute('INSERT OR IGNORE INTO user_titles (user_id, list_name, title_key, title, added_at) '
+                       'VALUES (?, ?, ?, ?, ?)', (user_id, list_name, title_key(title), title, at))
+        elif kind == 'remove':
+            _, _, list_name, key = op
+            db.execute('DELETE FROM user_titles WHERE user_id = ? AND list_name = ? AND title_key = ?',
+                       (user_id, list_name, key))
+        elif kind == 'note':
+            _, _, movie, rating, text, at = op
+            db.execute('INSERT INTO user_notes (user_id, movie, rating, text, created_at) VALUES (?, ?, ?, ?, ?)',
+                       (user_id, movie, rating, text, at))
+    versions = {}
+    for user_id in dict.fromkeys(op[1] for op in ops):
+        db.execute('INSERT INTO user_store_versions (user_id, version) VALUES (?, 1) '
+                   'ON CONFLICT(user_id) DO UPDATE SET version = version + 1', (user_id,))
+        versions[user_id] = store_version(db, user_id)
+    return versions
+
+
+class ProfileStore:
+    """Read-through, write-behind cache of UserLists over one database file."""
+
+    def __init__(self, db_path, flush_interval=0.05, max_users=10000):
+        self.db_path = db_path
+        self.flush_interval, self.max_users = flush_interval, max_users
+        self._entries = OrderedDict()  # user_id -> (version, UserLists)
+        self._pending = []
+        self._inflight = []  # the batch being written by flush()
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pending_for(self, user_id):
+        return [op for op in self._inflight + self._pending if op[1] == user_id]
+
+    def get(self, db, user_id):
+        """A copy of the user's lists, including this process's unflushed writes."""
+        version = store_version(db, user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                return entry[1].copy()
+        lists = load_user_lists(db, user_id)
+        with self._lock:
+            for op in self._pending_for(user_id):
+                lists.apply(op)
+            self._remember(user_id, version, lists)
+            return lists.copy()
+
+    def _remember(self, user_id, version, lists):
+        self._entries[user_id] = (version, lists)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def _write(self, db, user_id, ops):
+        """Queue `ops` and apply them to the cached entry; returns the updated copy (None for ANONYMOUS)."""
+        lists = self.get(db, user_id) if user_id != ANONYMOUS else None
+        with self._lock:
+            self._pending.extend(ops)
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                for op in ops:
+                    entry[1].apply(op)
+                lists = entry[1].copy()
+            elif lists is not None:
+                # evicted since get() (always, with max_users=0)
+                for op in ops:
+                    lists.apply(op)
+        self._start()
+        self._wake.set()
+        return lists
+
+    def add_title(self, db, user_id, list_name, title):
+        return self._write(db, user_id, [('add', user_id, list_name, title, time.time())])
+
+    def remove_title(self, db, user_id, list_name, title):
+        return self._write(db, user_id, [('remove', user_id, list_name, title_key(title))])
+
+    def mark_seen(self, db, user_id, title):
+        return self._write(db, user_id, [('add', user_id, SEEN, title, time.time()),
+                                         ('remove', user_id, WATCHLIST, title_key(title))])
+
+    def add_note(self, db, user_id, movie, rating, text):
+        return self._write(db, user_id or ANONYMOUS, [('note', user_id or ANONYMOUS, movie, rating, text, time.time())])
+
+    def flush(self):
+        """Apply every queued operation now; returns the number written."""
+        with self._flush_lock:
+            with self._lock:
+                ops, self._pending = self._pending, []
+                # reads keep applying the batch until it has committed
+                self._inflight = ops
+            if not ops:
+                return 0
+            try:
+                # mode=rw: never create a database that has been removed
+                conn = sqlite3.connect(f'{Path(self.db_path).resolve().as_uri()}?mode=rw', uri=True)
+                try:
+                    with conn:
+                        versions = apply_ops(conn, ops)
+                finally:
+                    conn.close()
+            except Exception as e:
+                with self._lock:
+                    self._inflight = []
+                    self._failures += 1
+                    if self._failures < MAX_FLUSH_ATTEMPTS:
+                        self._pending[:0] = ops  # retried on the next flush
+                    else:
+                        self._failures = 0
+                        # the cached entries hold the dropped writes; reload them
+                        for user_id in {op[1] for op in ops}:
+                            self._entries.pop(user_id, None)
+                if self._failures:
+                    logger.error("Profile store flush of %d operations failed: %s", len(ops), e)
+                else:
+                    logger.error("Profile store flush of %d operations failed %d times, dropping them: %s",
+                                 len(ops), MAX_FLUSH_ATTEMPTS, e)
+                return 0
+            with self._lock:
+                self._inflight = []
+                self._failures = 0
+                # reloaded on the next read: an entry cached while the batch was
+                # committing may hold its rows and its operations both
+                for user_id in versions:
+                    self._entries.pop(user_id, None)
+            return len(ops)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profile-store-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            # gather whatever else arrives within the interval into the same batch
+            self._stop.wait(self.flush_interval)
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
@@ -0,0 +1,95 @@
+# rec_cache.py - per-user cache for /recommendations/<user_id>
+#
+# A user's recommendations only change when their preferences, their
+# watchlist/seen set, or the catalog change.  user_rec_versions holds two
+# counters per user that the write endpoints bump in the same transaction as
+# their change; together with the catalog version (catalog.py) they form the
+# cache key, so every worker process can validate its cached entry with one
+# primary-key lookup.  Entries hold the enriched response.  One whose
+# enrichment came back degraded (an external lookup failed) expires after a
+# short TTL instead, so that it is redone soon rather than served until the
+# user's inputs change.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+def ensure_rec_cache_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_rec_versions (
+            user_id TEXT PRIMARY KEY,
+            prefs_version INTEGER NOT NULL DEFAULT 0,
+            activity_version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # one small row per cache hit instead of a full recommendation_records row
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS recommendation_hits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            record_id INTEGER,
+            served_at REAL
+        )
+    ''')
+
+
+def bump_user_version(db, user_id, prefs=False, activity=False):
+    """Invalidate `user_id`'s cached recommendations (no commit).
+
+    prefs: preferences/favourites/settings changed.  activity: watchlist or
+    seen (rated feedback) changed.
+    """
+    db.execute(
+        'INSERT INTO user_rec_versions (user_id, prefs_version, activity_version) VALUES (?, ?, ?) '
+        'ON CONFLICT(user_id) DO UPDATE SET prefs_version = prefs_version + excluded.prefs_version, '
+        'activity_version = activity_version + excluded.activity_version',
+        (user_id, int(prefs), int(activity))
+    )
+
+
+def get_user_versions(db, user_id):
+    row = db.execute(
+        'SELECT prefs_version, activity_version FROM user_rec_versions WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+class RecommendationCache:
+    """Thread-safe LRU of user_id -> (key, record, payload, expires).
+
+    `record` identifies the recommendation_records row the payload was logged
+    as (the batch_writer.PendingWrite that inserts it).  `expires` is a
+    time.monotonic() deadline, or None for an entry kept until its key changes.
+    """
+
+    def __init__(self, max_users=10000):
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key):
+        """(record, payload) if the cached entry was built for `key` and has not expired, else None."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != key:
+                return None
+            if entry[3] is not None and entry[3] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1], entry[2]
+
+    def put(self, user_id, key, record, payload, ttl=None):
+        with self._lock:
+            self._entries[user_id] = (key, record, payload, None if ttl is None else time.monotonic() + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,80 @@
+# rec_pipeline.py - two-stage candidate generation + re-ranking for /recommendations
+#
+# Stage 1: cheap candidate generators each propose up to `budget` movie
+# rowids from a single signal:
+#   preference  inverted-index hits on the user's titles, directors, actors,
+#               genres and learned affinity features (the max-score posting-
+#               list walk, stopped at the budget)
+#   neighbours  item-CF neighbours of the user's well-rated and favourite movies
+#   popular     the most-rated movies
+# Filter: the user's seen/watchlist movies are dropped from the union.
+# Stage 2: the re-ranker scores only the surviving candidates with every
+# signal combined (preference + learned affinity + CF bonus + popularity
+# prior) and keeps the top N.
+#
+# Generators are plain callables `fn(budget) -> iterable of rowids`, so the
+# caller can plug in or drop sources.  Every stage is timed into `trace`,
+# which /recommendations/<user_id>?debug=1 returns.
+import heapq
+import math
+import time
+
+import item_cf
+
+
+def neighbour_candidates(db, seeds, budget):
+    """Rowids of the `budget` strongest item-CF neighbours of `seeds` ({rowid: rating})."""
+    scores = item_cf.cf_scores(db, seeds)
+    return [m for m, _ in heapq.nlargest(budget, scores.items(), key=lambda x: x[1])]
+
+
+def popularity_prior(db, rowids, weight):
+    """{rowid: weight * log(1 + n_ratings)} for the rated movies among `rowids`."""
+    if not weight:
+        return {}
+    out = {}
+    ids = list(rowids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        for movie_rowid, n in db.execute(
+                f"SELECT movie_rowid, n_ratings FROM item_norms WHERE movie_rowid IN ({','.join('?' * len(chunk))})",
+                chunk):
+            if n:
+                out[movie_rowid] = weight * math.log1p(n)
+    return out
+
+
+class StageTimer:
+    """Collects {'stage', 'ms', 'count'} entries into `trace` (a list, or None)."""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def run(self, stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        if self.trace is not None:
+            self.trace.append({
+                'stage': stage,
+                'ms': round((time.perf_counter() - start) * 1000, 3),
+                'count': len(result),
+            })
+        return result
+
+
+def run_pipeline(generators, exclude, load_movies, rerank, budget, top_n, trace=None):
+    """Two-stage top N.
+
+    generators:  [(name, fn(budget) -> rowids)]
+    exclude:     rowid -> bool, applied between the stages
+    load_movies: rowids -> {rowid: MovieFeatures}
+    rerank:      (movies, top_n) -> [(score, MovieFeatures)]
+    """
+    timer = StageTimer(trace)
+    candidates = set()
+    for name, generate in generators:
+        candidates.update(timer.run(f'candidates:{name}', lambda: list(generate(budget))))
+    kept = timer.run('filter', lambda: [r for r in candidates if not exclude(r)])
+    movies = timer.run('load', load_movies, kept)
+    # rowid order, so equal scores and titles break ties like a full scan
+    return timer.run('rerank', rerank, [movies[r] for r in sorted(movies)], top_n)
@@ -1,14 +1,49 @@
 # server.py  (replacement - removes similarity.pkl & pandas)
-from flask import Flask, request, jsonify, g
+from flask import Flask, Response, request, jsonify, g, stream_with_context
 from flask_cors import CORS
-import sqlite3
-from pathlib import Path
 import re
 import os
 import json
 import time
 import requests
 import logging
+import threading
+import atexit
+import itertools
+
+from catalog import changed_rowids, ensure_catalog_state, ensure_movies_table, get_catalog_version
+from rec_cache import RecommendationCache, bump_user_version, ensure_rec_cache_schema, get_user_versions
+from precompute import ensure_precompute_schema, load_fresh_precomputed
+from shard_pool import get_shard_pool
+from bitmap_index import from_rowids, get_bitmap_index, iter_rowids
+from rec_pipeline import neighbour_candidates, popularity_prior, run_pipeline
+import trending
+import cold_start
+import profile_store
+import migrations
+import bulk_io
+import database
+from batch_writer import BatchWriter
+from catalog_snapshot import ACTOR_COLUMNS, Contains, Equals, Excludes, get_catalog_snapshot
+from user_context import PreferencesCache, UserContext, copy_preferences, parse_preferences
+import item_cf
+import affinity
+from features import (
+    SPLIT_RE, split_field, MovieFeatures, PreferenceProfile,
+    FeatureCache, get_feature_cache, iter_movie_features, load_movie_features, rank_by_preference, similarity_score
+)
+
+try:
+    from ann_index import LSHIndex, content_features
+except ImportError:  # numpy not installed: /similar stays on the SQL candidate scan
+    LSHIndex = None
+    content_features = None
+
+try:
+    import numpy as np
+    from vector_scorer import get_vector_scorer
+except ImportError:  # numpy not installed: recommenders use the per-movie loop
+    get_vector_scorer = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -42,39 +77,127 @@ WATCHMODE_SOURCES_URL = "https://api.watchmode.com/v1/title/{id}/sources/"
 MAX_RETRIES = 2
 INITIAL_DELAY = 1.0  # seconds
 
-# separators for genres/tags/actor fields (handles spaces, '|', ',', ';', '/', '&', and the word 'and')
-SPLIT_RE = re.compile(r'(?:\s+|[|,;/&]|\band\b)', re.IGNORECASE)
+# Approximate nearest-neighbour candidate generation for /similar.
+# Used automatically once the catalog reaches ANN_MIN_CATALOG_SIZE rows, or per
+# request with ?mode=ann (?mode=exact forces the SQL candidate scan).
+ANN_MIN_CATALOG_SIZE = int(os.getenv('ANN_MIN_CATALOG_SIZE', 50000))
+ANN_CANDIDATES = int(os.getenv('ANN_CANDIDATES', 200))
+ANN_PARAMS = {
+    'n_tables': int(os.getenv('ANN_TABLES', 16)),
+    'n_probes': int(os.getenv('ANN_PROBES', 0)),
+    'idf_power': float(os.getenv('ANN_IDF_POWER', 2.0)),
+}
+
+# Catalogs larger than FEATURE_CACHE_MAX_MOVIES are not kept tokenized in
+# memory: the recommenders stream movies_flat in SCAN_CHUNK_SIZE chunks and
+# keep only a bounded top-N heap.
+FEATURE_CACHE_MAX_MOVIES = int(os.getenv('FEATURE_CACHE_MAX_MOVIES', 1000000))
+SCAN_CHUNK_SIZE = int(os.getenv('SCAN_CHUNK_SIZE', 1000))
+
+# The movie lookups and searches (/movie, /movies/<id>, /search, ...) are
+# served from an in-memory copy of movies_flat (catalog_snapshot.py) for
+# catalogs of up to CATALOG_SNAPSHOT_MAX_MOVIES rows; larger ones are queried.
+CATALOG_SNAPSHOT_MAX_MOVIES = int(os.getenv('CATALOG_SNAPSHOT_MAX_MOVIES', 1000000))
+
+# How the in-memory recommenders take the top N: 'maxscore' walks the feature
+# posting lists heaviest first and stops once no unseen movie can make the
+# cut (vector_scorer.VectorScorer.top_maxscore); 'full' scores every movie;
+# 'auto' uses max-score from MAXSCORE_MIN_CATALOG_SIZE movies up, below which
+# the full mat-vec is cheaper than the pruning bookkeeping.
+REC_RETRIEVAL = os.getenv('REC_RETRIEVAL', 'auto')
+MAXSCORE_MIN_CATALOG_SIZE = int(os.getenv('MAXSCORE_MIN_CATALOG_SIZE', 100000))
+
+# From SHARD_MIN_CATALOG_SIZE movies up, user recommendations are scored by
+# SCORING_SHARDS worker processes that each hold rowid % SCORING_SHARDS of
+# the catalog (shard_pool.py), keeping the scan off the request thread's GIL.
+# 0 disables the pool.
+SCORING_SHARDS = int(os.getenv('SCORING_SHARDS', 0))
+SHARD_MIN_CATALOG_SIZE = int(os.getenv('SHARD_MIN_CATALOG_SIZE', 200000))
+
+# /recommendations ranks in two stages (rec_pipeline.py): each generator in
+# REC_GENERATORS proposes up to REC_CANDIDATES movies, and only their union is
+# re-scored with every signal.  REC_PIPELINE=full scores the whole catalog.
+# REC_POPULARITY_WEIGHT scales the log(1 + ratings) prior of the re-ranker.
+REC_PIPELINE = os.getenv('REC_PIPELINE', 'two_stage')
+REC_CANDIDATES = int(os.getenv('REC_CANDIDATES', 300))
+REC_GENERATORS = [g.strip() for g in os.getenv('REC_GENERATORS', 'preference,neighbours,popular').split(',') if g.strip()]
+REC_POPULARITY_WEIGHT = float(os.getenv('REC_POPULARITY_WEIGHT', 0))
+
+# Trending counters (trending.py) are fed from publish_event ('local') or by
+# consuming the Kafka topic ('kafka'); re-ranked and checkpointed to SQLite
+# every TRENDING_REFRESH_SECONDS / TRENDING_CHECKPOINT_SECONDS.
+TRENDING_SOURCE = os.getenv('TRENDING_SOURCE', 'local')
+TRENDING_REFRESH_SECONDS = float(os.getenv('TRENDING_REFRESH_SECONDS', 5))
+TRENDING_CHECKPOINT_SECONDS = float(os.getenv('TRENDING_CHECKPOINT_SECONDS', 60))
+
+# Cold-start lists (cold_start.py) are rebuilt in the background once older
+# than this many seconds; 0 leaves rebuilding to `python cold_start.py`.
+COLD_START_MAX_AGE = int(os.getenv('COLD_START_MAX_AGE', 21600))
+
+# Most seeds accepted by one POST /similar/batch request
+SIMILAR_BATCH_MAX_SEEDS = int(os.getenv('SIMILAR_BATCH_MAX_SEEDS', 50))
+
+# Title lists behind /user/watchlist, /user/seen and /user/feedback
+# (profile_store.py): users cached per process, and how long writes are
+# batched before they are flushed to SQLite for the other workers.
+PROFILE_CACHE_MAX_USERS = int(os.getenv('PROFILE_CACHE_MAX_USERS', 10000))
+PROFILE_FLUSH_MS = float(os.getenv('PROFILE_FLUSH_MS', 50))
+
+# Append-only rows (recommendation_records, recommendation_hits, bug_reports)
+# are committed by a background thread (batch_writer.py) in batches of up to
+# WRITE_BATCH_ROWS rows or WRITE_BATCH_MS milliseconds.  Requests wait for the
+# writer only once WRITE_QUEUE_SIZE rows are queued.
+WRITE_BATCH_ROWS = int(os.getenv('WRITE_BATCH_ROWS', 500))
+WRITE_BATCH_MS = float(os.getenv('WRITE_BATCH_MS', 20))
+WRITE_QUEUE_SIZE = int(os.getenv('WRITE_QUEUE_SIZE', 10000))
+
+# POST /users/import (bulk_io.py) commits every BULK_IMPORT_BATCH_ROWS valid
+# lines and lists at most BULK_IMPORT_MAX_ERRORS rejected lines in its report.
+BULK_IMPORT_BATCH_ROWS = int(os.getenv('BULK_IMPORT_BATCH_ROWS', 10000))
+BULK_IMPORT_MAX_ERRORS = int(os.getenv('BULK_IMPORT_MAX_ERRORS', 1000))
+
+# Parsed users_preferences blobs are reused across requests for up to
+# PREFS_CACHE_TTL seconds (0 disables), for at most PREFS_CACHE_MAX_USERS
+# users (user_context.py).  Other workers see a preference change within the TTL.
+PREFS_CACHE_TTL = float(os.getenv('PREFS_CACHE_TTL', 5))
+PREFS_CACHE_MAX_USERS = int(os.getenv('PREFS_CACHE_MAX_USERS', 10000))
+
+# Per-process LRU of /recommendations/<user_id> responses (see rec_cache.py);
+# a response with a failed enrichment lookup is kept REC_CACHE_DEGRADED_TTL seconds
+REC_CACHE_MAX_USERS = int(os.getenv('REC_CACHE_MAX_USERS', 10000))
+REC_CACHE_DEGRADED_TTL = float(os.getenv('REC_CACHE_DEGRADED_TTL', 60))
+# Weight of the item-item collaborative filtering signal (item_cf.py) blended
+# into /recommendations; 0 disables it.  CF_NEIGHBOURS is K per movie.
+CF_WEIGHT = float(os.getenv('CF_WEIGHT', item_cf.DEFAULT_WEIGHT))
+CF_NEIGHBOURS = int(os.getenv('CF_NEIGHBOURS', 50))
+# Results written by precompute.py are served while younger than this (seconds)
+PRECOMPUTE_MAX_AGE = int(os.getenv('PRECOMPUTE_MAX_AGE', 86400))
 
 # -----------------------
 # DB helpers
 # -----------------------
+# Connections are long-lived, per thread and tuned (WAL, mmap, ...); see database.py
 def get_db():
     db = getattr(g, "_database", None)
     if db is None:
-        db_path = Path(DATABASE)
-        if not db_path.exists():
-            raise RuntimeError(f"Database file not found: {DATABASE}. Create it first.")
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = database.connection(DATABASE)
+    return db
+
+def get_read_db():
+    """Read-only connection for GET endpoints that never write; its reads do not wait on writers."""
+    db = getattr(g, "_read_database", None)
+    if db is None:
+        db = g._read_database = database.connection(DATABASE, readonly=True)
     return db
 
 @app.teardown_appcontext
 def close_connection(exc):
-    db = getattr(g, "_database", None)
-    if db is not None:
-        db.close()
+    # the connections are reused; only discard what the request left uncommitted
+    database.release()
 
 def row_to_dict(row):
     return {k: row[k] for k in row.keys()}
 
-def split_field(s):
-    if s is None:
-        return []
-    s = str(s).strip()
-    if s == "":
-        return []
-    return [part.strip().lower() for part in SPLIT_RE.split(s) if part.strip()]
-
 
 # -----------------------
 # Kafka producer (event stream)
@@ -110,6 +233,34 @@ def publish_event(event_type, payload):
     else:
         # fallback logging when Kafka is not initialized
         logger.info("Kafka producer not initialized. Event: %s", event)
+    if TRENDING_SOURCE == 'local':
+        try:
+            get_trending_consumer().submit(event)
+        except Exception as e:
+            logger.error("Trending submit error for event '%s': %s", event_type, e)
+
+
+_trending_lock = threading.Lock()
+_trending_consumer = None
+
+
+def get_trending_consumer():
+    """The process-wide TrendingConsumer, started on first use (restarted if DATABASE changed)."""
+    global _trending_consumer
+    consumer = _trending_consumer
+    if consumer is not None and consumer.db_path == DATABASE:
+        return consumer
+    with _trending_lock:
+        consumer = _trending_consumer
+        if consumer is None or consumer.db_path != DATABASE:
+            if consumer is not None:
+                consumer.stop()
+            consumer = trending.TrendingConsumer(DATABASE, TRENDING_REFRESH_SECONDS,
+                                                 TRENDING_CHECKPOINT_SECONDS).start()
+            if TRENDING_SOURCE == 'kafka' and KAFKA_BOOTSTRAP:
+                trending.consume_kafka(consumer, KAFKA_BOOTSTRAP)
+            _trending_consumer = consumer
+        return consumer
 
 def fetch_streaming_platforms(title):
     """
@@ -329,6 +480,11 @@ def fetch_ratings(title):
             
     return {}
 
+def enrichment_degraded(movie):
+    """Whether enrich_movie_info left a movie without its synopsis or OMDB scores."""
+    return not movie.get('synopsis') or movie.get('imdb_score', 'N/A') == 'N/A'
+
+
 def enrich_movie_info(movie):
     """Given a movie dict from the DB, add `synopsis` and `platforms` keys if possible.
     This function is best-effort and will not raise.
@@ -386,23 +542,8 @@ def init_db_schema():
     db = get_db()
     cur = db.cursor()
     
-    # Movies table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS movies_flat (
-            rowid INTEGER PRIMARY KEY,
-            director_name TEXT,
-            actor_1_name TEXT,
-            actor_2_name TEXT,
-            actor_3_name TEXT,
-            genres TEXT,
-            movie_title TEXT,
-            tags TEXT,
-            movie_title_lower TEXT,
-            synopsis TEXT,
-            rating REAL,
-            platforms TEXT
-        )
-    ''')
+    # Movies table (see catalog.py)
+    ensure_movies_table(cur)
     
     # Users basic table
     cur.execute('''
@@ -469,8 +610,23 @@ def init_db_schema():
             created_at REAL
         )
     ''')
+    # catalog version counter + movies_flat triggers (see catalog.py)
+    ensure_catalog_state(cur)
+    # per-user version counters for the recommendation cache (see rec_cache.py)
+    ensure_rec_cache_schema(cur)
+    # offline results from precompute.py
+    ensure_precompute_schema(cur)
+    # item-item CF model built from users_feedback
+    item_cf.ensure_item_cf_schema(cur)
+    # materialized per-user profiles read by the recommenders
+    affinity.ensure_affinity_schema(cur)
+    trending.ensure_trending_schema(cur)
+    cold_start.ensure_cold_start_schema(cur)
+    profile_store.ensure_profile_store_schema(cur)
 
     db.commit()
+    # indexes and constraints on tables that already exist (see migrations.py)
+    migrations.migrate(db)
 
 
 # Initialize schema at startup
@@ -480,11 +636,243 @@ try:
 except Exception as e:
     print('Warning: init_db_schema failed:', e)
 
+# -----------------------
+# ANN index over movie content features (used by /similar on large catalogs)
+# -----------------------
+_ann_lock = threading.Lock()
+_ann_state = {'index': None, 'version': None}
+# new movies appended in place at most; more are cheaper to index in a rebuild
+ANN_PATCH_MAX_APPENDS = 1000
+
+
+def movie_content_features(features):
+    """Weighted content features of a MovieFeatures, matching similarity_score."""
+    return content_features(features.director, features.actors, features.genres, features.tags)
+
+
+def get_ann_index(db):
+    """Return the process-wide LSH index, kept in step with the catalog version.
+
+    Movies inserted since the last call (catalog.changed_rowids, e.g.
+    through admin.py) are appended in place, which requests querying the
+    index concurrently tolerate.  Updates and deletes build a new index that
+    is swapped in: LSHIndex.remove compacts every array, far slower per movie
+    than a rebuild and unsafe under concurrent queries.  More than
+    ANN_PATCH_MAX_APPENDS inserts, a different database or a bulk rewrite
+    rebuild too.
+    """
+    catalog = get_feature_cache(db)
+    version = catalog.version
+    with _ann_lock:
+        index = _ann_state['index']
+        prev = _ann_state['version']
+        if index is not None and version is not None and version == prev:
+            return index
+        changed = changed_rowids(db, prev, version, len(index)) if index is not None else None
+        appends = changed is not None and len(changed) <= ANN_PATCH_MAX_APPENDS and \
+            all(rowid in catalog.by_rowid and rowid not in index for rowid in changed)
+        if appends:
+            for rowid in changed:
+                index.add(rowid, movie_content_features(catalog.by_rowid[rowid]))
+        else:
+            start = time.time()
+            index = LSHIndex(**ANN_PARAMS).build((f.rowid, movie_content_features(f)) for f in catalog.movies)
+            logger.info("ANN index built over %d movies in %.2fs", len(catalog), time.time() - start)
+        _ann_state.update(index=index, version=version)
+        return index
+
+
+def catalog_size_hint(db):
+    # MAX(rowid) is an O(log n) stand-in for the catalog size
+    return db.execute(f"SELECT MAX(rowid) FROM {MOVIES_TABLE}").fetchone()[0] or 0
+
+
+def use_feature_cache(db):
+    return catalog_size_hint(db) <= FEATURE_CACHE_MAX_MOVIES
+
+
+def get_catalog(db):
+    """The in-memory CatalogSnapshot, or None when the catalog is too large to keep one."""
+    return get_catalog_snapshot(db, CATALOG_SNAPSHOT_MAX_MOVIES)
+
+
+def rank_movies_for_profile(db, profile, top_n, exclude_rowids=(), exclude_titles=(), bonus=None,
+                            maxscore=None, stats=None):
+    """Top `top_n` (score, MovieFeatures) for a PreferenceProfile.
+
+    Movies whose rowid (as str, like get_user_watchlist_set) is in
+    `exclude_rowids` or whose normalized title is in `exclude_titles` are
+    skipped; `bonus` ({rowid: score}) is added to the preference score.
+    Very large catalogs are scattered across the shard pool when it is
+    enabled; otherwise small catalogs go through the in-memory scorers and
+    larger ones are streamed from SQLite with a bounded heap.  `maxscore`
+    overrides REC_RETRIEVAL for the in-memory scorers; `stats` receives
+    VectorScorer.top_maxscore's posting counts when it is used in process.
+    """
+    size = catalog_size_hint(db)
+    if SCORING_SHARDS > 0 and size >= SHARD_MIN_CATALOG_SIZE:
+        try:
+            return get_shard_pool(DATABASE, SCORING_SHARDS).top(
+                profile, top_n, get_catalog_version(db), exclude_rowids, exclude_titles, bonus,
+                maxscore=use_maxscore(size // SCORING_SHARDS) if maxscore is None else maxscore
+            )
+        except Exception as e:
+            logger.warning("Shard pool scoring failed, scoring in process: %s", e)
+    if use_feature_cache(db):
+        if get_vector_scorer is not None:
+            scorer = get_vector_scorer(db)
+            exclude = scorer.positions_for_rowids(exclude_rowids)
+            if exclude_titles:
+                exclude = np.union1d(exclude, scorer.positions_for_titles(exclude_titles))
+            if use_maxscore(len(scorer)) if maxscore is None else maxscore:
+                return scorer.top_maxscore(profile, top_n, exclude=exclude, bonus=scorer.bonus_vector(bonus),
+                                           stats=stats)
+            return scorer.top(profile, top_n, exclude=exclude, bonus=scorer.bonus_vector(bonus))
+        movies = get_feature_cache(db).movies
+    else:
+        movies = iter_movie_features(db, SCAN_CHUNK_SIZE)
+    return rank_by_preference(
+        movies, profile, top_n,
+        skip=lambda m: str(m.rowid) in exclude_rowids or m.title_key in exclude_titles,
+        bonus=bonus
+    )
+
+
+def use_maxscore(catalog_size):
+    if REC_RETRIEVAL == 'auto':
+        return catalog_size >= MAXSCORE_MIN_CATALOG_SIZE
+    return REC_RETRIEVAL == 'maxscore'
+
+
+def use_ann_for_similar(db, mode):
+    if LSHIndex is None or mode == 'exact':
+        return False
+    if mode == 'ann':
+        return True
+    return catalog_size_hint(db) >= ANN_MIN_CATALOG_SIZE
+
+
+def similar_candidate_clauses(features):
+    """[(sql, params)] matching any movie that shares a /similar feature with `features`."""
+    clauses = []
+    # director equality (normalized lower)
+    if features.director:
+        clauses.append(("LOWER(director_name) = ?", (features.director,)))
+    # actors - match exact actor names in any actor column
+    for actor_name in sorted(features.actors):
+        clauses.append(("(LOWER(actor_1_name) = ? OR LOWER(actor_2_name) = ? OR LOWER(actor_3_name) = ?)",
+                        (actor_name, actor_name, actor_name)))
+    # genres/tags - partial match with LIKE (match any genre/tag string)
+    for g in sorted(features.genres):
+        clauses.append(("LOWER(genres) LIKE ?", (f"%{g}%",)))
+    for t in sorted(features.tags):
+        clauses.append(("LOWER(tags) LIKE ?", (f"%{t}%",)))
+    return clauses
+
+
+def ann_similar_ids(db, features, exclude):
+    """Rowids of the ANN_CANDIDATES nearest neighbours of `features`."""
+    hits = get_ann_index(db).query(movie_content_features(features), k=ANN_CANDIDATES,
+                                   min_candidates=ANN_CANDIDATES, exclude=exclude)
+    return [mid for _, mid in hits]
+
+
+def get_movie_bitmaps(db):
+    return get_bitmap_index(db, get_feature_cache(db).movies if use_feature_cache(db) else None)
+
+
+def split_terms(value):
+    return [t.strip() for t in (value or '').split(',') if t.strip()]
+
+
+def genre_bitmap_filter(db, args):
+    """Bitmap for the genre / genre_any / genre_not query params, None when absent."""
+    all_of, any_of, none_of = (split_terms(args.get(k)) for k in ('genre', 'genre_any', 'genre_not'))
+    if not (all_of or any_of or none_of):
+        return None
+    return get_movie_bitmaps(db).genre_filter(all_of, any_of, none_of)
+
+
+def tag_bitmap(db, term):
+    """Bitmap of the movies whose tags contain every token of `term` as a whole token.
+
+    Tokens with a MovieBitmaps tag bitmap are intersected directly.  The
+    rarer ones are found with LIKE, which also matches inside longer words,
+    and each candidate's tags are then split (features.split_field) so that
+    only whole tokens count, as they do in the bitmaps.
+    """
+    bitmaps = get_movie_bitmaps(db)
+    out = bitmaps.tag(term)
+    if out is not None:
+        return out
+    tokens = set(split_field(term))
+    rare = sorted(t for t in tokens if t not in bitmaps.tags)
+    clause = ' AND '.join(['LOWER(tags) LIKE ?'] * len(rare))
+    cur = db.execute(f"SELECT rowid, tags FROM {MOVIES_TABLE} WHERE {clause}", [f"%{t}%" for t in rare])
+    out = from_rowids(rowid for rowid, tags in cur if set(split_field(tags)).issuperset(rare))
+    for token in tokens.difference(rare):
+        out &= bitmaps.tags[token]
+    return out
+
+
+def find_movies(db, filters, limit, bitmap=None):
+    """Up to `limit` movies (dicts) passing every filter, restricted to the rowids set in `bitmap`.
+
+    `filters` are catalog_snapshot Contains/Equals/Excludes.  They are
+    matched against the catalog snapshot when there is one.  Otherwise
+    without a bitmap this is a plain filtered scan; with one, only the rowids
+    in the bitmap are read, 500 at a time in rowid order, until `limit` rows
+    also pass the filters.
+    """
+    snapshot = get_catalog(db)
+    if snapshot is not None:
+        positions = None if bitmap is None else snapshot.positions(iter_rowids(bitmap))
+        return [snapshot.movie(pos) for pos in snapshot.find(filters, limit, positions)]
+    where, params = [], []
+    for f in filters:
+        clause, clause_params = f.sql()
+        where.append(clause)
+        params.extend(clause_params)
+    cond = ' AND '.join(where)
+    if bitmap is None:
+        sql = f"SELECT * FROM {MOVIES_TABLE}" + (f" WHERE {cond}" if cond else "") + " LIMIT ?"
+        return [row_to_dict(r) for r in db.execute(sql, (*params, limit))]
+    rows = []
+    rowids = iter_rowids(bitmap)
+    while len(rows) < limit:
+        chunk = list(itertools.islice(rowids, 500))
+        if not chunk:
+            break
+        sql = (f"SELECT * FROM {MOVIES_TABLE} WHERE rowid IN ({','.join('?' * len(chunk))})"
+               + (f" AND {cond}" if cond else "") + " ORDER BY rowid LIMIT ?")
+        rows.extend(db.execute(sql, (*chunk, *params, limit - len(rows))).fetchall())
+    return [row_to_dict(r) for r in rows]
+
+
+def find_movie_by_title(db, title, id_key=None):
+    """The first movie titled `title` (normalized), else the first whose title contains it; None if neither.
+
+    With `id_key` the movie's rowid is included under that key.
+    """
+    title = title.strip().lower()
+    snapshot = get_catalog(db)
+    if snapshot is not None:
+        pos = snapshot.find_title(title)
+        return None if pos is None else snapshot.movie(pos, id_key)
+    columns = f"rowid AS {id_key}, *" if id_key else "*"
+    row = db.execute(f"SELECT {columns} FROM {MOVIES_TABLE} WHERE LOWER(TRIM(movie_title)) = ? LIMIT 1", (title,)).fetchone()
+    if not row:
+        # try partial match (first match)
+        row = db.execute(f"SELECT {columns} FROM {MOVIES_TABLE} WHERE LOWER(movie_title) LIKE ? LIMIT 1",
+                         (f"%{title}%",)).fetchone()
+    return row_to_dict(row) if row else None
+
+
 # -----------------------
 # SEARCH endpoint
 # Supports query params:
 #   - title (partial match)
-#   - genre (partial or full)
+#   - genre, genre_any, genre_not (comma-separated genres: all / any / none)
 #   - director (partial or full)
 #   - actor (partial or full)
 #
@@ -493,44 +881,29 @@ except Exception as e:
 # -----------------------
 @app.route("/search", methods=["GET"])
 def search():
-    params = []
-    where_clauses = []
+    filters = []
 
     title = request.args.get("title")
     genre = request.args.get("genre")
     director = request.args.get("director")
     actor = request.args.get("actor")
     limit = int(request.args.get("limit", 100))
+    db = get_read_db()
 
     if title:
-        where_clauses.append("LOWER(movie_title) LIKE ?")
-        params.append(f"%{title.strip().lower()}%")
+        filters.append(Contains(('movie_title',), title))
     if director:
-        where_clauses.append("LOWER(director_name) LIKE ?")
-        params.append(f"%{director.strip().lower()}%")
+        filters.append(Contains(('director_name',), director))
     if actor:
         # check actor_1_name, actor_2_name, actor_3_name
-        sub = "(LOWER(actor_1_name) LIKE ? OR LOWER(actor_2_name) LIKE ? OR LOWER(actor_3_name) LIKE ?)"
-        where_clauses.append(sub)
-        aterm = f"%{actor.strip().lower()}%"
-        params.extend([aterm, aterm, aterm])
-    if genre:
-        # genre field contains a delimited list - partial match ok
-        where_clauses.append("LOWER(genres) LIKE ?")
-        params.append(f"%{genre.strip().lower()}%")
-
-    sql = f"SELECT * FROM {MOVIES_TABLE}"
-    if where_clauses:
-        sql += " WHERE " + " AND ".join(where_clauses)
-    sql += " LIMIT ?"
-    params.append(limit)
-
-    db = get_db()
-    cur = db.execute(sql, params)
-    rows = cur.fetchall()
-    results = [row_to_dict(r) for r in rows]
-    # enrich results with synopsis/platforms (best-effort)
-    enriched = [enrich_movie_info(dict(r)) for r in results]
+        filters.append(Contains(ACTOR_COLUMNS, actor))
+    # genre, genre_any, genre_not: comma-separated genres that must all / at
+    # least one / none match, answered from the genre bitmaps
+    bitmap = genre_bitmap_filter(db, request.args)
+
+    results = find_movies(db, filters, limit, bitmap)
+    # enrich results with synopsis/platforms (best-effort); the dicts are new
+    enriched = [enrich_movie_info(r) for r in results]
     publish_event('search_performed', {'title': title, 'genre': genre, 'director': director, 'actor': actor, 'limit': limit})
     return jsonify({"count": len(enriched), "results": enriched})
 
@@ -548,118 +921,82 @@ def similar():
     top_n = int(request.args.get("top", 5))
     title = title_raw.strip().lower()
 
-    db = get_db()
+    db = get_read_db()
 
-    # find the target movie row (case-insensitive exact match or best partial match)
-    cur = db.execute(f"SELECT * FROM {MOVIES_TABLE} WHERE LOWER(TRIM(movie_title)) = ? LIMIT 1", (title,))
-    row = cur.fetchone()
-    if not row:
-        # try partial match (first match)
-        cur = db.execute(f"SELECT * FROM {MOVIES_TABLE} WHERE LOWER(movie_title) LIKE ? LIMIT 1", (f"%{title}%",))
-        row = cur.fetchone()
-        if not row:
-            return jsonify({"error": "Movie not found"}), 404
-
-    target = row_to_dict(row)
-
-    # extract features from target
-    target_director = target.get("director_name", "")
-    target_actors = []
-    for col in ("actor_1_name", "actor_2_name", "actor_3_name"):
-        v = target.get(col)
-        if v:
-            target_actors.extend(split_field(v))
-    target_genres = split_field(target.get("genres", ""))
-    target_tags = split_field(target.get("tags", ""))
+    # find the target movie (case-insensitive exact match or best partial match)
+    target = find_movie_by_title(db, title, id_key="target_rowid")
+    if target is None:
+        return jsonify({"error": "Movie not found"}), 404
+    target_rowid = target.pop("target_rowid")
+
+    # pre-tokenized features (tokenizes on the fly if the row is newer than the
+    # cache, or always when the catalog is too large to cache)
+    catalog = get_feature_cache(db) if use_feature_cache(db) else FeatureCache([], None)
+    target_features = catalog.get(target_rowid, target)
 
     # optional user_id parameter: exclude user's watchlist/seen from results
     user_id_param = request.args.get('user_id')
     user_watchlist = set()
     user_seen = set()
     if user_id_param:
-        u = user_profiles.get(user_id_param)
-        if u:
-            user_watchlist = set([m.lower().strip() for m in (u.get('watchlist') or [])])
-            user_seen = set([m.lower().strip() for m in (u.get('seen') or [])])
+        u = get_profile_store().get(db, user_id_param)
+        user_watchlist = set([m.lower().strip() for m in u.watchlist])
+        user_seen = set([m.lower().strip() for m in u.seen])
 
     # Build candidate SQL: any row that shares director, actor, genre, or tag.
-    # We'll construct OR clauses for director equality, actor columns (LIKE), and genres/tags LIKE
     candidate_clauses = []
     candidate_params = []
-
-    # director equality (normalized lower)
-    if target_director:
-        candidate_clauses.append("LOWER(director_name) = ?")
-        candidate_params.append(target_director.strip().lower())
-
-    # actors - check any actor column equals any actor name (lowered)
-    for actor_name in target_actors:
-        # match exact actor names in any actor column
-        candidate_clauses.append("(LOWER(actor_1_name) = ? OR LOWER(actor_2_name) = ? OR LOWER(actor_3_name) = ?)")
-        candidate_params.extend([actor_name, actor_name, actor_name])
-
-    # genres/tags - partial match with LIKE (match any genre/tag string)
-    for g in target_genres:
-        candidate_clauses.append("LOWER(genres) LIKE ?")
-        candidate_params.append(f"%{g}%")
-    for t in target_tags:
-        candidate_clauses.append("LOWER(tags) LIKE ?")
-        candidate_params.append(f"%{t}%")
+    for clause, params in similar_candidate_clauses(target_features):
+        candidate_clauses.append(clause)
+        candidate_params.extend(params)
 
     # fallback: if no features found, return empty
     if not candidate_clauses:
         return jsonify({"error": "No metadata available for this movie to compute similarity"}), 400
 
-    # exclude the movie itself; we'll compare by movie_title (normalized)
-    sql = f"""
-        SELECT * FROM {MOVIES_TABLE}
-        WHERE ({' OR '.join(candidate_clauses)})
-          AND LOWER(TRIM(movie_title)) != ?
-    """
-    candidate_params.append(title)  # exclude target
-    # limit the number of candidates fetched to a reasonable amount to compute scoring
-    sql += " LIMIT 1000"
-
-    cur = db.execute(sql, candidate_params)
-    candidates = [row_to_dict(r) for r in cur.fetchall()]
-
-    # Scoring function (weights)
+    if use_ann_for_similar(db, (request.args.get('mode') or '').strip().lower()):
+        # large catalog: take the nearest neighbours from the ANN index instead of
+        # the OR/LIKE scan, then score them exactly like the SQL candidates below
+        ids = ann_similar_ids(db, target_features, (target_rowid,))
+        candidates = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cur = db.execute(
+                f"SELECT rowid AS _rowid, * FROM {MOVIES_TABLE} WHERE rowid IN ({','.join('?' * len(chunk))}) "
+                "AND LOWER(TRIM(movie_title)) != ?",
+                (*chunk, title)
+            )
+            candidates.extend(cur.fetchall())
+    else:
+        # exclude the movie itself; we'll compare by movie_title (normalized)
+        sql = f"""
+            SELECT rowid AS _rowid, * FROM {MOVIES_TABLE}
+            WHERE ({' OR '.join(candidate_clauses)})
+              AND LOWER(TRIM(movie_title)) != ?
+        """
+        candidate_params.append(title)  # exclude target
+        # limit the number of candidates fetched to a reasonable amount to compute scoring
+        sql += " LIMIT 1000"
+
+        cur = db.execute(sql, candidate_params)
+        candidates = cur.fetchall()
+
+    # Scoring (features.similarity_score):
     # same director -> +5
     # each shared actor -> +3
     # each shared genre -> +1
     # each shared tag -> +0.5
-    def score_candidate(candidate):
-        s = 0.0
-        # director
-        cand_dir = (candidate.get("director_name") or "").strip().lower()
-        if cand_dir and target_director and cand_dir == target_director.strip().lower():
-            s += 5.0
-        # actors
-        cand_actors = []
-        for c in ("actor_1_name", "actor_2_name", "actor_3_name"):
-            cand_actors.extend(split_field(candidate.get(c, "")))
-        # count unique overlaps
-        shared_actors = set(cand_actors).intersection(set(target_actors))
-        s += 3.0 * len(shared_actors)
-        # genres
-        cand_genres = set(split_field(candidate.get("genres", "")))
-        shared_genres = cand_genres.intersection(set(target_genres))
-        s += 1.0 * len(shared_genres)
-        # tags
-        cand_tags = set(split_field(candidate.get("tags", "")))
-        shared_tags = cand_tags.intersection(set(target_tags))
-        s += 0.5 * len(shared_tags)
-        return s
-
     scored = []
-    for c in candidates:
+    for r in candidates:
+        features = catalog.get(r["_rowid"], r)
         # skip if candidate is in user's watchlist or seen list
-        c_title = (c.get('movie_title') or '').strip().lower()
+        c_title = features.title_key
         if c_title and (c_title in user_watchlist or c_title in user_seen):
             continue
-        sc = score_candidate(c)
+        sc = similarity_score(target_features, features)
         if sc > 0:
-            c_with_score = dict(c)
+            c_with_score = row_to_dict(r)
+            del c_with_score["_rowid"]
             c_with_score["score"] = sc
             scored.append(c_with_score)
 
@@ -670,7 +1007,7 @@ def similar():
     top_results = scored_sorted[:top_n]
 
     # Enrich top results with synopsis/platforms
-    enriched_top = [enrich_movie_info(dict(r)) for r in top_results]
+    enriched_top = [enrich_movie_info(r) for r in top_results]
 
     publish_event('similar_movies_requested', {'target_title': target.get('movie_title'), 'top_n': top_n, 'user_id': user_id_param})
     return jsonify({
@@ -680,12 +1017,176 @@ def similar():
     })
 
 
+def resolve_seed_movies(db, seeds):
+    """Seed rows for a list of rowids (ints) and titles (str).
+
+    Returns ([(seed, row)] in request order, [seeds not found]).  Titles are
+    looked up like /similar does (find_movie_by_title: normalized, then
+    partial).  Rowids and exact titles are resolved in one query; only the
+    titles it does not find go through find_movie_by_title.  Duplicates of
+    an already resolved movie are dropped.
+    """
+    ids = list(dict.fromkeys(s for s in seeds if isinstance(s, int) and not isinstance(s, bool)))
+    keys = list(dict.fromkeys(s.strip().lower() for s in seeds if isinstance(s, str) and s.strip()))
+    by_id, by_title = {}, {}
+    for i in range(0, max(len(ids), len(keys)), 400):
+        id_chunk, key_chunk = ids[i:i + 400], keys[i:i + 400]
+        # rowid order: the first movie with a title wins, as in find_movie_by_title
+        for r in db.execute(f"SELECT rowid AS target_rowid, *, LOWER(TRIM(movie_title)) AS _title_key "
+                            f"FROM {MOVIES_TABLE} WHERE rowid IN ({','.join('?' * len(id_chunk))}) "
+                            f"OR LOWER(TRIM(movie_title)) IN ({','.join('?' * len(key_chunk))}) ORDER BY rowid",
+                            id_chunk + key_chunk):
+            row = row_to_dict(r)
+            by_title.setdefault(row.pop('_title_key'), row)
+            by_id[row['target_rowid']] = row
+    resolved, missing, seen = [], [], set()
+    for seed in seeds:
+        if isinstance(seed, str):
+            key = seed.strip().lower()
+            row = by_title.get(key) or (find_movie_by_title(db, seed, id_key='target_rowid') if key else None)
+        else:
+            row = by_id.get(seed)
+        if row is None:
+            missing.append(seed)
+        elif row['target_rowid'] not in seen:
+            seen.add(row['target_rowid'])
+            resolved.append((seed, row))
+    return resolved, missing
+
+
+# -----------------------
+# SIMILAR batch endpoint
+# POST {"seeds": [title or movie_id, ...], "top": 5, "user_id": optional, "mode": optional}
+# One /similar for many seeds: the seeds are resolved in one query and each
+# seed's candidates selected as /similar would, all in one UNION ALL query
+# tagged by seed; every candidate is scored against every seed in one pass,
+# and each movie returned is enriched once.
+# Returns a per-seed breakdown (the seed's /similar list without the other
+# seeds) plus a merged ranking by summed score.
+# -----------------------
+@app.route("/similar/batch", methods=["POST"])
+def similar_batch():
+    data = request.get_json() or {}
+    seeds = data.get('seeds')
+    if not isinstance(seeds, list) or not seeds:
+        return jsonify({"error": "'seeds' must be a non-empty list of titles or movie ids"}), 400
+    if len(seeds) > SIMILAR_BATCH_MAX_SEEDS:
+        return jsonify({"error": f"At most {SIMILAR_BATCH_MAX_SEEDS} seeds per request"}), 400
+    top_n = int(data.get('top', 5))
+
+    db = get_read_db()
+    resolved, missing = resolve_seed_movies(db, seeds)
+    if not resolved:
+        return jsonify({"error": "Movie not found", "not_found": missing}), 404
+
+    catalog = get_feature_cache(db) if use_feature_cache(db) else FeatureCache([], None)
+    targets = [(seed, row['target_rowid'], catalog.get(row['target_rowid'], row)) for seed, row in resolved]
+    seed_rowids = {rowid for _, rowid, _ in targets}
+    seed_titles = {features.title_key for _, _, features in targets}
+
+    excluded = set()
+    user_id_param = data.get('user_id')
+    if user_id_param:
+        u = get_profile_store().get(db, user_id_param)
+        excluded = set([m.lower().strip() for m in u.watchlist + u.seen])
+
+    # each seed's candidates exactly as /similar selects them (its own
+    # clauses and its own LIMIT), read in one query tagged by seed
+    rows, seed_candidates = {}, [[] for _ in targets]
+    use_ann = use_ann_for_similar(db, (data.get('mode') or '').strip().lower())
+    if use_ann:
+        for i, (_, rowid, features) in enumerate(targets):
+            seed_candidates[i] = ann_similar_ids(db, features, (rowid,))
+        ids = list(dict.fromkeys(mid for ids in seed_candidates for mid in ids))
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for r in db.execute(f"SELECT rowid AS _rowid, * FROM {MOVIES_TABLE} "
+                                f"WHERE rowid IN ({','.join('?' * len(chunk))})", chunk):
+                rows[r['_rowid']] = r
+        seed_candidates = [[mid for mid in ids if mid in rows] for ids in seed_candidates]
+    else:
+        selects = []
+        for i, (_, _, features) in enumerate(targets):
+            clauses = similar_candidate_clauses(features)
+            if clauses:
+                selects.append((f"SELECT * FROM (SELECT ? AS _seed, rowid AS _rowid, * FROM {MOVIES_TABLE} "
+                                f"WHERE ({' OR '.join(clause for clause, _ in clauses)}) "
+                                f"AND LOWER(TRIM(movie_title)) != ? LIMIT 1000)",
+                                [i] + [p for _, ps in clauses for p in ps] + [features.title_key]))
+        if not selects:
+            return jsonify({"error": "No metadata available for these movies to compute similarity"}), 400
+        # as few statements as SQLite's default 999 bound parameters allow
+        batches, size = [[]], 0
+        for select in selects:
+            if batches[-1] and size + len(select[1]) > 999:
+                batches.append([])
+                size = 0
+            batches[-1].append(select)
+            size += len(select[1])
+        for batch in batches:
+            sql = ' UNION ALL '.join(sql for sql, _ in batch)
+            for r in db.execute(sql, [p for _, params in batch for p in params]):
+                rows.setdefault(r['_rowid'], r)
+                seed_candidates[r['_seed']].append(r['_rowid'])
+
+    # one pass: every candidate scored against every seed
+    scores = {}
+    for rowid, r in rows.items():
+        features = catalog.get(rowid, r)
+        c_title = features.title_key
+        if rowid in seed_rowids or c_title in seed_titles or (c_title and c_title in excluded):
+            continue
+        scores[rowid] = [similarity_score(target_features, features) for _, _, target_features in targets]
+    per_seed = [[(scores[rowid][i], rows[rowid]['movie_title'], rowid) for rowid in ids
+                 if rowid in scores and scores[rowid][i] > 0]
+                for i, ids in enumerate(seed_candidates)]
+    merged = {rowid: {targets[i][1]: sc for i, sc in enumerate(by_seed) if sc > 0}
+              for rowid, by_seed in scores.items() if any(sc > 0 for sc in by_seed)}
+
+    def order(item):
+        return (-item[0], item[1] or "", item[2])
+
+    per_seed_top = [sorted(scored, key=order)[:top_n] for scored in per_seed]
+    merged_top = sorted(((sum(by_seed.values()), rows[rowid]['movie_title'], rowid)
+                         for rowid, by_seed in merged.items()), key=order)[:top_n]
+
+    # enrich the union of everything returned, once per movie
+    enriched = {}
+    for _, _, rowid in [item for top in per_seed_top for item in top] + merged_top:
+        if rowid not in enriched:
+            movie = row_to_dict(rows[rowid])
+            del movie["_rowid"]
+            movie.pop("_seed", None)
+            movie["movie_id"] = rowid
+            enriched[rowid] = enrich_movie_info(movie)
+
+    breakdown = []
+    for (seed, rowid, features), top in zip(targets, per_seed_top):
+        breakdown.append({
+            "seed": seed,
+            "movie_id": rowid,
+            "movie_title": features.title,
+            "recommendations": [dict(enriched[mid], score=sc) for sc, _, mid in top],
+        })
+        publish_event('similar_movies_requested', {'target_title': features.title, 'top_n': top_n,
+                                                   'user_id': user_id_param})
+    return jsonify({
+        "seeds": breakdown,
+        "not_found": missing,
+        "count_candidates": len(rows),
+        "recommendations": [dict(enriched[mid], score=sc, seed_scores={str(k): v for k, v in merged[mid].items()})
+                            for sc, _, mid in merged_top],
+    })
+
 # -----------------------
 # Catalog options (movies, directors, actors, genres)
 # -----------------------
 @app.route('/catalog/options', methods=['GET'])
 def catalog_options():
-    db = get_db()
+    db = get_read_db()
+    snapshot = get_catalog(db)
+    if snapshot is not None:
+        return jsonify(snapshot.options())
     # movies
     movies = [r[0] for r in db.execute(f"SELECT DISTINCT movie_title FROM {MOVIES_TABLE} WHERE movie_title IS NOT NULL").fetchall()]
     # directors
@@ -719,10 +1220,101 @@ def catalog_options():
 
 
 # -----------------------
-# In-memory user/profile and reports storage (simple)
+# Batched append-only writes (batch_writer.py)
+# -----------------------
+_batch_writer = None
+_batch_writer_lock = threading.Lock()
+
+
+def get_batch_writer():
+    """The process-wide BatchWriter (replaced, after writing its queue, if DATABASE changed)."""
+    global _batch_writer
+    writer = _batch_writer
+    if writer is not None and writer.db_path == DATABASE:
+        return writer
+    with _batch_writer_lock:
+        writer = _batch_writer
+        if writer is None or writer.db_path != DATABASE:
+            if writer is not None:
+                writer.close()
+            writer = BatchWriter(DATABASE, WRITE_BATCH_ROWS, WRITE_BATCH_MS / 1000.0, WRITE_QUEUE_SIZE)
+            _batch_writer = writer
+        return writer
+
+
+@atexit.register
+def close_batch_writer():
+    # flush-on-shutdown: rows still queued are written before the process exits
+    if _batch_writer is not None:
+        _batch_writer.close()
+
+
+# -----------------------
+# User list storage (profile_store.py) and in-memory reports
 # -----------------------
-user_profiles = {}
 bug_reports = []
+_profile_store = None
+_profile_store_lock = threading.Lock()
+
+
+def get_profile_store():
+    """The process-wide ProfileStore (replaced, after a final flush, if DATABASE changed)."""
+    global _profile_store
+    store = _profile_store
+    if store is not None and store.db_path == DATABASE:
+        return store
+    with _profile_store_lock:
+        store = _profile_store
+        if store is None or store.db_path != DATABASE:
+            if store is not None:
+                store.close()
+            store = profile_store.ProfileStore(DATABASE, PROFILE_FLUSH_MS / 1000.0, PROFILE_CACHE_MAX_USERS)
+            _profile_store = store
+        return store
+
+
+@atexit.register
+def close_profile_store():
+    # flush-on-shutdown: list writes already acknowledged are written before the
+    # process exits; the trending consumer checkpoints its counts as it stops
+    if _profile_store is not None:
+        _profile_store.close()
+    if _trending_consumer is not None:
+        _trending_consumer.stop()
+
+
+def user_memory(db, user_id):
+    """The user's title lists in the form affinity.rebuild takes."""
+    return get_profile_store().get(db, user_id).as_memory()
+
+
+def begin_write(db):
+    """Take the write lock before a read-modify-write, so concurrent requests cannot lose its update."""
+    if not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+
+
+def update_affinity(db, user_id, fn):
+    """Apply fn(affinity.Affinity) to the user's materialized profile (no commit).
+
+    The profile is read under the write lock: a concurrent request for the
+    same user waits instead of saving over this change.
+    """
+    begin_write(db)
+    aff = affinity.get_or_build(db, user_id, user_memory(db, user_id))
+    fn(aff)
+    affinity.save(db, aff)
+
+
+def record_interaction(user_id, fn):
+    """update_affinity for the title-list endpoints: commits, bumps the rec version, never raises."""
+    try:
+        db = get_db()
+        update_affinity(db, user_id, fn)
+        bump_user_version(db, user_id, prefs=True)
+        db.commit()
+    except Exception as e:
+        logger.error('Failed to update affinity profile for user %s: %s', user_id, e)
 
 
 @app.route('/user/preferences', methods=['POST'])
@@ -734,15 +1326,8 @@ def save_preferences():
         return jsonify({'error': 'user_id and preferences required'}), 400
     # Overwrite stored preferences with the submitted set.
     # This ensures removals (emptying a list or omitting items) persist.
-    user = user_profiles.setdefault(user_id, {})
     # normalize to ensure keys exist
-    normalized = {
-        'movies': prefs.get('movies') or [],
-        'genres': prefs.get('genres') or [],
-        'directors': prefs.get('directors') or [],
-        'actors': prefs.get('actors') or []
-    }
-    user['preferences'] = normalized
+    normalized = bulk_io.normalize_preferences(prefs)
 
     # persist to DB users_preferences table as JSON for durability
     try:
@@ -752,7 +1337,10 @@ def save_preferences():
             'ON CONFLICT(user_id) DO UPDATE SET preferences_json=excluded.preferences_json, updated_at=excluded.updated_at',
             (user_id, json.dumps(normalized), time.time())
         )
+        update_affinity(db, user_id, lambda a: setattr(a, 'prefs', normalized))
+        bump_user_version(db, user_id, prefs=True)
         db.commit()
+        forget_user_preferences(user_id)
         publish_event('preferences_saved', {'user_id': user_id, 'preferences': normalized})
     except Exception as e:
         print('Failed to persist user preferences to DB:', e)
@@ -767,8 +1355,7 @@ def get_preferences(user_id):
         prefs = get_user_preferences(user_id)
         return jsonify({'user_id': user_id, 'preferences': prefs})
     except Exception:
-        user = user_profiles.get(user_id, {})
-        return jsonify({'user_id': user_id, 'preferences': user.get('preferences', {})})
+        return jsonify({'user_id': user_id, 'preferences': {}})
 
 
 @app.route('/user/feedback', methods=['POST'])
@@ -778,24 +1365,16 @@ def save_feedback():
     movie = data.get('movie')
     rating = data.get('rating')
     text = data.get('text')
-    entry = {'movie': movie, 'rating': rating, 'text': text}
-    if user_id:
-        user = user_profiles.setdefault(user_id, {})
-        fb = user.setdefault('feedback', [])
-        fb.append(entry)
-    else:
-        # anonymous feedback - append to global list under None
-        anon = user_profiles.setdefault('__anonymous__', {})
-        afb = anon.setdefault('feedback', [])
-        afb.append(entry)
+    # anonymous feedback is kept under profile_store.ANONYMOUS
+    get_profile_store().add_note(get_db(), user_id, movie, rating, text)
     publish_event('feedback_created', {'user_id': user_id, 'movie': movie, 'rating': rating})
     return jsonify({'status': 'ok'})
 
 
 @app.route('/user/feedback/<user_id>', methods=['GET'])
 def get_feedback(user_id):
-    user = user_profiles.get(user_id, {})
-    return jsonify({'user_id': user_id, 'feedback': user.get('feedback', [])})
+    user = get_profile_store().get(get_read_db(), user_id)
+    return jsonify({'user_id': user_id, 'feedback': user.feedback})
 
 
 @app.route('/user/watchlist', methods=['POST'])
@@ -805,12 +1384,9 @@ def add_watchlist():
     movie = data.get('movie')
     if not user_id or not movie:
         return jsonify({'error': 'user_id and movie required'}), 400
-    user = user_profiles.setdefault(user_id, {})
-    wl = user.setdefault('watchlist', [])
-    # dedupe case-insensitive
-    low = {m.strip().lower() for m in wl if m}
-    if movie.strip().lower() not in low:
-        wl.append(movie)
+    # deduped case-insensitively by the store
+    wl = get_profile_store().add_title(get_db(), user_id, profile_store.WATCHLIST, movie).watchlist
+    record_interaction(user_id, lambda a: a.watchlist_titles.add(movie.strip().lower()))
 
     publish_event('watchlist_movie_added', {'user_id': user_id, 'movie': movie})
     return jsonify({'status': 'ok', 'watchlist': wl})
@@ -823,18 +1399,16 @@ def remove_watchlist():
     movie = data.get('movie')
     if not user_id or not movie:
         return jsonify({'error': 'user_id and movie required'}), 400
-    user = user_profiles.setdefault(user_id, {})
-    wl = user.get('watchlist', [])
-    new_wl = [m for m in wl if m.strip().lower() != movie.strip().lower()]
-    user['watchlist'] = new_wl
+    new_wl = get_profile_store().remove_title(get_db(), user_id, profile_store.WATCHLIST, movie).watchlist
+    record_interaction(user_id, lambda a: a.watchlist_titles.discard(movie.strip().lower()))
     publish_event('watchlist_movie_removed', {'user_id': user_id, 'movie': movie})
     return jsonify({'status': 'ok', 'watchlist': new_wl})
 
 
 @app.route('/user/watchlist/<user_id>', methods=['GET'])
 def get_watchlist(user_id):
-    user = user_profiles.get(user_id, {})
-    return jsonify({'user_id': user_id, 'watchlist': user.get('watchlist', [])})
+    user = get_profile_store().get(get_read_db(), user_id)
+    return jsonify({'user_id': user_id, 'watchlist': user.watchlist})
 
 
 @app.route('/user/favorites', methods=['POST'])
@@ -844,9 +1418,12 @@ def add_favorite():
     movie = data.get('movie')
     if not user_id or not movie:
         return jsonify({'error': 'user_id and movie required'}), 400
-    user = user_profiles.setdefault(user_id, {})
-    # Load existing preferences from DB (preferred) or in-memory
-    prefs = get_user_preferences(user_id) or user.setdefault('preferences', {})
+    # read-modify-write: read the stored preferences, not a cached copy
+    # another worker may have replaced, under the write lock
+    db = get_db()
+    begin_write(db)
+    row = db.execute('SELECT preferences_json FROM users_preferences WHERE user_id = ?', (user_id,)).fetchone()
+    prefs = parse_preferences(row[0] if row else None)
     # ensure the movies list exists and merge (dedupe)
     movies = prefs.get('movies') or []
     low_movies = {m.strip().lower() for m in movies if m}
@@ -861,19 +1438,21 @@ def add_favorite():
         favs.append(movie)
     prefs['favorites'] = favs
 
-    # Update in-memory representation as well
-    user['preferences'] = prefs
-    user['favorites'] = favs
-
     # Persist back to DB (upsert into users_preferences)
     try:
-        db = get_db()
         db.execute(
             'INSERT INTO users_preferences (user_id, preferences_json, updated_at) VALUES (?, ?, ?) '
             'ON CONFLICT(user_id) DO UPDATE SET preferences_json=excluded.preferences_json, updated_at=excluded.updated_at',
             (user_id, json.dumps(prefs), time.time())
         )
+
+        def favourite(a):
+            a.prefs = prefs
+            a.learn(affinity.movie_by_title(db, movie), affinity.FAVOURITE_SIGNAL)
+        update_affinity(db, user_id, favourite)
+        bump_user_version(db, user_id, prefs=True)
         db.commit()
+        forget_user_preferences(user_id)
     except Exception as e:
         logger.error('Failed to persist favorites to DB for user %s: %s', user_id, e)
 
@@ -888,16 +1467,18 @@ def mark_seen():
     movie = data.get('movie')
     if not user_id or not movie:
         return jsonify({'error': 'user_id and movie required'}), 400
-    user = user_profiles.setdefault(user_id, {})
-    seen = user.setdefault('seen', [])
-    low = {m.strip().lower() for m in seen if m}
-    if movie.strip().lower() not in low:
-        seen.append(movie)
-    # also remove from watchlist if present
-    wl = user.get('watchlist', [])
-    user['watchlist'] = [m for m in wl if m.strip().lower() != movie.strip().lower()]
+    # also removes the movie from the watchlist
+    user = get_profile_store().mark_seen(get_db(), user_id, movie)
+
+    def seen_movie(a):
+        key = movie.strip().lower()
+        if key not in a.seen_titles:
+            a.learn(affinity.movie_by_title(get_db(), movie), affinity.SEEN_SIGNAL)
+        a.seen_titles.add(key)
+        a.watchlist_titles.discard(key)
+    record_interaction(user_id, seen_movie)
     publish_event('movie_seen', {'user_id': user_id, 'movie': movie})
-    return jsonify({'status': 'ok', 'seen': seen, 'watchlist': user.get('watchlist', [])})
+    return jsonify({'status': 'ok', 'seen': user.seen, 'watchlist': user.watchlist})
 
 
 # -----------------------
@@ -910,51 +1491,29 @@ def recommend_from_user():
     top_n = int(data.get('top_n', 10))
     if not user_id:
         return jsonify({'error': 'user_id required'}), 400
-    user = user_profiles.get(user_id)
-    if not user or 'preferences' not in user:
-        return jsonify({'error': 'No preferences found for user'}), 404
-    prefs = user['preferences']
-    pref_movies = set([m.lower().strip() for m in (prefs.get('movies') or [])])
-    pref_directors = set([d.lower().strip() for d in (prefs.get('directors') or [])])
-    pref_actors = set([a.lower().strip() for a in (prefs.get('actors') or [])])
-    pref_genres = set([g.lower().strip() for g in (prefs.get('genres') or [])])
-    pref_watchlist = set([w.lower().strip() for w in (user.get('watchlist') or [])])
-    pref_seen = set([s.lower().strip() for s in (user.get('seen') or [])])
-
     db = get_db()
-    cur = db.execute(f"SELECT * FROM {MOVIES_TABLE}")
-    candidates = [row_to_dict(r) for r in cur.fetchall()]
-
-    def score_movie(m):
-        s = 0.0
-        title = (m.get('movie_title') or '').strip().lower()
-        if title in pref_movies:
-            s += 6.0
-        director = (m.get('director_name') or '').strip().lower()
-        if director and director in pref_directors:
-            s += 5.0
-        # actors
-        actors = set()
-        for col in ('actor_1_name', 'actor_2_name', 'actor_3_name'):
-            actors.update(split_field(m.get(col, '')))
-        s += 3.0 * len(actors.intersection(pref_actors))
-        # genres
-        genres = set(split_field(m.get('genres', '')))
-        s += 1.0 * len(genres.intersection(pref_genres))
-        return s
-
-    scored = []
-    for m in candidates:
-        title = (m.get('movie_title') or '').strip().lower()
-        # skip user's favorite movies, seen movies, and items on their watchlist
-        if title in pref_movies or title in pref_seen or title in pref_watchlist:
-            continue
-        sc = score_movie(m)
-        if sc > 0:
-            scored.append((sc, m.get('movie_title')))
-
-    scored_sorted = sorted(scored, key=lambda x: (-x[0], x[1] or ''))
-    titles = [t for _, t in scored_sorted[:top_n]]
+    # materialized profile (affinity.py); falls back to the source tables
+    aff = affinity.load(db, user_id)
+    if aff is not None and aff.has_preferences():
+        profile = aff.profile()
+        pref_watchlist, pref_seen = aff.watchlist_titles, aff.seen_titles
+    else:
+        prefs = get_user_preferences(user_id)
+        if not prefs:
+            fallback = cold_start_movies(db, top_n)
+            if fallback:
+                return jsonify({'recommendations': [m['movie_title'] for m in fallback],
+                                'fallback': fallback[0]['fallback']})
+            return jsonify({'error': 'No preferences found for user'}), 404
+        user = get_profile_store().get(db, user_id)
+        profile = PreferenceProfile(prefs)
+        pref_watchlist = set([w.lower().strip() for w in user.watchlist])
+        pref_seen = set([s.lower().strip() for s in user.seen])
+    # skip user's favorite movies, seen movies, and items on their watchlist
+    excluded = profile.movies | pref_seen | pref_watchlist
+
+    top = rank_movies_for_profile(db, profile, top_n, exclude_titles=excluded)
+    titles = [m.title for _, m in top]
     publish_event('recommendations_generated', {'user_id': user_id, 'count': len(titles)})
     return jsonify({'recommendations': titles})
 
@@ -969,15 +1528,13 @@ def create_report():
     if not subject or not description:
         return jsonify({'error': 'subject and description required'}), 400
 
-    db = get_db()
     now = time.time()
-    cur = db.execute(
+    # the response carries the new id: wait for the batch, which is committed
+    # at once (urgent) together with whatever else is queued
+    report_id = get_batch_writer().submit(
         'INSERT INTO bug_reports (user_id, subject, description, created_at) VALUES (?, ?, ?, ?)',
-        (user_id, subject, description, now)
-    )
-    db.commit()
-
-    report_id = cur.lastrowid
+        (user_id, subject, description, now), urgent=True
+    ).result()
     report = {
         'id': report_id,
         'user_id': user_id,
@@ -992,7 +1549,7 @@ def create_report():
 
 @app.route('/reports', methods=['GET'])
 def list_reports():
-    db = get_db()
+    db = get_read_db()
     rows = db.execute('SELECT report_id, user_id, subject, description FROM bug_reports ORDER BY created_at DESC').fetchall()
     reports = [dict(row) for row in rows]
     return jsonify({'reports': reports})
@@ -1007,17 +1564,9 @@ def movie_details():
     title_raw = request.args.get("title", "")
     if not title_raw:
         return jsonify({"error": "Missing 'title' query parameter"}), 400
-    title = title_raw.strip().lower()
-    db = get_db()
-    cur = db.execute(f"SELECT * FROM {MOVIES_TABLE} WHERE LOWER(TRIM(movie_title)) = ? LIMIT 1", (title,))
-    row = cur.fetchone()
-    if not row:
-        # try partial
-        cur = db.execute(f"SELECT * FROM {MOVIES_TABLE} WHERE LOWER(movie_title) LIKE ? LIMIT 1", (f"%{title}%",))
-        row = cur.fetchone()
-        if not row:
-            return jsonify({"error": "Movie not found"}), 404
-    movie = row_to_dict(row)
+    movie = find_movie_by_title(get_read_db(), title_raw)
+    if movie is None:
+        return jsonify({"error": "Movie not found"}), 404
     movie = enrich_movie_info(movie)
     return jsonify(movie)
 
@@ -1047,132 +1596,260 @@ def director_movies():
     name_normalized = name_raw.lower()
     limit = int(request.args.get('limit', 200))
 
-    db = get_db()
+    db = get_read_db()
 
     # 1) Try exact normalized match (fast & precise)
-    rows = db.execute(
-        f"SELECT * FROM {MOVIES_TABLE} WHERE LOWER(TRIM(director_name)) = ? LIMIT ?",
-        (name_normalized, limit)
-    ).fetchall()
+    movies = find_movies(db, [Equals('director_name', name_normalized)], limit)
 
     # 2) If no exact match, try a partial match (case-insensitive)
-    if not rows:
-        rows = db.execute(
-            f"SELECT * FROM {MOVIES_TABLE} WHERE LOWER(director_name) LIKE ? LIMIT ?",
-            (f"%{name_normalized}%", limit)
-        ).fetchall()
+    if not movies:
+        movies = find_movies(db, [Contains(('director_name',), name_normalized)], limit)
 
-    movies = [row_to_dict(r) for r in rows]
     # enrich with synopsis/platforms
-    enriched = [enrich_movie_info(dict(m)) for m in movies]
+    enriched = [enrich_movie_info(m) for m in movies]
     return jsonify({'director': name_raw, 'count': len(enriched), 'movies': enriched})
 
 
 # -----------------------
 # New APIs for use-case implementation
 # -----------------------
+_prefs_cache = None
+_prefs_cache_lock = threading.Lock()
+
+
+def get_prefs_cache():
+    """The process-wide PreferencesCache (replaced if DATABASE changed)."""
+    global _prefs_cache
+    cache = _prefs_cache
+    if cache is not None and cache.db_path == DATABASE:
+        return cache
+    with _prefs_cache_lock:
+        if _prefs_cache is None or _prefs_cache.db_path != DATABASE:
+            _prefs_cache = PreferencesCache(DATABASE, PREFS_CACHE_TTL, PREFS_CACHE_MAX_USERS)
+        return _prefs_cache
+
+
+def get_user_context(user_id):
+    """The request's UserContext for `user_id` (user_context.py), shared by the get_user_* helpers."""
+    contexts = getattr(g, '_user_contexts', None)
+    if contexts is None:
+        contexts = g._user_contexts = {}
+    ctx = contexts.get(user_id)
+    if ctx is None:
+        ctx = contexts[user_id] = UserContext(get_db(), user_id, get_prefs_cache())
+    return ctx
+
+
+def forget_user_preferences(user_id=None):
+    """Call after writing users_preferences for `user_id` (None: any user)."""
+    contexts = getattr(g, '_user_contexts', {})
+    if user_id is None:
+        contexts.clear()
+    else:
+        contexts.pop(user_id, None)
+    get_prefs_cache().invalidate(user_id)
+
+
 def get_user_basic(user_id):
-    db = get_db()
-    row = db.execute('SELECT * FROM users_basic WHERE user_id = ?', (user_id,)).fetchone()
-    if row:
-        return dict(row)
-    # fallback to in-memory
-    return user_profiles.get(user_id)
+    basic = get_user_context(user_id).basic
+    if basic is not None:
+        return dict(basic)
+    # users of the title-list endpoints have no users_basic row
+    lists = get_profile_store().get(get_db(), user_id)
+    return None if lists.is_empty() else {'user_id': user_id}
 
 
 def get_user_preferences(user_id):
-    db = get_db()
-    row = db.execute('SELECT preferences_json FROM users_preferences WHERE user_id = ?', (user_id,)).fetchone()
-    if row and row[0]:
-        try:
-            return json.loads(row[0])
-        except Exception:
-            return {}
-    # fallback
-    u = user_profiles.get(user_id, {})
-    return u.get('preferences', {})
+    return copy_preferences(get_user_context(user_id).prefs)
 
 
 def get_user_watchlist_set(user_id):
-    db = get_db()
-    rows = db.execute('SELECT movie_rowid FROM user_watchlist_map m JOIN users_watchlist w ON m.list_id = w.list_id WHERE w.user_id = ?', (user_id,)).fetchall()
-    return set([str(r[0]) for r in rows])
+    return set(get_user_context(user_id).watchlist_set())
 
 
 def get_user_seen_set(user_id):
-    db = get_db()
-    rows = db.execute('SELECT movie_rowid FROM users_feedback WHERE user_id = ? AND rating IS NOT NULL', (user_id,)).fetchall()
-    return set([str(r[0]) for r in rows])
+    return set(get_user_context(user_id).seen_set())
 
 
 def get_user_favorites_set(user_id):
-    # favorites were stored in-memory previously; try DB users_preferences -> favorites key
-    prefs = get_user_preferences(user_id)
-    favs = prefs.get('favorites') if isinstance(prefs, dict) else None
-    if favs:
-        return set([f.strip().lower() for f in favs if f])
-    # fallback: in-memory
-    u = user_profiles.get(user_id, {})
-    return set([f.strip().lower() for f in (u.get('favorites') or [])])
+    # favorites are stored inside users_preferences under the 'favorites' key
+    return get_user_context(user_id).favorites_set()
+
+
+def fetch_movies_by_rowid(db, rowids):
+    """Full `rowid as movie_id, *` rows for `rowids`, returned in the given order."""
+    ids = list(rowids)
+    snapshot = get_catalog(db)
+    if snapshot is not None:
+        return [snapshot.movie(pos, 'movie_id') for pos in snapshot.positions(ids)]
+    found = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cur = db.execute(
+            f"SELECT rowid as movie_id, * FROM {MOVIES_TABLE} WHERE rowid IN ({','.join('?' * len(chunk))})",
+            chunk
+        )
+        for r in cur.fetchall():
+            found[r['movie_id']] = row_to_dict(r)
+    return [found[i] for i in ids if i in found]
+
+
+def favourite_seeds(db, aff, profile):
+    """CF seeds for candidate generation: rated seeds plus favourite titles as 5s."""
+    seeds = dict(aff.cf_seeds())
+    titles = list(profile.movies)
+    if titles:
+        for (rowid,) in db.execute(
+                f"SELECT rowid FROM {MOVIES_TABLE} WHERE movie_title_lower IN ({','.join('?' * len(titles))})",
+                titles):
+            seeds.setdefault(rowid, 5.0)
+    return seeds
+
+
+def recommendation_generators(db, aff, profile, exclude_rowids, stats=None):
+    """The REC_GENERATORS candidate sources, as (name, fn(budget) -> rowids).
+
+    'preference' is a bounded retrieval, not a ranking of the catalog: the
+    max-score walk over the profile's feature posting lists, heaviest first,
+    stops once no other movie can make the budget.  `stats` receives its
+    posting counts.
+    """
+    sources = {
+        'preference': lambda budget: [
+            m.rowid for _, m in rank_movies_for_profile(db, profile, budget, exclude_rowids=exclude_rowids,
+                                                        maxscore=True, stats=stats)
+        ],
+        'neighbours': lambda budget: neighbour_candidates(db, favourite_seeds(db, aff, profile), budget),
+        'popular': lambda budget: [m for m, _ in item_cf.popular_movies(db, budget)],
+    }
+    return [(name, sources[name]) for name in REC_GENERATORS if name in sources]
+
+
+def two_stage_rank(db, aff, profile, exclude_rowids, bonus, top_n, trace=None):
+    def load_movies(rowids):
+        if use_feature_cache(db):
+            cache = get_feature_cache(db)
+            found = {r: cache.by_rowid.get(r) for r in rowids}
+            return {r: m for r, m in found.items() if m is not None}
+        return load_movie_features(db, rowids)
+
+    def rerank(movies, n):
+        combined = dict(bonus)
+        for rowid, prior in popularity_prior(db, [m.rowid for m in movies], REC_POPULARITY_WEIGHT).items():
+            combined[rowid] = combined.get(rowid, 0.0) + prior
+        return rank_by_preference(movies, profile, n, bonus=combined)
+
+    stats = {}
+    top = run_pipeline(
+        recommendation_generators(db, aff, profile, exclude_rowids, stats),
+        lambda rowid: str(rowid) in exclude_rowids,
+        load_movies, rerank, REC_CANDIDATES, top_n, trace
+    )
+    if trace is not None and stats:
+        # stage-1 cost: posting entries walked against a full scan's
+        for entry in trace:
+            if entry['stage'] == 'candidates:preference':
+                entry.update(postings=stats['postings'], visited=stats['visited'])
+    return top
 
 
-def compute_recommendations_for_user(user_id, top_n=10):
-    db = get_db()
-    prefs = get_user_preferences(user_id) or {}
-    pref_movies = set([m.lower().strip() for m in (prefs.get('movies') or [])])
-    pref_directors = set([d.lower().strip() for d in (prefs.get('directors') or [])])
-    pref_actors = set([a.lower().strip() for a in (prefs.get('actors') or [])])
-    pref_genres = set([g.lower().strip() for g in (prefs.get('genres') or [])])
-
-    # load all movies
-    cur = db.execute(f"SELECT rowid as movie_id, * FROM {MOVIES_TABLE}")
-    candidates = [row_to_dict(r) for r in cur.fetchall()]
-
-    def score_movie(m):
-        s = 0.0
-        title = (m.get('movie_title') or '').strip().lower()
-        if title in pref_movies:
-            s += 6.0
-        director = (m.get('director_name') or '').strip().lower()
-        if director and director in pref_directors:
-            s += 5.0
-        # actors
-        actors = set()
-        for col in ('actor_1_name', 'actor_2_name', 'actor_3_name'):
-            actors.update(split_field(m.get(col, '')))
-        s += 3.0 * len(actors.intersection(pref_actors))
-        # genres
-        genres = set(split_field(m.get('genres', '')))
-        s += 1.0 * len(genres.intersection(pref_genres))
-        return s
-
-    watched = get_user_seen_set(user_id)
-    watchlist_ids = get_user_watchlist_set(user_id)
+def trending_movies(db, top_n, window='24h', exclude_rowids=()):
+    """Full rows of the `top_n` trending movies, each with its 'trending_score'."""
+    top = get_trending_consumer().trending.top(window, top_n + len(exclude_rowids))
+    scores = {rowid: score for rowid, score in top if str(rowid) not in exclude_rowids}
+    rows = fetch_movies_by_rowid(db, list(scores)[:top_n])
+    for r in rows:
+        r['trending_score'] = round(scores[r['movie_id']], 4)
+    return rows
 
-    scored = []
-    for m in candidates:
-        mid = str(m.get('movie_id'))
-        title = (m.get('movie_title') or '').strip().lower()
-        if mid in watchlist_ids or mid in watched:
-            continue
-        sc = score_movie(m)
-        if sc > 0:
-            scored.append((sc, m))
 
-    scored_sorted = sorted(scored, key=lambda x: (-x[0], x[1].get('movie_title','')))
-    top = [item for _, item in scored_sorted[:top_n]]
+def cold_start_list_movies(db, top_n, exclude_rowids=(), genres=()):
+    """Rows from the precomputed cold-start lists (cold_start.py), tagged 'fallback'."""
+    lists = cold_start.get_lists(db)
+    if COLD_START_MAX_AGE > 0:
+        cold_start.refresh_if_stale(DATABASE, lists.built_at, COLD_START_MAX_AGE)
+    rows = fetch_movies_by_rowid(db, lists.top(top_n, genres, exclude_rowids))
+    for r in rows:
+        r['fallback'] = 'cold_start'
+    return rows
+
 
-    # persist recommendation record
+def cold_start_movies(db, top_n, exclude_rowids=(), genres=()):
+    """Fallback for users with no signal: the cold-start lists, then trending (24h, then 7d)."""
+    rows = cold_start_list_movies(db, top_n, exclude_rowids, genres)
+    for window in ('24h', '7d'):
+        if len(rows) >= top_n:
+            break
+        have = set(exclude_rowids) | {str(r['movie_id']) for r in rows}
+        extra = trending_movies(db, top_n - len(rows), window, have)
+        for r in extra:
+            r['fallback'] = 'trending'
+        rows += extra
+    return rows
+
+
+def rank_recommendations_for_user(user_id, top_n=10, trace=None):
+    """Top `top_n` full movie rows for `user_id`; stage timings go to `trace` if given."""
+    db = get_db()
+    # one row: preferences, learned weights, watchlist/seen ids and CF seeds
+    aff = affinity.get_or_build(db, user_id, user_memory(db, user_id))
+    # a profile built on first use is kept (recommendation_records rows, whose
+    # commit it used to share, are now written by the batch writer)
+    db.commit()
+    # movies co-rated with the user's well-rated movies (item_cf.py)
+    bonus = item_cf.cf_scores(db, aff.cf_seeds(), CF_WEIGHT)
+    profile, exclude_rowids = aff.profile(), aff.exclude_rowids()
+    if aff.is_cold():
+        return cold_start_movies(db, top_n, exclude_rowids, profile.genres)
+    if REC_PIPELINE == 'two_stage':
+        ranked = two_stage_rank(db, aff, profile, exclude_rowids, bonus, top_n, trace)
+    else:
+        ranked = rank_movies_for_profile(db, profile, top_n, exclude_rowids=exclude_rowids, bonus=bonus)
+    # only the winners need their full rows
+    rows = fetch_movies_by_rowid(db, [m.rowid for _, m in ranked])
+    if len(rows) < top_n:
+        # too little signal for a full list: pad from the user's genre lists
+        have = set(exclude_rowids) | {str(r['movie_id']) for r in rows}
+        rows += cold_start_list_movies(db, top_n - len(rows), have, profile.genres) if profile.genres else []
+    return rows
+
+
+def record_recommendations(user_id, top):
+    """Queue a recommendation_records row; returns its PendingWrite (None on failure)."""
     try:
-        db.execute('INSERT INTO recommendation_records (user_id, generated_at, recommendations_json) VALUES (?, ?, ?)',
-                   (user_id, time.time(), json.dumps([r.get('movie_id') for r in top])))
-        db.commit()
+        return get_batch_writer().submit(
+            'INSERT INTO recommendation_records (user_id, generated_at, recommendations_json) VALUES (?, ?, ?)',
+            (user_id, time.time(), json.dumps([r.get('movie_id') for r in top]))
+        )
     except Exception as e:
         print('Failed to persist recommendation record:', e)
+        return None
+
 
+def compute_recommendations_for_user(user_id, top_n=10):
+    top = rank_recommendations_for_user(user_id, top_n)
+    record_recommendations(user_id, top)
     return top
 
 
+rec_cache = RecommendationCache(REC_CACHE_MAX_USERS)
+
+
+def recommendation_cache_key(db, user_id, top_n):
+    # other users' ratings move this user's CF bonus without changing the
+    # key; a cached list keeps the bonus it was computed with (see item_cf.py)
+    return get_user_versions(db, user_id) + (get_catalog_version(db), top_n)
+
+
+def load_recommendations_for_user(db, user_id, top_n, user_versions):
+    """Precomputed results when fresh, otherwise computed online."""
+    ids = load_fresh_precomputed(db, user_id, top_n, user_versions, PRECOMPUTE_MAX_AGE)
+    # an empty precomputed list (user with no signal) falls through to the cold-start lists
+    if ids:
+        return fetch_movies_by_rowid(db, ids)
+    return rank_recommendations_for_user(user_id, top_n=top_n)
+
+
 @app.route('/recommendations/<user_id>', methods=['GET'])
 def api_recommendations(user_id):
     # verify user exists
@@ -1180,20 +1857,62 @@ def api_recommendations(user_id):
     if not ub:
         return jsonify({'error': 'User not found'}), 404
     top_n = int(request.args.get('top', 10))
-    recs = compute_recommendations_for_user(user_id, top_n=top_n)
+    db = get_db()
+    if request.args.get('debug') in ('1', 'true', 'True', 'yes'):
+        # computed fresh (no cache, no precomputed rows) with per-stage timings
+        trace = []
+        start = time.perf_counter()
+        recs = rank_recommendations_for_user(user_id, top_n=top_n, trace=trace)
+        total_ms = round((time.perf_counter() - start) * 1000, 3)
+        record_recommendations(user_id, recs)
+        enriched = [enrich_movie_info(dict(r)) for r in recs]
+        return jsonify({
+            'user_id': user_id, 'count': len(enriched), 'recommendations': enriched,
+            'debug': {'pipeline': REC_PIPELINE, 'candidate_budget': REC_CANDIDATES,
+                      'generators': REC_GENERATORS, 'stages': trace, 'total_ms': total_ms},
+        })
+    key = recommendation_cache_key(db, user_id, top_n)
+    cached = rec_cache.get(user_id, key)
+    if cached is not None:
+        record, payload = cached
+        try:
+            # `record` (a PendingWrite) is written as the record's rowid
+            get_batch_writer().submit('INSERT INTO recommendation_hits (user_id, record_id, served_at) VALUES (?, ?, ?)',
+                                      (user_id, record, time.time()))
+        except Exception as e:
+            print('Failed to persist recommendation hit:', e)
+        return jsonify(payload)
+
+    recs = load_recommendations_for_user(db, user_id, top_n, key[:2])
+    record = record_recommendations(user_id, recs)
     # enrich each movie with synopsis and streaming platforms (best-effort)
     enriched = [enrich_movie_info(dict(r)) for r in recs]
-    return jsonify({'user_id': user_id, 'count': len(enriched), 'recommendations': enriched})
+    payload = {'user_id': user_id, 'count': len(enriched), 'recommendations': enriched}
+    # cold-start and trending fallbacks change without the cache key changing
+    if not any('fallback' in r for r in recs):
+        # a failed OMDB/Watchmode lookup is retried once the short TTL is over
+        ttl = REC_CACHE_DEGRADED_TTL if any(enrichment_degraded(m) for m in enriched) else None
+        rec_cache.put(user_id, key, record, payload, ttl)
+    return jsonify(payload)
+
+
+@app.route('/movies/trending', methods=['GET'])
+def api_trending():
+    # params: window (1h, 24h, 7d or decayed; default 24h), limit (default 20)
+    window = request.args.get('window', '24h')
+    if window not in trending.WINDOWS and window != trending.DECAYED:
+        return jsonify({'error': f"window must be one of {', '.join(list(trending.WINDOWS) + [trending.DECAYED])}"}), 400
+    limit = max(1, min(int(request.args.get('limit', 20)), trending.TOP_SIZE))
+    movies = trending_movies(get_read_db(), limit, window)
+    return jsonify({'window': window, 'count': len(movies), 'movies': movies})
 
 
 @app.route('/movies/<int:movie_id>', methods=['GET'])
 def api_movie_by_id(movie_id):
-    db = get_db()
-    cur = db.execute(f"SELECT rowid as movie_id, * FROM {MOVIES_TABLE} WHERE rowid = ? LIMIT 1", (movie_id,))
-    row = cur.fetchone()
-    if not row:
+    movies = fetch_movies_by_rowid(get_read_db(), [movie_id])
+    if not movies:
         return jsonify({'error': 'Movie not found'}), 404
-    movie = row_to_dict(row)
+    movie = movies[0]
     # Enrich with synopsis and platforms
     movie = enrich_movie_info(movie)
     return jsonify(movie)
@@ -1201,42 +1920,40 @@ def api_movie_by_id(movie_id):
 
 @app.route('/movies/search', methods=['GET'])
 def api_movies_search():
-    # params: query, director, mood (tag), exclude_mainstream (bool), user_id (optional)
+    # params: query, director, mood (tag), genre / genre_any / genre_not,
+    # exclude_mainstream (bool), user_id (optional)
     query = (request.args.get('query') or '').strip()
     director = (request.args.get('director') or '').strip()
     mood = (request.args.get('mood') or '').strip()
     exclude_mainstream = request.args.get('exclude_mainstream') in ('1','true','True','yes')
     user_id = request.args.get('user_id')
 
-    db = get_db()
-    where = []
-    params = []
+    db = get_read_db()
+    filters = []
     if query:
-        where.append('LOWER(movie_title) LIKE ?')
-        params.append(f"%{query.lower()}%")
+        filters.append(Contains(('movie_title',), query))
     if director:
-        where.append('LOWER(director_name) LIKE ?')
-        params.append(f"%{director.lower()}%")
+        filters.append(Contains(('director_name',), director))
+    bitmap = genre_bitmap_filter(db, request.args)
     if mood:
-        where.append('LOWER(tags) LIKE ?')
-        params.append(f"%{mood.lower()}%")
-
-    sql = f"SELECT * FROM {MOVIES_TABLE}"
-    if where:
-        sql += ' WHERE ' + ' AND '.join(where)
-    sql += ' LIMIT 200'
-    rows = db.execute(sql, params).fetchall()
-    results = [row_to_dict(r) for r in rows]
+        # every word of the mood must be a whole tag token, in any order: "love"
+        # no longer matches "lovers" and "dark comedy" matches "comedy, dark"
+        tag_bits = tag_bitmap(db, mood)
+        bitmap = tag_bits if bitmap is None else bitmap & tag_bits
     # apply mainstream exclusion if requested and user provided
     if exclude_mainstream and user_id:
         prefs = get_user_preferences(user_id)
         exclude_list = prefs.get('exclude', []) if isinstance(prefs, dict) else []
-        # simple heuristic: remove movies whose title/director in exclude_list
-        exset = set([e.strip().lower() for e in exclude_list])
-        results = [r for r in results if (r.get('movie_title') or '').strip().lower() not in exset and (r.get('director_name') or '').strip().lower() not in exset]
+        # simple heuristic: remove movies whose title/director in exclude_list,
+        # as a filter so that the 200-row limit counts only kept movies
+        exclude = Excludes(('movie_title', 'director_name'), exclude_list)
+        if exclude.values:
+            filters.append(exclude)
+
+    results = find_movies(db, filters, 200, bitmap)
 
     # enrich results with synopsis/platforms
-    enriched = [enrich_movie_info(dict(r)) for r in results]
+    enriched = [enrich_movie_info(r) for r in results]
     return jsonify({'count': len(enriched), 'results': enriched})
 
 
@@ -1257,13 +1974,16 @@ def api_movie_feedback(movie_id):
     movie = row_to_dict(row)
 
     now = time.time()
-    # check existing feedback by same user and movie
-    existing = db.execute('SELECT feedback_id FROM users_feedback WHERE user_id = ? AND movie_rowid = ? LIMIT 1', (user_id, movie_id)).fetchone()
-    if existing:
-        fid = existing[0]
-        db.execute('UPDATE users_feedback SET rating = ?, text = ?, created_at = ? WHERE feedback_id = ?', (rating, text, now, fid))
-    else:
-        db.execute('INSERT INTO users_feedback (user_id, movie_rowid, movie_title, rating, text, created_at) VALUES (?, ?, ?, ?, ?, ?)', (user_id, movie_id, movie.get('movie_title'), rating, text, now))
+    # the previous rating (if any) for the CF model; ux_users_feedback_user_movie lookup
+    existing = db.execute('SELECT rating FROM users_feedback WHERE user_id = ? AND movie_rowid = ?', (user_id, movie_id)).fetchone()
+    # fold the rating into the item-item CF model (same transaction)
+    item_cf.apply_rating(db, user_id, movie_id, rating, existing[0] if existing else None, CF_NEIGHBOURS)
+    db.execute('INSERT INTO users_feedback (user_id, movie_rowid, movie_title, rating, text, created_at) VALUES (?, ?, ?, ?, ?, ?) '
+               'ON CONFLICT(user_id, movie_rowid) DO UPDATE SET rating=excluded.rating, text=excluded.text, created_at=excluded.created_at',
+               (user_id, movie_id, movie.get('movie_title'), rating, text, now))
+    update_affinity(db, user_id, lambda a: a.set_rating(MovieFeatures.from_row(row), rating))
+    # rated feedback marks the movie as seen
+    bump_user_version(db, user_id, activity=True)
     db.commit()
 
     # publish event
@@ -1305,7 +2025,9 @@ def api_add_movie_to_watchlist(list_id):
     m = db.execute(f"SELECT rowid FROM {MOVIES_TABLE} WHERE rowid = ? LIMIT 1", (movie_id,)).fetchone()
     if not m:
         return jsonify({'error': 'movie not found'}), 404
-    db.execute('INSERT INTO user_watchlist_map (list_id, movie_rowid, added_at) VALUES (?, ?, ?)', (list_id, movie_id, time.time()))
+    db.execute('INSERT OR IGNORE INTO user_watchlist_map (list_id, movie_rowid, added_at) VALUES (?, ?, ?)', (list_id, movie_id, time.time()))
+    update_affinity(db, user_id, lambda a: a.watchlist.add(m[0]))
+    bump_user_version(db, user_id, activity=True)
     db.commit()
     publish_event('watchlist_movie_added', {'user_id': user_id, 'list_id': list_id, 'movie_id': movie_id})
     return jsonify({'status': 'ok'})
@@ -1319,10 +2041,41 @@ def api_update_user_settings(user_id):
     prefs_json = json.dumps(data)
     db = get_db()
     db.execute('INSERT INTO users_preferences (user_id, preferences_json, updated_at) VALUES (?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET preferences_json=excluded.preferences_json, updated_at=excluded.updated_at', (user_id, prefs_json, time.time()))
+    update_affinity(db, user_id, lambda a: setattr(a, 'prefs', data))
+    bump_user_version(db, user_id, prefs=True)
     db.commit()
+    forget_user_preferences(user_id)
     publish_event('settings_updated', {'user_id': user_id})
     return jsonify({'status': 'ok'})
 
 
+# -----------------------
+# Bulk user data (bulk_io.py)
+# POST /users/import: NDJSON body of watchlist / seen / feedback / preferences
+#   lines; returns counts and the rejected lines with their reasons
+# GET /users/export?type=<comma-separated types>&user_id=<optional>: the same
+#   format, streamed
+# -----------------------
+@app.route('/users/import', methods=['POST'])
+def api_users_import():
+    db = get_db()
+    report = bulk_io.import_ndjson(db, request.stream, bulk_io.load_movie_titles(db), BULK_IMPORT_BATCH_ROWS,
+                                   BULK_IMPORT_MAX_ERRORS, CF_NEIGHBOURS)
+    if report['imported']['preferences']:
+        forget_user_preferences()
+    publish_event('users_imported', {'imported': report['imported'], 'errors': report['error_count']})
+    return jsonify(report)
+
+
+@app.route('/users/export', methods=['GET'])
+def api_users_export():
+    types = split_terms(request.args.get('type')) or list(bulk_io.TYPES)
+    unknown = [t for t in types if t not in bulk_io.TYPES]
+    if unknown:
+        return jsonify({'error': f"type must be among {', '.join(bulk_io.TYPES)}"}), 400
+    lines = bulk_io.export_ndjson(get_read_db(), types, request.args.get('user_id'))
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
 if __name__ == "__main__":
     app.run(debug=True)
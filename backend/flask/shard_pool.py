@@ -0,0 +1,212 @@
+# shard_pool.py - scatter-gather preference scoring across worker processes
+#
+# Scoring a catalog of hundreds of thousands of movies in the request thread
+# holds the GIL for the whole scan and stalls every other request of the API
+# process.  ShardPool splits the catalog into n shards (rowid % n) and starts
+# one long-lived process per shard.  Each worker keeps its shard tokenized
+# (and as a VectorScorer when numpy is available) and answers scoring tasks
+# with its local top N.  The request thread sends the task to every shard
+# and merges the local lists.  Every shard's list is exact and is cut with the
+# same (-score, title, rowid) order, so the merged top N equals a scan of the
+# whole catalog.
+#
+# Tasks carry the catalog version (catalog.py).  A worker that sees a new
+# version re-tokenizes only its share of the rows changed since
+# (catalog.changed_rowids), and reloads its shard after a bulk rewrite.
+import heapq
+import itertools
+import multiprocessing
+import sqlite3
+import threading
+
+from catalog import MOVIES_TABLE, changed_rowids
+from features import FEATURE_COLUMNS, MovieFeatures, apply_changes, load_movie_features, rank_by_preference
+
+try:
+    import numpy as np
+    from vector_scorer import VectorScorer
+except ImportError:  # numpy not installed: workers use the per-movie loop
+    VectorScorer = None
+
+
+def merge_key(item):
+    score, movie = item
+    return -score, movie.title or '', movie.rowid
+
+
+class Shard:
+    """One worker's share of the catalog: the movies with rowid % n_shards == shard."""
+
+    def __init__(self, shard, n_shards):
+        self.shard, self.n_shards = shard, n_shards
+        self.movies, self.scorer, self.version = [], None, None
+
+    def _load(self, conn):
+        rows = conn.execute(
+            f"SELECT {FEATURE_COLUMNS} FROM {MOVIES_TABLE} WHERE rowid % ? = ? ORDER BY rowid",
+            (self.n_shards, self.shard)
+        ).fetchall()
+        return [MovieFeatures.from_row(r) for r in rows]
+
+    def refresh(self, conn, version):
+        if version is not None and version == self.version:
+            return
+        changed = changed_rowids(conn, self.version, version, len(self.movies) * self.n_shards)
+        base = None
+        if changed is not None:
+            mine = [r for r in changed if r % self.n_shards == self.shard]
+            current = load_movie_features(conn, mine)
+            movies = apply_changes(self.movies, mine, [current[r] for r in mine if r in current])
+            if movies is self.movies:  # nothing in this shard
+                self.version = version
+                return
+            # appends only: the old movies (the same objects) are a prefix of the new list
+            if movies[:len(self.movies)] == self.movies:
+                base = self.scorer
+            self.movies = movies
+        else:
+            self.movies = self._load(conn)
+        if VectorScorer is not None:
+            self.scorer = VectorScorer(self.movies, base=base)
+        self.version = version
+
+    def top(self, profile, top_n, exclude_rowids=(), exclude_titles=(), bonus=None, maxscore=False):
+        if self.scorer is not None:
+            scorer = self.scorer
+            exclude = scorer.positions_for_rowids(exclude_rowids)
+            if exclude_titles:
+                exclude = np.union1d(exclude, scorer.positions_for_titles(exclude_titles))
+            top = scorer.top_maxscore if maxscore else scorer.top
+            return top(profile, top_n, exclude=exclude, bonus=scorer.bonus_vector(bonus))
+        return rank_by_preference(
+            self.movies, profile, top_n,
+            skip=lambda m: str(m.rowid) in exclude_rowids or m.title_key in exclude_titles,
+            bonus=bonus
+        )
+
+
+def _worker(db_path, shard, n_shards, tasks, results):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    state = Shard(shard, n_shards)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, version, args = task
+        try:
+            state.refresh(conn, version)
+            results.put((task_id, state.top(*args), None))
+        except Exception as e:
+            results.put((task_id, None, repr(e)))
+    conn.close()
+
+
+class _Pending:
+    __slots__ = ('remaining', 'parts', 'error', 'done')
+
+    def __init__(self, n):
+        self.remaining, self.parts, self.error = n, [], None
+        self.done = threading.Event()
+
+
+class ShardPool:
+    """`n_shards` scoring processes over the catalog in `db_path`.
+
+    Thread-safe: concurrent requests each scatter to all shards, and the
+    workers interleave their tasks.
+    """
+
+    def __init__(self, db_path, n_shards, timeout=30.0):
+        self.db_path, self.n_shards, self.timeout = db_path, n_shards, timeout
+        # spawn: the API process is multi-threaded, so do not fork it
+        ctx = multiprocessing.get_context('spawn')
+        self._results = ctx.Queue()
+        self._tasks = [ctx.Queue() for _ in range(n_shards)]
+        self._procs = [
+            ctx.Process(target=_worker, args=(db_path, i, n_shards, self._tasks[i], self._results), daemon=True)
+            for i in range(n_shards)
+        ]
+        for p in self._procs:
+            p.start()
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _collect(self):
+        while True:
+            msg = self._results.get()
+            if msg is None:
+                break
+            task_id, top, error = msg
+            with self._lock:
+                pending = self._pending.get(task_id)
+                if pending is None:
+                    continue  # the request timed out
+                if error is not None:
+                    pending.error = error
+                else:
+                    pending.parts.append(top)
+                pending.remaining -= 1
+                if pending.remaining == 0 or error is not None:
+                    pending.done.set()
+
+    def top(self, profile, top_n, version, exclude_rowids=(), exclude_titles=(), bonus=None, maxscore=False):
+        """Top `top_n` (score, MovieFeatures) over all shards (see rank_movies_for_profile)."""
+        task_id = next(self._ids)
+        pending = _Pending(self.n_shards)
+        with self._lock:
+            self._pending[task_id] = pending
+        args = (profile, top_n, set(exclude_rowids), set(exclude_titles), bonus, maxscore)
+        try:
+            for q in self._tasks:
+                q.put((task_id, version, args))
+            if not pending.done.wait(self.timeout):
+                raise TimeoutError(f'shard pool: no answer within {self.timeout}s')
+            if pending.error is not None:
+                raise RuntimeError(f'shard worker failed: {pending.error}')
+        finally:
+            with self._lock:
+                self._pending.pop(task_id, None)
+        return heapq.nsmallest(top_n, itertools.chain.from_iterable(pending.parts), key=merge_key)
+
+    def close(self):
+        for q in self._tasks:
+            try:
+                q.put(None)
+            except Exception:
+                pass
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self._results.put(None)
+
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def get_shard_pool(db_path, n_shards):
+    """Process-wide ShardPool, restarted if the database path or shard count changed."""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.db_path == db_path and pool.n_shards == n_shards:
+        return pool
+    with _pool_lock:
+        pool = _pool
+        if pool is None or pool.db_path != db_path or pool.n_shards != n_shards:
+            if pool is not None:
+                pool.close()
+            pool = _pool = ShardPool(db_path, n_shards)
+        return pool
+
+
+def shutdown_shard_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
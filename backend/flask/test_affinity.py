@@ -0,0 +1,186 @@
+"""
+Tests for the materialized per-user affinity profiles (affinity.py).
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import affinity
+import server
+from features import MovieFeatures
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        movies = [
+            ('Christopher Nolan', 'Leonardo DiCaprio', 'Ellen Page', 'Marion Cotillard',
+             'Sci-Fi, Thriller, Action', 'Inception', 'mind-bending, heist, dreams'),
+            ('Christopher Nolan', 'Christian Bale', 'Michael Caine', 'Gary Oldman',
+             'Action, Crime, Drama', 'The Dark Knight', 'superhero, dark, intense'),
+            ('Frank Darabont', 'Tim Robbins', 'Morgan Freeman', 'Bob Gunton',
+             'Drama, Crime', 'The Shawshank Redemption', 'redemption, prison, classic'),
+            ('Christopher Nolan', 'Matthew McConaughey', 'Anne Hathaway', 'Jessica Chastain',
+             'Sci-Fi, Drama', 'Interstellar', 'space, time'),
+        ]
+        for m in movies:
+            db.execute('''
+                INSERT INTO movies_flat
+                (director_name, actor_1_name, actor_2_name, actor_3_name, genres, movie_title, tags, movie_title_lower)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (*m, m[5].lower()))
+        db.execute("INSERT INTO users_basic (user_id) VALUES ('u1')")
+        db.commit()
+
+    yield app.test_client()
+
+    server.get_profile_store().close()
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def post(client, url, payload):
+    return client.post(url, data=json.dumps(payload), content_type='application/json')
+
+
+def rowid(title):
+    with app.app_context():
+        return get_db().execute('SELECT rowid FROM movies_flat WHERE movie_title = ?', (title,)).fetchone()[0]
+
+
+def stored_profile():
+    with app.app_context():
+        return affinity.load(get_db(), 'u1')
+
+
+class TestAffinityModel:
+
+    def test_learn_and_decay(self):
+        movie = MovieFeatures(1, 'Inception', 'Christopher Nolan', 'Leonardo DiCaprio', '', '', 'Sci-Fi', '')
+        aff = affinity.Affinity('u', as_of=0.0)
+        aff.learn(movie, 1.0, now=0.0)
+        assert aff.weights[('director', 'christopher nolan')] == pytest.approx(affinity.LEARN_RATE * 5.0)
+        assert aff.weights[('genre', 'sci-fi')] == pytest.approx(affinity.LEARN_RATE * 1.0)
+        assert ('title', 'inception') not in aff.weights
+
+        half_life = affinity.HALF_LIFE_DAYS * 86400.0
+        decayed = aff.decayed_weights(now=half_life)
+        assert decayed[('director', 'christopher nolan')] == pytest.approx(affinity.LEARN_RATE * 5.0 / 2)
+
+    def test_rating_change_applies_delta(self):
+        movie = MovieFeatures(1, 'Inception', 'Christopher Nolan', '', '', '', '', '')
+        aff = affinity.Affinity('u', as_of=0.0)
+        aff.set_rating(movie, 5, now=0.0)
+        aff.set_rating(movie, 1, now=0.0)
+        assert aff.weights[('director', 'christopher nolan')] == pytest.approx(-affinity.LEARN_RATE * 5.0)
+        assert aff.exclude_rowids() == {'1'}
+        assert aff.cf_seeds() == {}
+
+    def test_json_round_trip(self):
+        aff = affinity.Affinity('u', prefs={'genres': ['Drama']}, weights={('actor', 'bale'): 1.5}, as_of=10.0,
+                                ratings={3: 4.0}, watchlist={7}, seen_titles={'heat'})
+        back = affinity.Affinity.from_json('u', aff.to_json(), 10.0)
+        assert back.prefs == aff.prefs and back.weights == aff.weights
+        assert back.ratings == {3: 4.0} and back.watchlist == {7} and back.seen_titles == {'heat'}
+
+
+class TestAffinityMaintenance:
+
+    def test_endpoints_update_profile_incrementally(self, client):
+        post(client, '/user/preferences', {'user_id': 'u1', 'preferences': {'genres': ['Drama']}})
+        post(client, f"/movies/{rowid('Inception')}/feedback", {'user_id': 'u1', 'rating': 5})
+        list_id = json.loads(post(client, '/users/u1/watchlists', {}).data)['list_id']
+        post(client, f'/watchlists/{list_id}/movies', {'user_id': 'u1', 'movie_id': rowid('Interstellar')})
+        post(client, '/user/seen', {'user_id': 'u1', 'movie': 'Heat'})
+
+        aff = stored_profile()
+        assert aff.prefs['genres'] == ['Drama']
+        assert aff.ratings == {rowid('Inception'): 5.0}
+        assert aff.watchlist == {rowid('Interstellar')}
+        assert aff.seen_titles == {'heat'}
+        assert aff.weights[('director', 'christopher nolan')] > 0
+
+    def test_concurrent_interactions_are_not_lost(self, client):
+        def mark(title):
+            def seen(a):
+                time.sleep(0.05)  # both requests would read the profile before either saves
+                a.seen_titles.add(title)
+            with app.test_request_context():
+                server.record_interaction('u1', seen)
+        with app.app_context():
+            affinity.save(get_db(), affinity.rebuild(get_db(), 'u1'))
+            get_db().commit()
+        threads = [threading.Thread(target=mark, args=(t,)) for t in ('heat', 'ronin', 'thief')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert stored_profile().seen_titles == {'heat', 'ronin', 'thief'}
+
+    def test_incremental_profile_matches_rebuild(self, client):
+        post(client, '/user/preferences', {'user_id': 'u1', 'preferences': {'genres': ['Drama']}})
+        post(client, f"/movies/{rowid('Inception')}/feedback", {'user_id': 'u1', 'rating': 5})
+        post(client, f"/movies/{rowid('The Shawshank Redemption')}/feedback", {'user_id': 'u1', 'rating': 2})
+        post(client, f"/movies/{rowid('Inception')}/feedback", {'user_id': 'u1', 'rating': 4})
+
+        incremental = stored_profile()
+        with app.app_context():
+            rebuilt = affinity.rebuild(get_db(), 'u1')
+        assert rebuilt.prefs == incremental.prefs
+        assert rebuilt.ratings == incremental.ratings
+        now = max(incremental.as_of, rebuilt.as_of)
+        got, want = incremental.decayed_weights(now), rebuilt.decayed_weights(now)
+        assert set(got) == set(want)
+        for key, weight in want.items():
+            assert got[key] == pytest.approx(weight, rel=1e-4)
+
+    def test_compute_reads_one_profile_row(self, client, monkeypatch):
+        post(client, '/user/preferences', {'user_id': 'u1', 'preferences': {'directors': ['Christopher Nolan']}})
+        post(client, f"/movies/{rowid('Inception')}/feedback", {'user_id': 'u1', 'rating': 5})
+
+        def unused(*args, **kwargs):
+            raise AssertionError('recommenders should read the affinity row')
+        for name in ('get_user_preferences', 'get_user_seen_set', 'get_user_watchlist_set'):
+            monkeypatch.setattr(server, name, unused)
+
+        with app.app_context():
+            recs = server.compute_recommendations_for_user('u1')
+        titles = [r['movie_title'] for r in recs]
+        assert 'Inception' not in titles
+        assert titles[:2] == ['Interstellar', 'The Dark Knight']
+
+    def test_low_rating_pushes_director_down(self, client):
+        post(client, '/user/preferences', {'user_id': 'u1', 'preferences': {'genres': ['Drama']}})
+        before = [r['movie_title'] for r in json.loads(client.get('/recommendations/u1').data)['recommendations']]
+        assert before[0] == 'Interstellar'
+        post(client, f"/movies/{rowid('Inception')}/feedback", {'user_id': 'u1', 'rating': 1})
+        after = [r['movie_title'] for r in json.loads(client.get('/recommendations/u1').data)['recommendations']]
+        assert after[0] == 'The Shawshank Redemption'
+
+    def test_recommend_user_uses_profile_exclusions(self, client):
+        post(client, '/user/preferences', {'user_id': 'u1', 'preferences': {'directors': ['Christopher Nolan']}})
+        post(client, '/user/seen', {'user_id': 'u1', 'movie': 'Interstellar'})
+        post(client, '/user/watchlist', {'user_id': 'u1', 'movie': 'Inception'})
+        data = json.loads(post(client, '/recommend/user', {'user_id': 'u1'}).data)
+        # Shawshank only scores through the Drama genre learned from the seen mark
+        assert data['recommendations'] == ['The Dark Knight', 'The Shawshank Redemption']
@@ -0,0 +1,152 @@
+"""
+Tests for the approximate nearest-neighbour index (ann_index.py) and its use
+by the /similar endpoint.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import admin
+import server
+from ann_index import LSHIndex, content_features, recall_at_k
+from bench_ann import row_features
+from bench_data import synthetic_movies
+from server import app, get_db, init_db_schema
+
+
+@pytest.fixture
+def catalog_items():
+    rows = synthetic_movies(2000, seed=7)
+    return [(i + 1, row_features(r)) for i, r in enumerate(rows)]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db, original_admin_db = server.DATABASE, admin.DATABASE
+    server.DATABASE = db_path
+    admin.DATABASE = db_path
+    # keep /similar offline: enrichment calls external APIs
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        movies = [
+            ('Christopher Nolan', 'Leonardo DiCaprio', 'Ellen Page', 'Marion Cotillard',
+             'Sci-Fi, Thriller, Action', 'Inception', 'mind-bending, heist, dreams'),
+            ('Christopher Nolan', 'Christian Bale', 'Michael Caine', 'Gary Oldman',
+             'Action, Crime, Drama', 'The Dark Knight', 'superhero, dark, intense'),
+            ('Frank Darabont', 'Tim Robbins', 'Morgan Freeman', 'Bob Gunton',
+             'Drama, Crime', 'The Shawshank Redemption', 'redemption, prison, classic'),
+            ('Steven Spielberg', 'Tom Cruise', 'Dakota Cruise', 'Justin Chatwin',
+             'Sci-Fi, Action', 'War of the Worlds', 'aliens, invasion, survival'),
+        ]
+        for m in movies:
+            db.execute('''
+                INSERT INTO movies_flat
+                (director_name, actor_1_name, actor_2_name, actor_3_name, genres, movie_title, tags, movie_title_lower)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (*m, m[5].lower()))
+        db.commit()
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+    admin.DATABASE = original_admin_db
+
+
+class TestLSHIndex:
+
+    def test_content_features_weights(self):
+        feats = dict(content_features('christopher nolan', ['leonardo', 'dicaprio'], ['sci-fi'], ['heist']))
+        assert feats == {
+            'd:christopher nolan': 5.0,
+            'a:leonardo': 3.0,
+            'a:dicaprio': 3.0,
+            'g:sci-fi': 1.0,
+            't:heist': 0.5,
+        }
+
+    def test_exact_matches_similarity_weights(self, catalog_items):
+        index = LSHIndex().build(catalog_items)
+        query_id, query = catalog_items[0]
+        qkeys = {k for k, _ in query}
+        lookup = dict(catalog_items)
+        for score, mid in index.exact(query, k=5, exclude=(query_id,)):
+            assert score == pytest.approx(sum(w for k, w in lookup[mid] if k in qkeys))
+
+    def test_recall_against_exact(self, catalog_items):
+        index = LSHIndex(n_tables=32).build(catalog_items)
+        queries = [(feats, (mid,)) for mid, feats in catalog_items[:50]]
+        assert recall_at_k(index, queries, k=10) >= 0.9
+
+    def test_more_tables_do_not_lower_recall(self, catalog_items):
+        queries = [(feats, (mid,)) for mid, feats in catalog_items[:50]]
+        small = recall_at_k(LSHIndex(n_tables=4).build(catalog_items), queries, k=10)
+        large = recall_at_k(LSHIndex(n_tables=32, n_probes=1).build(catalog_items), queries, k=10)
+        assert large >= small
+
+    def test_incremental_add_is_queryable(self, catalog_items):
+        index = LSHIndex().build(catalog_items)
+        _, template = catalog_items[3]
+        new_id = len(catalog_items) + 100
+        index.add(new_id, template)
+        assert len(index) == len(catalog_items) + 1
+        hits = index.query(template, k=5)
+        assert new_id in [mid for _, mid in hits]
+
+    def test_remove(self, catalog_items):
+        index = LSHIndex().build(catalog_items)
+        mid, feats = catalog_items[3]
+        assert index.remove(mid)
+        assert mid not in [m for _, m in index.exact(feats, k=50)]
+        assert not index.remove(mid)
+
+
+class TestSimilarWithANN:
+
+    def test_ann_mode_matches_exact_mode(self, client):
+        exact = json.loads(client.get('/similar?title=Inception&top=3&mode=exact').data)
+        approx = json.loads(client.get('/similar?title=Inception&top=3&mode=ann').data)
+        assert [r['movie_title'] for r in approx['recommendations']] == \
+            [r['movie_title'] for r in exact['recommendations']]
+        assert [r['score'] for r in approx['recommendations']] == \
+            [r['score'] for r in exact['recommendations']]
+
+    def test_admin_insert_is_picked_up_incrementally(self, client):
+        client.get('/similar?title=Inception&mode=ann')
+        index = server._ann_state['index']
+        size = len(index)
+
+        admin_client = admin.app.test_client()
+        payload = {
+            'movie_title': 'Interstellar', 'director_name': 'Christopher Nolan',
+            'actor_1_name': 'Matthew McConaughey', 'actor_2_name': 'Anne Hathaway',
+            'actor_3_name': 'Jessica Chastain', 'genres': 'Sci-Fi, Drama', 'tags': 'space, dreams',
+        }
+        resp = admin_client.post('/add', data=json.dumps(payload), content_type='application/json')
+        assert resp.status_code == 201
+
+        data = json.loads(client.get('/similar?title=Inception&top=5&mode=ann').data)
+        assert server._ann_state['index'] is index  # appended, not rebuilt
+        assert len(index) == size + 1
+        assert 'Interstellar' in [r['movie_title'] for r in data['recommendations']]
+
+        # an update is not applied to the index other requests are querying
+        with app.app_context():
+            db = get_db()
+            db.execute("UPDATE movies_flat SET genres = 'Western' WHERE movie_title = 'Interstellar'")
+            db.commit()
+        client.get('/similar?title=Inception&mode=ann')
+        assert server._ann_state['index'] is not index
+        assert len(server._ann_state['index']) == size + 1
@@ -0,0 +1,114 @@
+"""
+Tests for the background writer of append-only rows (batch_writer.py).
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import server
+from batch_writer import BatchWriter
+from rec_cache import RecommendationCache
+from server import app, init_db_schema
+
+INSERT_EVENT = 'INSERT INTO events (name) VALUES (?)'
+
+
+@pytest.fixture
+def db_path():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE events (id INTEGER PRIMARY KEY, name TEXT NOT NULL, parent_id INTEGER)')
+    conn.commit()
+    conn.close()
+    yield path
+    os.close(fd)
+    os.unlink(path)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+
+    yield app.test_client()
+
+    server.get_batch_writer().close()
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def names(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [r[0] for r in conn.execute('SELECT name FROM events ORDER BY id')]
+    finally:
+        conn.close()
+
+
+class TestBatchWriter:
+
+    def test_rows_are_committed_in_batches(self, db_path):
+        writer = BatchWriter(db_path, max_rows=4, max_delay=0.5)
+        sizes = []
+        write = writer._write
+        writer._write = lambda batch: (sizes.append(len(batch)), write(batch))
+        try:
+            for i in range(10):
+                writer.submit(INSERT_EVENT, (f'e{i}',))
+            writer.flush()
+            assert names(db_path) == [f'e{i}' for i in range(10)]
+            assert sizes == [4, 4, 3]  # the last batch also carries the flush marker
+        finally:
+            writer.close()
+
+    def test_urgent_write_returns_its_rowid_without_the_delay(self, db_path):
+        writer = BatchWriter(db_path, max_delay=10)
+        try:
+            start = time.time()
+            parent = writer.submit(INSERT_EVENT, ('parent',))
+            child = writer.submit('INSERT INTO events (name, parent_id) VALUES (?, ?)', ('child', parent), urgent=True)
+            assert child.result(timeout=5) == 2
+            assert time.time() - start < 5
+            assert parent.done() and parent.rowid == 1
+            conn = sqlite3.connect(db_path)
+            assert conn.execute("SELECT parent_id FROM events WHERE name = 'child'").fetchone()[0] == 1
+            conn.close()
+        finally:
+            writer.close()
+
+    def test_failed_row_is_isolated_and_close_writes_the_queue(self, db_path):
+        writer = BatchWriter(db_path, max_delay=10)
+        bad = writer.submit(INSERT_EVENT, (None,))
+        good = writer.submit(INSERT_EVENT, ('kept',))
+        writer.close()
+        with pytest.raises(sqlite3.IntegrityError):
+            bad.result(timeout=0)
+        assert good.result(timeout=0) == 1
+        assert names(db_path) == ['kept']
+        with pytest.raises(RuntimeError):
+            writer.submit(INSERT_EVENT, ('late',))
+
+
+class TestEndpoints:
+
+    def test_report_id_is_returned_and_listed(self, client):
+        resp = client.post('/reports', json={'user_id': 'u1', 'subject': 'Bug', 'description': 'broken'})
+        report_id = json.loads(resp.data)['report']['id']
+        assert report_id == 1
+        assert [r['report_id'] for r in json.loads(client.get('/reports').data)['reports']] == [report_id]
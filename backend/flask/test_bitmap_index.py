@@ -0,0 +1,130 @@
+"""
+Tests for the genre/tag bitmap filters (bitmap_index.py) behind /search and /movies/search.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import server
+from bitmap_index import MovieBitmaps, from_rowids, get_bitmap_index, iter_rowids
+from features import MovieFeatures, iter_movie_features
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+# title, director, genres, tags
+MOVIES = [
+    ('Inception', 'Christopher Nolan', 'Action, Sci-Fi, Thriller', 'dreams heist'),
+    ('The Dark Knight', 'Christopher Nolan', 'Action, Crime, Drama', 'dark superhero'),
+    ('Heat', 'Michael Mann', 'Crime, Thriller', 'heist'),
+    ('Amelie', 'Jean-Pierre Jeunet', 'Comedy, Romance', 'paris'),
+    ('Imitation of Life', 'Douglas Sirk', 'Melodrama', 'classic'),
+]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        for title, director, genres, tags in MOVIES:
+            db.execute('INSERT INTO movies_flat (movie_title, movie_title_lower, director_name, genres, tags) '
+                       'VALUES (?, ?, ?, ?, ?)', (title, title.lower(), director, genres, tags))
+        db.commit()
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def titles(resp):
+    return [m['movie_title'] for m in json.loads(resp.data)['results']]
+
+
+def features(rowid, genres, tags=''):
+    return MovieFeatures(rowid, f'M{rowid}', '', '', '', '', genres, tags)
+
+
+class TestBitmaps:
+
+    def test_rowid_round_trip(self):
+        assert list(iter_rowids(from_rowids([70, 3, 8, 0]))) == [0, 3, 8, 70]
+        assert list(iter_rowids(0)) == []
+
+    def test_boolean_filters(self):
+        movies = [features(1, 'Action, Drama'), features(2, 'Action'), features(3, 'Drama'), features(4, 'Horror')]
+        bm = MovieBitmaps.build(lambda: movies, None)
+        assert list(iter_rowids(bm.genre_filter(all_of=['action', 'drama']))) == [1]
+        assert list(iter_rowids(bm.genre_filter(any_of=['Drama', 'Horror']))) == [1, 3, 4]
+        assert list(iter_rowids(bm.genre_filter(none_of=['action']))) == [3, 4]
+        assert bm.genre_filter() is None
+
+    def test_only_frequent_tags_are_indexed(self):
+        movies = [features(1, 'Drama', 'heist dark'), features(2, 'Drama', 'heist'), features(3, 'Drama', 'paris')]
+        bm = MovieBitmaps.build(lambda: movies, None, top_tags=1)
+        assert list(iter_rowids(bm.tag('Heist'))) == [1, 2]
+        assert bm.tag('paris') is None
+
+    def test_appends_extend_bitmaps(self, client):
+        with app.app_context():
+            db = get_db()
+            before = get_bitmap_index(db)
+            db.execute("INSERT INTO movies_flat (movie_title, genres, tags) VALUES ('Up', 'Animation, Comedy', 'heist')")
+            db.commit()
+            after = get_bitmap_index(db)
+        assert after is not before
+        assert list(iter_rowids(after.genre('comedy'))) == [4, 6]
+        assert list(iter_rowids(after.tag('heist'))) == [1, 3, 6]
+
+
+class TestSearchFilters:
+
+    def test_genre_is_a_token_not_a_substring(self, client):
+        assert titles(client.get('/search?genre=Drama')) == ['The Dark Knight']
+        # a partial genre still selects the genres containing it
+        assert titles(client.get('/search?genre=sci')) == ['Inception']
+
+    def test_and_or_not(self, client):
+        assert titles(client.get('/search?genre=Action,Thriller')) == ['Inception']
+        assert titles(client.get('/search?genre_any=Comedy,Melodrama')) == ['Amelie', 'Imitation of Life']
+        assert titles(client.get('/search?genre=Crime&genre_not=Drama')) == ['Heat']
+
+    def test_bitmap_combined_with_other_criteria(self, client):
+        assert titles(client.get('/search?genre=Thriller&director=nolan')) == ['Inception']
+        assert titles(client.get('/search?genre=Crime&limit=1')) == ['The Dark Knight']
+
+    def test_movies_search_mood_and_exclusions(self, client):
+        assert titles(client.get('/movies/search?mood=heist')) == ['Inception', 'Heat']
+        assert titles(client.get('/movies/search?mood=heist&genre_not=Sci-Fi')) == ['Heat']
+        with app.app_context():
+            db = get_db()
+            db.execute("INSERT INTO users_preferences (user_id, preferences_json, updated_at) VALUES ('u1', ?, 0)",
+                       (json.dumps({'exclude': ['Michael Mann']}),))
+            db.commit()
+        assert titles(client.get('/movies/search?mood=heist&exclude_mainstream=1&user_id=u1')) == ['Inception']
+
+    def test_rare_and_frequent_moods_match_whole_tokens(self, client, monkeypatch):
+        with app.app_context():
+            db = get_db()
+            db.execute("UPDATE movies_flat SET tags = 'heists dark' WHERE movie_title = 'Amelie'")
+            db.commit()
+        for top_tags in (512, 0):  # every tag indexed, then none
+            monkeypatch.setattr(server, 'get_movie_bitmaps',
+                                lambda db, n=top_tags: MovieBitmaps.build(lambda: iter_movie_features(db), None, n))
+            assert titles(client.get('/movies/search?mood=heist')) == ['Inception', 'Heat']
+            assert titles(client.get('/movies/search?mood=dark heist')) == []
+            assert titles(client.get('/movies/search?mood=heists, dark')) == ['Amelie']
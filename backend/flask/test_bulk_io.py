@@ -0,0 +1,149 @@
+"""
+Tests for the NDJSON user data import and export (bulk_io.py).
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import server
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+MOVIES = [
+    ('Christopher Nolan', 'Inception', 'Sci-Fi'),
+    ('Christopher Nolan', 'The Dark Knight', 'Action'),
+    ('Michael Mann', 'Heat', 'Crime'),
+]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        for director, title, genres in MOVIES:
+            db.execute('INSERT INTO movies_flat (director_name, movie_title, movie_title_lower, genres) VALUES (?, ?, ?, ?)',
+                       (director, title, title.lower(), genres))
+        db.commit()
+
+    yield app.test_client()
+
+    server.get_profile_store().close()
+    server.get_batch_writer().close()
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def ndjson(*items):
+    return ''.join((i if isinstance(i, str) else json.dumps(i)) + '\n' for i in items)
+
+
+def import_lines(client, *items):
+    resp = client.post('/users/import', data=ndjson(*items), content_type='application/x-ndjson')
+    assert resp.status_code == 200
+    return json.loads(resp.data)
+
+
+def export_lines(client, query=''):
+    resp = client.get('/users/export' + query)
+    assert resp.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in resp.data.decode().splitlines()]
+
+
+class TestImport:
+
+    def test_valid_lines_are_written_and_bad_ones_reported(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'BULK_IMPORT_BATCH_ROWS', 2)
+        report = import_lines(
+            client,
+            {'type': 'watchlist', 'user_id': 'u1', 'movie_id': 3},
+            {'type': 'seen', 'user_id': 'u1', 'movie': 'Some Old Film'},
+            '{not json',
+            {'type': 'feedback', 'user_id': 'u1', 'movie_id': 1, 'rating': 5},
+            {'type': 'feedback', 'user_id': 'u2', 'movie_id': 1, 'rating': 4},
+            {'type': 'feedback', 'user_id': 'u2', 'movie_id': 2, 'rating': 5},
+            {'type': 'feedback', 'user_id': 'u1', 'movie_id': 2, 'rating': 4},
+            {'type': 'feedback', 'user_id': 'u1', 'movie_id': 99, 'rating': 4},
+            {'type': 'preferences', 'user_id': 'u3', 'preferences': {'directors': ['Michael Mann']}},
+            {'type': 'rating', 'user_id': 'u1'},
+        )
+        assert report['imported'] == {'watchlist': 1, 'seen': 1, 'feedback': 4, 'preferences': 1}
+        assert report['users'] == 3
+        assert [e['line'] for e in report['errors']] == [3, 8, 10]
+        assert report['errors'][1]['error'] == 'unknown movie_id 99'
+
+        assert json.loads(client.get('/user/watchlist/u1').data)['watchlist'] == ['Heat']
+        assert json.loads(client.get('/user/preferences/u3').data)['preferences']['directors'] == ['Michael Mann']
+        with app.app_context():
+            db = get_db()
+            # imported users exist for the per-user endpoints, and the CF model was rebuilt
+            assert db.execute('SELECT COUNT(*) FROM users_basic').fetchone()[0] == 3
+            assert db.execute('SELECT neighbour_rowid FROM item_neighbours WHERE movie_rowid = 1').fetchone()[0] == 2
+
+    def test_import_invalidates_profiles_and_cached_recommendations(self, client):
+        import_lines(client, {'type': 'preferences', 'user_id': 'u1', 'preferences': {'directors': ['Michael Mann']}})
+        titles = lambda: [m['movie_title'] for m in json.loads(client.get('/recommendations/u1').data)['recommendations']]
+        assert titles()[0] == 'Heat'
+        import_lines(client, {'type': 'preferences', 'user_id': 'u1', 'preferences': {'directors': ['Christopher Nolan']}},
+                     {'type': 'feedback', 'user_id': 'u1', 'movie_id': 1, 'rating': 5})
+        assert titles()[0] == 'The Dark Knight'
+
+
+class TestExport:
+
+    def test_export_round_trips(self, client):
+        import_lines(
+            client,
+            {'type': 'watchlist', 'user_id': 'u1', 'movie_id': 3, 'added_at': 10},
+            {'type': 'seen', 'user_id': 'u1', 'movie': 'Some Old Film', 'added_at': 11},
+            {'type': 'feedback', 'user_id': 'u1', 'movie_id': 1, 'rating': 5, 'text': 'great', 'created_at': 12},
+            {'type': 'preferences', 'user_id': 'u2', 'preferences': {'genres': ['Crime']}},
+        )
+        exported = export_lines(client)
+        assert exported == [
+            {'type': 'watchlist', 'user_id': 'u1', 'movie': 'Heat', 'added_at': 10, 'movie_id': 3},
+            {'type': 'seen', 'user_id': 'u1', 'movie': 'Some Old Film', 'added_at': 11},
+            {'type': 'feedback', 'user_id': 'u1', 'movie_id': 1, 'rating': 5.0, 'text': 'great', 'created_at': 12},
+            {'type': 'preferences', 'user_id': 'u2', 'preferences': {'genres': ['Crime']}},
+        ]
+        assert import_lines(client, *exported)['error_count'] == 0
+        assert export_lines(client) == exported
+        assert export_lines(client, '?type=feedback&user_id=u1') == exported[2:3]
+        assert client.get('/users/export?type=ratings').status_code == 400
+
+    def test_preferences_keep_favorites_and_settings(self, client):
+        import_lines(client, {'type': 'preferences', 'user_id': 'u1', 'preferences': {'genres': ['Crime']}})
+        resp = client.post('/user/favorites', data=json.dumps({'user_id': 'u1', 'movie': 'Heat'}),
+                           content_type='application/json')
+        assert resp.status_code == 200
+        with app.app_context():
+            db = get_db()
+            prefs = json.loads(db.execute("SELECT preferences_json FROM users_preferences WHERE user_id = 'u1'").fetchone()[0])
+            prefs['exclude'] = ['Michael Bay']
+            db.execute("UPDATE users_preferences SET preferences_json = ? WHERE user_id = 'u1'", (json.dumps(prefs),))
+            db.commit()
+        exported = export_lines(client, '?type=preferences')
+        assert exported == [{'type': 'preferences', 'user_id': 'u1', 'preferences': prefs}]
+        assert prefs['favorites'] == ['Heat']
+
+        # imported into an empty database, the blob comes back unchanged
+        with app.app_context():
+            db = get_db()
+            db.execute('DELETE FROM users_preferences')
+            db.commit()
+        assert import_lines(client, *exported)['error_count'] == 0
+        assert export_lines(client, '?type=preferences') == exported
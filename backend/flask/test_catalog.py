@@ -0,0 +1,136 @@
+"""
+Tests for the catalog change log (catalog.py) and the in-memory structures patched from it.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import catalog
+import server
+from catalog import changed_rowids, ensure_catalog_state, get_catalog_version
+from catalog_snapshot import get_catalog_snapshot
+from features import get_feature_cache
+from rec_cache import RecommendationCache
+from server import app, get_db, get_movie_bitmaps, init_db_schema
+
+# title, director, genres
+MOVIES = [
+    ('Inception', 'Christopher Nolan', 'Action Sci-Fi'),
+    ('The Dark Knight', 'Christopher Nolan', 'Action Crime'),
+    ('Heat', 'Michael Mann', 'Crime Thriller'),
+    ('Amelie', 'Jean-Pierre Jeunet', 'Comedy Romance'),
+]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        for title, director, genres in MOVIES:
+            db.execute('INSERT INTO movies_flat (movie_title, movie_title_lower, director_name, genres) VALUES (?, ?, ?, ?)',
+                       (title, title.lower(), director, genres))
+        db.commit()
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(catalog, 'CHANGES_KEPT', 1000)
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE movies_flat (movie_title TEXT)')
+    ensure_catalog_state(conn.cursor())
+    yield conn
+    conn.close()
+
+
+def admin_edit(sql, params=()):
+    """Write through a separate connection, as admin.py does from its own process."""
+    conn = sqlite3.connect(server.DATABASE)
+    try:
+        conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class TestChangeLog:
+
+    def test_changes_are_logged_per_rowid(self, conn):
+        start = get_catalog_version(conn)
+        conn.executemany('INSERT INTO movies_flat (movie_title) VALUES (?)', [('a',), ('b',), ('c',)])
+        conn.execute("UPDATE movies_flat SET movie_title = 'B' WHERE rowid = 2")
+        conn.execute('UPDATE movies_flat SET rowid = 10 WHERE rowid = 3')
+        conn.execute('DELETE FROM movies_flat WHERE rowid = 1')
+        version = get_catalog_version(conn)
+        assert [r[0] for r in conn.execute('SELECT op FROM catalog_changes ORDER BY change_id')] == \
+            ['I', 'I', 'I', 'U', 'U', 'U', 'D']
+        assert changed_rowids(conn, start, version) == [1, 2, 3, 10]
+        assert changed_rowids(conn, version, version) == []
+        # another database
+        assert changed_rowids(conn, ('other',) + start[1:], version) is None
+
+    def test_pruned_log_means_rebuild(self, conn):
+        start = get_catalog_version(conn)
+        conn.executemany('INSERT INTO movies_flat (movie_title) VALUES (?)', [(str(i),) for i in range(2500)])
+        version = get_catalog_version(conn)
+        assert conn.execute('SELECT MIN(change_id) FROM catalog_changes').fetchone()[0] == 1001
+        assert changed_rowids(conn, start, version, size=100000) is None
+        mid = start[:3] + (1400,)
+        assert len(changed_rowids(conn, mid, version, size=100000)) == 1100
+        # a bulk change (over 1000 rowids and half the size) is reloaded rather than patched
+        assert changed_rowids(conn, mid, version, size=100) is None
+
+
+class TestHotReload:
+
+    def test_admin_edits_are_patched_into_the_api_structures(self, client):
+        assert json.loads(client.get('/movie?title=heat').data)['director_name'] == 'Michael Mann'
+        with app.app_context():
+            db = get_db()
+            features, snapshot = get_feature_cache(db), get_catalog_snapshot(db)
+            get_movie_bitmaps(db)
+
+        admin_edit("UPDATE movies_flat SET movie_title = 'Heat (1995)', genres = 'Crime Drama' WHERE rowid = 3")
+        admin_edit('DELETE FROM movies_flat WHERE rowid = 1')
+        admin_edit("INSERT INTO movies_flat (movie_title, director_name, genres) VALUES ('Thief', 'Michael Mann', 'Crime')")
+
+        get = lambda url: json.loads(client.get(url).data)
+        assert get('/movies/3')['movie_title'] == 'Heat (1995)'
+        assert client.get('/movies/1').status_code == 404
+        assert get('/movie?title=heat (1995)')['movie_title'] == 'Heat (1995)'
+        assert [m['movie_title'] for m in get('/search?genre=crime')['results']] == ['The Dark Knight', 'Heat (1995)', 'Thief']
+        assert [m['movie_title'] for m in get('/search?genre=action')['results']] == ['The Dark Knight']
+        assert [m['movie_title'] for m in get('/directors/movies?name=michael mann')['movies']] == ['Heat (1995)', 'Thief']
+        assert [m['movie_title'] for m in get('/search')['results']] == ['The Dark Knight', 'Heat (1995)', 'Amelie', 'Thief']
+        assert 'Inception' not in get('/catalog/options')['movies']
+
+        with app.app_context():
+            db = get_db()
+            patched_features, patched_snapshot = get_feature_cache(db), get_catalog_snapshot(db)
+        # patched, not reloaded: untouched movies are the same objects
+        assert patched_features.by_rowid[2] is features.by_rowid[2]
+        assert [m.rowid for m in patched_features.movies] == [2, 3, 4, 5]
+        assert patched_snapshot.values[0] is not snapshot.values[0]
+        assert patched_snapshot.dead == {0} and len(patched_snapshot) == 4
+        # the old snapshot is unchanged for requests still holding it
+        assert snapshot.movie(snapshot.by_rowid[3])['movie_title'] == 'Heat'
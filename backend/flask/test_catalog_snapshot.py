@@ -0,0 +1,111 @@
+"""
+Tests for the in-memory catalog snapshot behind the read endpoints (catalog_snapshot.py).
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import database
+import server
+from catalog_snapshot import get_catalog_snapshot
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+MOVIES = [
+    ('Christopher Nolan', 'Leonardo DiCaprio', 'Tom Hardy', 'Elliot Page', 'Action Sci-Fi', 'Inception', 'dream heist'),
+    ('Christopher Nolan', 'Christian Bale', 'Heath Ledger', 'Gary Oldman', 'Action Crime', 'The Dark Knight', 'batman'),
+    ('Michael Mann', 'Al Pacino', 'Robert De Niro', 'Val Kilmer', 'Crime Drama', 'Heat', 'heist'),
+    ('Michael Mann', 'Tom Cruise', 'Jamie Foxx', None, 'Crime Thriller', 'Collateral ', 'night'),
+]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        for movie in MOVIES:
+            db.execute('INSERT INTO movies_flat (director_name, actor_1_name, actor_2_name, actor_3_name, genres, '
+                       'movie_title, tags, movie_title_lower) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       movie + (movie[5].lower(),))
+        db.commit()
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+READS = [
+    '/movie?title=heat', '/movie?title=COLLATERAL', '/movie?title=knight', '/movie?title=nothing',
+    '/movies/3', '/movies/99',
+    '/directors/movies?name=michael mann', '/directors/movies?name=nolan&limit=1',
+    '/search?title=the', '/search?actor=tom', '/search?director=mann&genre=crime', '/search?limit=2',
+    '/movies/search?query=e&mood=heist', '/catalog/options',
+]
+
+
+def get(client, url):
+    resp = client.get(url)
+    return resp.status_code, json.loads(resp.data)
+
+
+class TestCatalogSnapshot:
+
+    def test_endpoints_match_the_sql_queries(self, client, monkeypatch):
+        from_snapshot = [get(client, url) for url in READS]
+        monkeypatch.setattr(server, 'CATALOG_SNAPSHOT_MAX_MOVIES', 0)
+        assert [get(client, url) for url in READS] == from_snapshot
+        assert from_snapshot[0][1]['movie_title'] == 'Heat'
+        assert from_snapshot[4][1]['movie_id'] == 3
+        assert [m['movie_title'] for m in from_snapshot[10][1]['results']] == ['Heat', 'Collateral ']
+
+    def test_reads_run_no_movies_flat_queries(self, client):
+        for url in READS:  # builds the snapshot, feature cache and bitmaps
+            get(client, url)
+        conn = database.connection(server.DATABASE, readonly=True)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            for url in READS:
+                get(client, url)
+        finally:
+            conn.set_trace_callback(None)
+        # only the catalog version check and the genre filter's O(log n) size probe remain
+        assert statements
+        assert not [s for s in statements if 'movies_flat' in s and s != 'SELECT MAX(rowid) FROM movies_flat']
+
+    def test_catalog_changes_swap_in_a_new_snapshot(self, client):
+        with app.app_context():
+            db = get_db()
+            before = get_catalog_snapshot(db)
+            assert get_catalog_snapshot(db) is before
+            # interned: one string object per distinct value
+            directors = before.values[before.columns.index('director_name')]
+            assert directors[0] is directors[1]
+
+            db.execute("INSERT INTO movies_flat (director_name, movie_title, movie_title_lower) "
+                       "VALUES ('Michael Mann', 'Thief', 'thief')")
+            db.commit()
+            appended = get_catalog_snapshot(db)
+            assert len(before) == 4 and len(appended) == 5
+            assert appended.movie(appended.find_title('thief'))['director_name'] is directors[2]
+
+            db.execute("UPDATE movies_flat SET movie_title = 'Heat (1995)' WHERE rowid = 3")
+            db.commit()
+        assert get(client, '/movies/3')[1]['movie_title'] == 'Heat (1995)'
+        assert appended.movie(2)['movie_title'] == 'Heat'
@@ -0,0 +1,140 @@
+"""
+Tests for the precomputed cold-start recommendation lists (cold_start.py).
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import cold_start
+import server
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+# title, genres, external score (movies_flat.rating)
+MOVIES = [
+    ('Inception', 'Sci-Fi, Thriller', None),
+    ('The Dark Knight', 'Action, Crime', None),
+    ('Heat', 'Crime, Thriller', None),
+    ('Amelie', 'Comedy, Romance', None),
+    ('Casablanca', 'Drama, Romance', 9.0),
+]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+    monkeypatch.setattr(server, 'COLD_START_MAX_AGE', 0)
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        for title, genres, rating in MOVIES:
+            db.execute('INSERT INTO movies_flat (movie_title, movie_title_lower, genres, rating) VALUES (?, ?, ?, ?)',
+                       (title, title.lower(), genres, rating))
+        for user_id in ('rater1', 'rater2', 'rater3', 'newbie'):
+            db.execute('INSERT INTO users_basic (user_id) VALUES (?)', (user_id,))
+        # Heat: many good ratings; Amelie: one perfect rating; Inception: poor
+        ratings = [('rater1', 'Heat', 5), ('rater2', 'Heat', 5), ('rater3', 'Heat', 4),
+                   ('rater1', 'Amelie', 5), ('rater1', 'Inception', 1), ('rater2', 'Inception', 2)]
+        for user_id, title, rating in ratings:
+            db.execute('INSERT INTO users_feedback (user_id, movie_rowid, rating, created_at) VALUES (?, ?, ?, 0)',
+                       (user_id, rowid(title), rating))
+        db.commit()
+        cold_start.build(db)
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def rowid(title):
+    return [m[0] for m in MOVIES].index(title) + 1
+
+
+def titles(rows):
+    return [r['movie_title'] for r in rows]
+
+
+class TestBuild:
+
+    def test_pack_round_trip(self):
+        assert cold_start.unpack(cold_start.pack([3, 1, 2 ** 40])) == [3, 1, 2 ** 40]
+        assert cold_start.unpack(None) == []
+
+    def test_bayesian_ranking(self, client):
+        with app.app_context():
+            db = get_db()
+            scores = cold_start.movie_scores(db)
+            lists = cold_start.get_lists(db)
+        mean = (5 + 5 + 4 + 5 + 1 + 2) / 6
+        assert scores[rowid('Heat')] == pytest.approx((5 * mean + 14) / 8)
+        # the external 9/10 is a prior of 4.5 with no ratings to move it
+        assert scores[rowid('Casablanca')] == pytest.approx(4.5)
+        assert rowid('The Dark Knight') not in scores
+        assert lists.lists[cold_start.GLOBAL_LIST] == [rowid('Casablanca'), rowid('Heat'), rowid('Amelie'),
+                                                       rowid('Inception')]
+        assert lists.lists['thriller'] == [rowid('Heat'), rowid('Inception')]
+        assert lists.lists['romance'] == [rowid('Casablanca'), rowid('Amelie')]
+
+    def test_genre_lists_interleave_and_exclude(self, client):
+        with app.app_context():
+            lists = cold_start.get_lists(get_db())
+        assert lists.top(3, genres={'romance', 'thriller'}) == [rowid('Casablanca'), rowid('Heat'), rowid('Amelie')]
+        assert lists.top(2, exclude={str(rowid('Casablanca'))}) == [rowid('Heat'), rowid('Amelie')]
+
+
+class TestServing:
+
+    def test_new_user_gets_global_list(self, client):
+        data = json.loads(client.get('/recommendations/newbie?top=3').data)
+        assert titles(data['recommendations']) == ['Casablanca', 'Heat', 'Amelie']
+        assert all(r['fallback'] == 'cold_start' for r in data['recommendations'])
+
+    def test_genre_only_preferences_use_genre_lists(self, client):
+        client.put('/users/newbie/settings', data=json.dumps({'genres': ['Thriller']}),
+                   content_type='application/json')
+        data = json.loads(client.get('/recommendations/newbie?top=3').data)
+        # Inception and Heat score on the genre; the list fills the rest
+        assert titles(data['recommendations'])[:2] == ['Heat', 'Inception']
+
+    def test_short_results_padded_from_genre_lists(self, client, monkeypatch):
+        # a one-candidate budget leaves the pipeline one romance short
+        monkeypatch.setattr(server, 'REC_CANDIDATES', 1)
+        monkeypatch.setattr(server, 'REC_GENERATORS', ['preference'])
+        client.put('/users/newbie/settings', data=json.dumps({'genres': ['Romance']}),
+                   content_type='application/json')
+        recs = json.loads(client.get('/recommendations/newbie?top=3').data)['recommendations']
+        assert sorted(titles(recs)) == ['Amelie', 'Casablanca']
+        assert 'fallback' not in recs[0]
+        assert recs[1]['fallback'] == 'cold_start'
+
+    def test_recommend_user_without_preferences(self, client):
+        resp = client.post('/recommend/user', data=json.dumps({'user_id': 'newbie', 'top_n': 2}),
+                           content_type='application/json')
+        data = json.loads(resp.data)
+        assert data == {'recommendations': ['Casablanca', 'Heat'], 'fallback': 'cold_start'}
+
+    def test_lists_reload_after_rebuild(self, client):
+        with app.app_context():
+            db = get_db()
+            before = cold_start.get_lists(db)
+            db.execute("INSERT INTO users_feedback (user_id, movie_rowid, rating, created_at) VALUES ('rater3', ?, 5, 0)",
+                       (rowid('The Dark Knight'),))
+            db.commit()
+            cold_start.build(db)
+            after = cold_start.get_lists(db)
+        assert after is not before
+        assert rowid('The Dark Knight') in after.lists[cold_start.GLOBAL_LIST]
@@ -0,0 +1,127 @@
+"""
+Tests for the shared, per-thread SQLite connections (database.py).
+"""
+
+import gc
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import admin
+import database
+import server
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+
+@pytest.fixture
+def db_path():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.close()
+    yield path
+    os.close(fd)
+    os.unlink(path)
+    database.remove_orphaned_wal(path)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db, original_admin_db = server.DATABASE, admin.DATABASE
+    server.DATABASE = admin.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        db.execute("INSERT INTO movies_flat (movie_title, movie_title_lower) VALUES ('Heat', 'heat')")
+        db.commit()
+
+    yield app.test_client()
+
+    server.get_profile_store().close()
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE, admin.DATABASE = original_db, original_admin_db
+
+
+class TestConnection:
+
+    def test_one_tuned_connection_per_thread(self, db_path):
+        conn = database.connection(db_path)
+        assert database.connection(db_path) is conn
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+        assert conn.execute('PRAGMA cache_size').fetchone()[0] == -database.SQLITE_CACHE_SIZE_KB
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(database.connection(db_path)))
+        thread.start()
+        thread.join()
+        assert other[0] is not conn
+
+    def test_connections_are_closed_when_their_thread_ends(self, db_path):
+        opened = []
+
+        def request():
+            opened.append(database.connection(db_path))
+            opened.append(database.connection(db_path, readonly=True))
+        before = len(database._open)
+        for _ in range(50):  # a thread per request, as app.run() does
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+        gc.collect()
+        assert len(opened) == 100
+        assert len(database._open) == before
+        for conn in opened:
+            with pytest.raises(sqlite3.ProgrammingError):
+                conn.execute('SELECT 1')
+
+    def test_reads_do_not_wait_for_a_writer(self, db_path):
+        writer = database.connection(db_path)
+        reader = database.connection(db_path, readonly=True)
+        writer.execute('INSERT INTO t VALUES (1)')  # write transaction left open
+        assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+        writer.commit()
+        assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
+        with pytest.raises(sqlite3.OperationalError):
+            reader.execute('INSERT INTO t VALUES (2)')
+
+    def test_release_rolls_back_and_replaced_files_reconnect(self, db_path):
+        conn = database.connection(db_path)
+        conn.execute('INSERT INTO t VALUES (1)')
+        database.release()
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+        os.replace(db_path, db_path + '.old')
+        with pytest.raises(RuntimeError):
+            database.connection(db_path)
+        os.replace(db_path + '.old', db_path)
+        assert database.connection(db_path) is conn
+        sqlite3.connect(db_path + '.new').close()
+        os.replace(db_path + '.new', db_path)
+        assert database.connection(db_path) is not conn
+
+
+class TestEndpoints:
+
+    def test_admin_writes_are_visible_to_api_reads(self, client):
+        assert json.loads(client.get('/movie?title=heat').data)['movie_title'] == 'Heat'
+        admin_client = admin.app.test_client()
+        resp = admin_client.post('/add', data=json.dumps({'movie_title': 'Ronin'}), content_type='application/json')
+        assert resp.status_code == 201
+        assert json.loads(client.get('/movie?title=ronin').data)['movie_title'] == 'Ronin'
+        assert [m['movie_title'] for m in json.loads(admin_client.get('/api/movies').data)] == ['Heat', 'Ronin']
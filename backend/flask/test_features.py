@@ -0,0 +1,250 @@
+"""
+Tests for the pre-tokenized feature cache (features.py) and the recommenders
+that score against it.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import server
+from features import (
+    MovieFeatures, PreferenceProfile, get_feature_cache, iter_movie_features, preference_score,
+    rank_by_preference, split_field
+)
+from server import app, get_db, init_db_schema
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        movies = [
+            ('Christopher Nolan', 'Leonardo DiCaprio', 'Ellen Page', 'Marion Cotillard',
+             'Sci-Fi, Thriller, Action', 'Inception', 'mind-bending, heist, dreams'),
+            ('Christopher Nolan', 'Christian Bale', 'Michael Caine', 'Gary Oldman',
+             'Action, Crime, Drama', 'The Dark Knight', 'superhero, dark, intense'),
+            ('Frank Darabont', 'Tim Robbins', 'Morgan Freeman', 'Bob Gunton',
+             'Drama, Crime', 'The Shawshank Redemption', 'redemption, prison, classic'),
+        ]
+        for m in movies:
+            db.execute('''
+                INSERT INTO movies_flat
+                (director_name, actor_1_name, actor_2_name, actor_3_name, genres, movie_title, tags, movie_title_lower)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (*m, m[5].lower()))
+        db.commit()
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+class TestMovieFeatures:
+
+    def test_split_field_still_exported_by_server(self):
+        assert server.split_field is split_field
+        assert split_field('Sci-Fi | Action and Drama') == ['sci-fi', 'action', 'drama']
+
+    def test_from_row_tokenizes_once(self):
+        row = {'movie_id': 7, 'movie_title': ' Inception ', 'director_name': 'Christopher Nolan',
+               'actor_1_name': 'Leonardo DiCaprio', 'actor_2_name': None, 'actor_3_name': '',
+               'genres': 'Sci-Fi, Action', 'tags': 'heist'}
+        f = MovieFeatures.from_row(row)
+        assert f.rowid == 7
+        assert f.title_key == 'inception'
+        assert f.director == 'christopher nolan'
+        assert f.actors == {'leonardo', 'dicaprio'}
+        assert f.genres == {'sci-fi', 'action'}
+        assert f.tags == {'heist'}
+
+    def test_preference_score_weights(self):
+        f = MovieFeatures(1, 'Inception', 'Christopher Nolan', 'Leonardo DiCaprio', '', '',
+                          'Sci-Fi, Action', '')
+        profile = PreferenceProfile({'movies': ['Inception'], 'directors': ['christopher nolan'],
+                                     'actors': ['dicaprio'], 'genres': ['Action', 'Drama']})
+        assert preference_score(f, profile) == 6.0 + 5.0 + 3.0 + 1.0
+
+
+class TestFeatureCache:
+
+    def test_reused_until_catalog_changes(self, client):
+        with app.app_context():
+            db = get_db()
+            cache = get_feature_cache(db)
+            assert len(cache) == 3
+            assert get_feature_cache(db) is cache
+
+            db.execute("UPDATE movies_flat SET genres = 'Drama' WHERE movie_title = 'Inception'")
+            db.commit()
+            rebuilt = get_feature_cache(db)
+            assert rebuilt is not cache
+            assert [m.genres for m in rebuilt.movies if m.title == 'Inception'] == [frozenset({'drama'})]
+
+    def test_appends_are_tokenized_incrementally(self, client):
+        with app.app_context():
+            db = get_db()
+            cache = get_feature_cache(db)
+            db.execute("INSERT INTO movies_flat (director_name, genres, movie_title, movie_title_lower) "
+                       "VALUES ('Christopher Nolan', 'Sci-Fi', 'Interstellar', 'interstellar')")
+            db.commit()
+            updated = get_feature_cache(db)
+            assert len(updated) == 4
+            # existing MovieFeatures objects are shared, not re-tokenized
+            assert updated.movies[0] is cache.movies[0]
+
+
+class TestRecommendersUseCache:
+
+    def test_compute_recommendations_for_user(self, client):
+        with app.app_context():
+            db = get_db()
+            db.execute('INSERT INTO users_preferences (user_id, preferences_json) VALUES (?, ?)',
+                       ('u1', json.dumps({'directors': ['Christopher Nolan'], 'genres': ['Drama']})))
+            shawshank = db.execute("SELECT rowid FROM movies_flat WHERE movie_title = 'The Shawshank Redemption'").fetchone()[0]
+            list_id = db.execute("INSERT INTO users_watchlist (user_id, name) VALUES ('u1', 'default')").lastrowid
+            db.execute('INSERT INTO user_watchlist_map (list_id, movie_rowid) VALUES (?, ?)', (list_id, shawshank))
+            db.commit()
+
+            recs = server.compute_recommendations_for_user('u1')
+            assert [r['movie_title'] for r in recs] == ['The Dark Knight', 'Inception']
+            assert all('movie_id' in r and 'tags' in r for r in recs)
+
+            server.get_batch_writer().flush()
+
+            stored = db.execute('SELECT recommendations_json FROM recommendation_records WHERE user_id = ?',
+                                ('u1',)).fetchone()[0]
+            assert json.loads(stored) == [r['movie_id'] for r in recs]
+
+    def test_recommend_from_user_skips_favourites(self, client):
+        # preferences without a materialized profile row
+        with app.app_context():
+            db = get_db()
+            db.execute('INSERT INTO users_preferences (user_id, preferences_json) VALUES (?, ?)',
+                       ('cache-user', json.dumps({'movies': ['Inception'], 'directors': ['Christopher Nolan'],
+                                                  'actors': [], 'genres': []})))
+            db.commit()
+        resp = client.post('/recommend/user', data=json.dumps({'user_id': 'cache-user'}),
+                           content_type='application/json')
+        data = json.loads(resp.data)
+        assert data['recommendations'] == ['The Dark Knight']
+
+
+    @pytest.mark.parametrize('mode', ['maxscore', 'full'])
+    def test_retrieval_modes_agree(self, client, monkeypatch, mode):
+        monkeypatch.setattr(server, 'REC_RETRIEVAL', mode)
+        with app.app_context():
+            db = get_db()
+            db.execute('INSERT INTO users_preferences (user_id, preferences_json) VALUES (?, ?)',
+                       ('u1', json.dumps({'directors': ['Christopher Nolan'], 'genres': ['Drama']})))
+            db.commit()
+            recs = server.compute_recommendations_for_user('u1')
+        assert [r['movie_title'] for r in recs] == ['The Dark Knight', 'Inception', 'The Shawshank Redemption']
+
+class TestVectorScorer:
+
+    @pytest.fixture
+    def movies(self):
+        from bench_data import synthetic_movies
+        rows = synthetic_movies(1500, seed=3)
+        return [MovieFeatures(i + 1, r[5], r[0], r[1], r[2], r[3], r[4], r[6]) for i, r in enumerate(rows)]
+
+    def test_matches_reference_ranking(self, movies):
+        from vector_scorer import VectorScorer
+        scorer = VectorScorer(movies)
+        for m in movies[:40:4]:
+            profile = PreferenceProfile({'movies': [m.title], 'directors': [m.director],
+                                         'actors': sorted(m.actors)[:2], 'genres': sorted(m.genres)})
+            excluded = {str(m.rowid), str(movies[7].rowid)}
+            expected = rank_by_preference(movies, profile, 10, skip=lambda x: str(x.rowid) in excluded)
+            got = scorer.top(profile, 10, exclude=scorer.positions_for_rowids(excluded))
+            assert [(s, x.rowid) for s, x in got] == [(s, x.rowid) for s, x in expected]
+
+    def test_ties_at_cutoff_ordered_by_title(self):
+        from vector_scorer import VectorScorer
+        movies = [MovieFeatures(i, title, '', '', '', '', 'Drama', '')
+                  for i, title in enumerate(['Delta', 'alpha', 'Charlie', 'Bravo'], start=1)]
+        scorer = VectorScorer(movies)
+        top = scorer.top(PreferenceProfile({'genres': ['drama']}), 2)
+        assert [m.title for _, m in top] == ['Bravo', 'Charlie']
+
+    def test_append_reuses_matrix(self, movies):
+        from vector_scorer import VectorScorer
+        base = VectorScorer(movies[:1000])
+        extended = VectorScorer(movies, base=base)
+        full = VectorScorer(movies)
+        profile = PreferenceProfile({'genres': ['drama', 'war'], 'directors': [movies[1200].director]})
+        assert [(s, m.rowid) for s, m in extended.top(profile, 20)] == \
+            [(s, m.rowid) for s, m in full.top(profile, 20)]
+
+
+    def test_maxscore_matches_full_scan(self, movies):
+        from vector_scorer import VectorScorer
+        scorer = VectorScorer(movies)
+        for i, m in enumerate(movies[:60:3]):
+            other = movies[i + 100]
+            profile = PreferenceProfile({'movies': [m.title], 'directors': [m.director, other.director],
+                                         'actors': sorted(m.actors)[:2], 'genres': sorted(m.genres)},
+                                        affinity={('genre', g): -0.75 for g in other.genres})
+            exclude = scorer.positions_for_rowids({str(m.rowid), str(movies[7].rowid)})
+            bonus = scorer.bonus_vector({movies[i + 200].rowid: 4.0, movies[i + 300].rowid: 0.5})
+            for top_n in (1, 10, 50):
+                expected = scorer.top(profile, top_n, exclude=exclude, bonus=bonus)
+                got = scorer.top_maxscore(profile, top_n, exclude=exclude, bonus=bonus)
+                assert [(s, x.rowid) for s, x in got] == [(s, x.rowid) for s, x in expected]
+
+    def test_maxscore_skips_low_weight_postings(self, movies):
+        from vector_scorer import VectorScorer
+        scorer = VectorScorer(movies)
+        m = movies[5]
+        profile = PreferenceProfile({'directors': [m.director], 'actors': sorted(m.actors),
+                                     'genres': sorted(m.genres)})
+        stats = {}
+        got = scorer.top_maxscore(profile, 5, stats=stats)
+        assert got == scorer.top(profile, 5)
+        assert stats['visited'] < stats['postings']
+
+
+class TestStreamingScan:
+
+    def test_iter_movie_features_chunks(self, client):
+        with app.app_context():
+            titles = [m.title for m in iter_movie_features(get_db(), chunk_size=2)]
+        assert titles == ['Inception', 'The Dark Knight', 'The Shawshank Redemption']
+
+    def test_large_catalog_streams_instead_of_caching(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'FEATURE_CACHE_MAX_MOVIES', 0)
+        monkeypatch.setattr(server, 'SCAN_CHUNK_SIZE', 1)
+
+        def no_cache(db):
+            raise AssertionError('feature cache used for an oversized catalog')
+        monkeypatch.setattr(server, 'get_feature_cache', no_cache)
+        monkeypatch.setattr(server, 'get_vector_scorer', no_cache)
+
+        with app.app_context():
+            profile = PreferenceProfile({'directors': ['Christopher Nolan'], 'genres': ['Drama', 'Crime']})
+            ranked = server.rank_movies_for_profile(get_db(), profile, 2, exclude_titles={'inception'})
+        assert [(s, m.title) for s, m in ranked] == [(7.0, 'The Dark Knight'), (2.0, 'The Shawshank Redemption')]
+
+        data = json.loads(client.get('/similar?title=Inception&top=2').data)
+        assert data['recommendations'][0]['movie_title'] == 'The Dark Knight'
+
+    def test_bounded_heap_keeps_title_tie_break(self):
+        movies = [MovieFeatures(i, title, '', '', '', '', 'Drama', '')
+                  for i, title in enumerate(['Delta', 'Bravo', 'Charlie', 'Alpha', 'Bravo'], start=1)]
+        ranked = rank_by_preference(iter(movies), PreferenceProfile({'genres': ['drama']}), 3)
+        assert [(m.title, m.rowid) for _, m in ranked] == [('Alpha', 4), ('Bravo', 2), ('Bravo', 5)]
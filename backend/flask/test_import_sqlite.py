@@ -0,0 +1,156 @@
+"""
+Tests for the streaming CSV importer (import_sqlite.py).
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import import_sqlite
+from catalog import changed_rowids, get_catalog_version
+from import_sqlite import import_csv, record_ranges
+
+COLUMNS = 'director_name, actor_1_name, actor_2_name, actor_3_name, genres, movie_title, tags, movie_title_lower'
+
+
+@pytest.fixture
+def paths():
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    csv_fd, csv_path = tempfile.mkstemp(suffix='.csv')
+    os.close(db_fd)
+    os.close(csv_fd)
+    os.unlink(db_path)  # the importer creates it
+
+    yield db_path, csv_path
+
+    for path in (db_path, csv_path):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def write(path, text, encoding='utf-8'):
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        f.write(text)
+
+
+def movies(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(f'SELECT rowid, {COLUMNS} FROM movies_flat ORDER BY rowid').fetchall()
+    finally:
+        conn.close()
+
+
+def version(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return get_catalog_version(conn)
+    finally:
+        conn.close()
+
+
+def synthetic_csv(n):
+    lines = [f'{COLUMNS.replace(", ", ",")}\r\n']
+    for i in range(n):
+        lines.append(f'Director {i % 7},"Actor, {i}",B,C,Drama,Movie {i},"multi\r\nline ""tag"" {i}",movie {i}\r\n')
+    return ''.join(lines)
+
+
+class TestImportSqlite:
+
+    def test_quoting_delimiter_and_derived_title_lower(self, paths):
+        db_path, csv_path = paths
+        write(csv_path, 'director_name;movie_title;genres;tags\n'
+                        'Ann Lee;"Heat; Again";Crime;"one\ntwo ""three"""\n'
+                        'Bo;Solaris;;\n', encoding='utf-8-sig')
+        report = import_csv(db_path, csv_path)
+        assert report['status'] == 'imported' and report['rows'] == 2
+        assert movies(db_path) == [
+            (1, 'Ann Lee', None, None, None, 'Crime', 'Heat; Again', 'one\ntwo "three"', 'heat; again'),
+            (2, 'Bo', None, None, None, '', 'Solaris', '', 'solaris'),
+        ]
+
+    def test_unchanged_file_is_skipped_and_force_reloads(self, paths):
+        db_path, csv_path = paths
+        write(csv_path, synthetic_csv(20))
+        import_csv(db_path, csv_path)
+        loaded, first = movies(db_path), version(db_path)
+
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE movies_flat SET genres = 'Edited' WHERE rowid = 3")  # an admin edit
+        conn.commit()
+        conn.close()
+        assert import_csv(db_path, csv_path)['status'] == 'unchanged'
+        assert movies(db_path)[2][5] == 'Edited'
+
+        assert import_csv(db_path, csv_path, force=True)['rows'] == 20
+        assert movies(db_path) == loaded
+        reloaded = version(db_path)
+        assert reloaded[0] != first[0]  # a new instance: the API rebuilds instead of replaying the log
+
+        # the triggers and the title index are back after the load
+        conn = sqlite3.connect(db_path)
+        names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'movies_flat'")}
+        conn.execute("UPDATE movies_flat SET genres = 'Western' WHERE rowid = 1")
+        conn.commit()
+        conn.close()
+        assert 'idx_movies_flat_title_lower' in names
+        assert version(db_path)[1] == reloaded[1] + 1
+
+    def test_parallel_parse_matches_sequential(self, paths, monkeypatch):
+        db_path, csv_path = paths
+        text = synthetic_csv(300)
+        write(csv_path, text)
+        import_csv(db_path, csv_path, batch_rows=7)
+        sequential = movies(db_path)
+
+        monkeypatch.setattr(import_sqlite, 'PARALLEL_MIN_BYTES', 0)
+        monkeypatch.setattr(import_sqlite, 'CHUNK_BYTES', 500)
+        _, _, data_start = import_sqlite.sniff_format(csv_path)
+        ranges = record_ranges(csv_path, data_start, 500)
+        assert len(ranges) > 10 and ranges[-1][1] == len(text.encode())
+        assert import_csv(db_path, csv_path, force=True, workers=2)['rows'] == 300
+        assert movies(db_path) == sequential
+
+    def test_malformed_rows_are_counted(self, paths):
+        db_path, csv_path = paths
+        write(csv_path, 'movie_title,genres\nHeat,Crime\nBroken,Crime,extra\n\nAlien,Horror\n')
+        report = import_csv(db_path, csv_path)
+        assert (report['rows'], report['skipped']) == (2, 1)
+        assert [m[6] for m in movies(db_path)] == ['Heat', 'Alien']
+
+    def test_sync_applies_only_the_differences(self, paths):
+        db_path, csv_path = paths
+        header = 'director_name,movie_title,genres\n'
+        write(csv_path, header + 'Mann,Heat,Crime\nScott,Alien,Horror\nX,Dune,Drama\nY,Dune,SciFi\nZ,Up,Family\n')
+        assert import_csv(db_path, csv_path, sync=True)['status'] == 'imported'  # an empty table is bulk loaded
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE movies_flat SET rating = 8.3 WHERE movie_title = 'Heat'")
+        conn.commit()
+        conn.close()
+        before = version(db_path)
+
+        # Alien edited, the second Dune removed, Up's director changed, Solaris added
+        write(csv_path, header + 'Mann,Heat,Crime\nScott,Alien,Horror Sci-Fi\nX,Dune,Drama\nW,Up,Family\nT,Solaris,Drama\n')
+        report = import_csv(db_path, csv_path, sync=True)
+        assert report['status'] == 'synced'
+        assert {k: report[k] for k in ('rows', 'inserted', 'updated', 'deleted')} == \
+            {'rows': 5, 'inserted': 2, 'updated': 1, 'deleted': 2}
+        assert [(m[0], m[1], m[6], m[5]) for m in movies(db_path)] == [
+            (1, 'Mann', 'Heat', 'Crime'), (2, 'Scott', 'Alien', 'Horror Sci-Fi'), (3, 'X', 'Dune', 'Drama'),
+            (6, 'W', 'Up', 'Family'), (7, 'T', 'Solaris', 'Drama'),
+        ]
+
+        after = version(db_path)
+        conn = sqlite3.connect(db_path)
+        assert conn.execute('SELECT rating FROM movies_flat WHERE rowid = 1').fetchone()[0] == 8.3
+        assert after[0] == before[0]
+        assert changed_rowids(conn, before, after) == [2, 4, 5, 6, 7]
+        conn.close()
+
+        assert import_csv(db_path, csv_path, sync=True, force=True)['updated'] == 0
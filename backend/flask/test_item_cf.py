@@ -0,0 +1,175 @@
+"""
+Tests for the item-item collaborative filtering model (item_cf.py) and its
+blend into /recommendations.
+"""
+
+import json
+import math
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import item_cf
+import server
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+TITLES = ['Inception', 'The Dark Knight', 'The Shawshank Redemption', 'Amelie', 'Heat']
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        for title in TITLES:
+            db.execute('INSERT INTO movies_flat (movie_title, movie_title_lower, genres) VALUES (?, ?, ?)',
+                       (title, title.lower(), 'Drama'))
+        for user_id in ('alice', 'bob', 'carol'):
+            db.execute('INSERT INTO users_basic (user_id) VALUES (?)', (user_id,))
+        db.commit()
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def rowid(title):
+    return TITLES.index(title) + 1
+
+
+def rate(client, user_id, title, rating):
+    resp = client.post(f'/movies/{rowid(title)}/feedback', data=json.dumps({'user_id': user_id, 'rating': rating}),
+                       content_type='application/json')
+    assert resp.status_code == 200
+
+
+def neighbours(db):
+    rows = db.execute('SELECT movie_rowid, neighbour_rowid, score FROM item_neighbours').fetchall()
+    return {(a, b): s for a, b, s in rows}
+
+
+RATINGS = [
+    ('alice', 'Inception', 5), ('alice', 'The Dark Knight', 4), ('alice', 'Heat', 2),
+    ('bob', 'Inception', 4), ('bob', 'The Dark Knight', 5), ('bob', 'Amelie', 1),
+    ('carol', 'The Shawshank Redemption', 5), ('carol', 'Inception', 3),
+]
+
+
+class TestItemCF:
+
+    def test_build_cosine(self, client):
+        for user_id, title, rating in RATINGS:
+            rate(client, user_id, title, rating)
+        with app.app_context():
+            db = get_db()
+            item_cf.build(db)
+            sims = neighbours(db)
+        inception, dark_knight = rowid('Inception'), rowid('The Dark Knight')
+        expected = (5 * 4 + 4 * 5) / math.sqrt((25 + 16 + 9) * (16 + 25))
+        assert sims[(inception, dark_knight)] == pytest.approx(expected)
+        assert sims[(dark_knight, inception)] == pytest.approx(expected)
+
+    def test_incremental_updates_match_batch_build(self, client):
+        for user_id, title, rating in RATINGS:
+            rate(client, user_id, title, rating)
+        rate(client, 'alice', 'Inception', 1)  # changed rating
+        with app.app_context():
+            db = get_db()
+            incremental = neighbours(db)
+            item_cf.build(db)
+            rebuilt = neighbours(db)
+        assert set(incremental) == set(rebuilt)
+        for key, score in rebuilt.items():
+            assert incremental[key] == pytest.approx(score)
+
+    def test_incremental_updates_keep_the_per_user_cap(self, client, monkeypatch):
+        monkeypatch.setattr(item_cf, 'MAX_ITEMS_PER_USER', 2)
+        for user_id, title, rating in RATINGS:
+            rate(client, user_id, title, rating)
+        rate(client, 'alice', 'Amelie', 3)  # retires alice's oldest kept rating
+        rate(client, 'alice', 'The Dark Knight', 4)  # re-rated: newest again
+        with app.app_context():
+            db = get_db()
+            incremental = neighbours(db)
+            norms = dict(db.execute('SELECT movie_rowid, norm_sq FROM item_norms WHERE n_ratings > 0').fetchall())
+            item_cf.build(db)
+            rebuilt = neighbours(db)
+            rebuilt_norms = dict(db.execute('SELECT movie_rowid, norm_sq FROM item_norms').fetchall())
+        assert set(incremental) == set(rebuilt)
+        for key, score in rebuilt.items():
+            assert incremental[key] == pytest.approx(score)
+        assert norms == pytest.approx(rebuilt_norms)
+
+    def test_lists_are_refilled_when_a_neighbour_drops(self, client):
+        # with k=1, Shawshank leads The Dark Knight's list until four more
+        # ratings of Shawshank lower their similarity below Inception's
+        ratings = [('alice', 'The Dark Knight', 5), ('alice', 'The Shawshank Redemption', 5),
+                   ('bob', 'The Dark Knight', 5), ('bob', 'Inception', 3), ('carol', 'Inception', 5)]
+        ratings += [(f'user{i}', 'The Shawshank Redemption', 5) for i in range(4)]
+        with app.app_context():
+            db = get_db()
+            for at, (user_id, title, rating) in enumerate(ratings):
+                item_cf.apply_rating(db, user_id, rowid(title), rating, k=1)
+                db.execute('INSERT INTO users_feedback (user_id, movie_rowid, rating, created_at) VALUES (?, ?, ?, ?)',
+                           (user_id, rowid(title), rating, at))
+            db.commit()
+            incremental = neighbours(db)
+            item_cf.build(db, k=1)
+            rebuilt = neighbours(db)
+        assert (rowid('The Dark Knight'), rowid('Inception')) in rebuilt
+        assert set(incremental) == set(rebuilt)
+        for key, score in rebuilt.items():
+            assert incremental[key] == pytest.approx(score)
+
+    def test_neighbour_lists_capped_at_k(self, client):
+        with app.app_context():
+            db = get_db()
+            for i, title in enumerate(TITLES):
+                db.execute("INSERT INTO users_feedback (user_id, movie_rowid, rating) VALUES ('alice', ?, 4)",
+                           (rowid(title),))
+                item_cf.apply_rating(db, 'alice', rowid(title), 4, k=2)
+            db.commit()
+            counts = db.execute('SELECT movie_rowid, COUNT(*) FROM item_neighbours GROUP BY movie_rowid').fetchall()
+        assert counts and all(c <= 2 for _, c in counts)
+
+    def test_cf_signal_blended_into_recommendations(self, client):
+        # bob and carol both loved Inception and Heat; alice loved Inception
+        rate(client, 'bob', 'Inception', 5)
+        rate(client, 'bob', 'Heat', 5)
+        rate(client, 'carol', 'Inception', 4)
+        rate(client, 'carol', 'Heat', 5)
+        rate(client, 'alice', 'Inception', 5)
+        # preferences that match no movie: only CF can produce results
+        client.put('/users/alice/settings', data=json.dumps({'genres': ['Western']}),
+                   content_type='application/json')
+
+        # every fixture is a Drama, which alice's rating also taught her profile;
+        # the CF neighbour of Inception ranks first
+        data = json.loads(client.get('/recommendations/alice').data)
+        assert data['recommendations'][0]['movie_title'] == 'Heat'
+
+    def test_cf_weight_zero_disables_signal(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'CF_WEIGHT', 0.0)
+        rate(client, 'bob', 'Inception', 5)
+        rate(client, 'bob', 'Heat', 5)
+        rate(client, 'alice', 'Inception', 5)
+        client.put('/users/alice/settings', data=json.dumps({'genres': ['Western']}),
+                   content_type='application/json')
+        data = json.loads(client.get('/recommendations/alice').data)
+        # only the learned Drama affinity is left: equal scores, title order
+        assert [r['movie_title'] for r in data['recommendations']] == \
+            ['Amelie', 'Heat', 'The Dark Knight', 'The Shawshank Redemption']
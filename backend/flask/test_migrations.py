@@ -0,0 +1,115 @@
+"""
+Tests for the versioned schema migrations (migrations.py).
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import migrations
+import server
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+
+def old_schema(conn):
+    """The user tables as init_db_schema created them before any migration."""
+    conn.executescript('''
+        CREATE TABLE users_feedback (feedback_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT,
+            movie_rowid INTEGER, movie_title TEXT, rating REAL, text TEXT, created_at REAL);
+        CREATE TABLE users_watchlist (list_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, name TEXT,
+            created_at REAL);
+        CREATE TABLE user_watchlist_map (id INTEGER PRIMARY KEY AUTOINCREMENT, list_id INTEGER,
+            movie_rowid INTEGER, added_at REAL);
+    ''')
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    old_schema(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        db.execute("INSERT INTO movies_flat (movie_title, movie_title_lower, genres) VALUES ('Heat', 'heat', 'Crime')")
+        db.execute("INSERT INTO users_basic (user_id) VALUES ('u1')")
+        db.commit()
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def plan(conn, sql, params):
+    return ' '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params))
+
+
+class TestMigrate:
+
+    def test_deduplicates_then_adds_constraints(self, conn):
+        conn.executemany('INSERT INTO users_feedback (user_id, movie_rowid, rating) VALUES (?, ?, ?)',
+                         [('u1', 1, 2), ('u1', 1, 5), ('u1', 2, 3), (None, 1, 4), (None, 1, 4)])
+        conn.executemany('INSERT INTO user_watchlist_map (list_id, movie_rowid) VALUES (?, ?)', [(1, 7), (1, 7), (1, 8)])
+        conn.commit()
+
+        assert migrations.migrate(conn) == [1, 2, 3]
+        assert migrations.migrate(conn) == []
+        assert migrations.current_version(conn) == len(migrations.MIGRATIONS)
+        # the latest rating wins; rows without a user are left alone
+        assert conn.execute('SELECT user_id, movie_rowid, rating FROM users_feedback ORDER BY feedback_id').fetchall() == \
+            [('u1', 1, 5.0), ('u1', 2, 3.0), (None, 1, 4.0), (None, 1, 4.0)]
+        assert conn.execute('SELECT list_id, movie_rowid FROM user_watchlist_map ORDER BY id').fetchall() == [(1, 7), (1, 8)]
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO users_feedback (user_id, movie_rowid, rating) VALUES ('u1', 2, 1)")
+
+    def test_user_lookups_use_indexes(self, conn):
+        migrations.migrate(conn)
+        assert 'ux_users_feedback_user_movie' in plan(
+            conn, 'SELECT movie_rowid FROM users_feedback WHERE user_id = ? AND rating IS NOT NULL', ('u1',))
+        assert 'ux_users_feedback_user_movie' in plan(
+            conn, 'SELECT rating FROM users_feedback WHERE user_id = ? AND movie_rowid = ?', ('u1', 1))
+        watchlist = plan(conn, 'SELECT movie_rowid FROM user_watchlist_map m JOIN users_watchlist w '
+                               'ON m.list_id = w.list_id WHERE w.user_id = ?', ('u1',))
+        assert 'idx_users_watchlist_user' in watchlist and 'ux_user_watchlist_map_list_movie' in watchlist
+
+    def test_failed_migration_is_not_recorded(self, conn):
+        def broken(db):
+            db.execute('CREATE INDEX idx_broken ON users_feedback(user_id)')
+            raise RuntimeError('boom')
+        with pytest.raises(RuntimeError):
+            migrations.migrate(conn, migrations.MIGRATIONS[:1] + [(2, 'broken', broken)])
+        assert migrations.current_version(conn) == 1
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'idx_broken'").fetchone()[0] == 0
+
+
+class TestFeedbackUpsert:
+
+    def test_rerating_updates_the_single_row(self, client):
+        for rating in (2, 5):
+            resp = client.post('/movies/1/feedback', data=json.dumps({'user_id': 'u1', 'rating': rating}),
+                               content_type='application/json')
+            assert resp.status_code == 200
+        with app.app_context():
+            rows = get_db().execute('SELECT rating FROM users_feedback WHERE user_id = ?', ('u1',)).fetchall()
+        assert [r[0] for r in rows] == [5.0]
@@ -0,0 +1,147 @@
+"""
+Tests for the offline recommendation precompute job (precompute.py) and
+/recommendations serving its results.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import affinity
+import precompute
+import profile_store
+import server
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+
+@pytest.fixture
+def db_path(monkeypatch):
+    db_fd, path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+    # forked workers would otherwise inherit whatever catalog an earlier test loaded
+    monkeypatch.setattr(precompute, '_catalog', None)
+    monkeypatch.setattr(precompute, '_scorer', None)
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        movies = [
+            ('Christopher Nolan', 'Leonardo DiCaprio', 'Ellen Page', 'Marion Cotillard',
+             'Sci-Fi, Thriller, Action', 'Inception', 'mind-bending, heist, dreams'),
+            ('Christopher Nolan', 'Christian Bale', 'Michael Caine', 'Gary Oldman',
+             'Action, Crime, Drama', 'The Dark Knight', 'superhero, dark, intense'),
+            ('Frank Darabont', 'Tim Robbins', 'Morgan Freeman', 'Bob Gunton',
+             'Drama, Crime', 'The Shawshank Redemption', 'redemption, prison, classic'),
+        ]
+        for m in movies:
+            db.execute('''
+                INSERT INTO movies_flat
+                (director_name, actor_1_name, actor_2_name, actor_3_name, genres, movie_title, tags, movie_title_lower)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (*m, m[5].lower()))
+        prefs = {
+            'u1': {'directors': ['Christopher Nolan'], 'genres': ['Drama']},
+            'u2': {'directors': ['Frank Darabont']},
+            'u3': {'genres': ['Sci-Fi']},
+        }
+        for user_id, p in prefs.items():
+            db.execute('INSERT INTO users_basic (user_id, display_name) VALUES (?, ?)', (user_id, user_id))
+            db.execute('INSERT INTO users_preferences (user_id, preferences_json) VALUES (?, ?)',
+                       (user_id, json.dumps(p)))
+        # u1 has seen The Dark Knight
+        db.execute("INSERT INTO users_feedback (user_id, movie_rowid, rating) "
+                   "SELECT 'u1', rowid, 5 FROM movies_flat WHERE movie_title = 'The Dark Knight'")
+        db.commit()
+
+    yield path
+
+    server.get_profile_store().close()
+    os.close(db_fd)
+    os.unlink(path)
+    server.DATABASE = original_db
+
+
+def stored(path):
+    with app.app_context():
+        rows = get_db().execute('SELECT user_id, recommendations_json FROM precomputed_recommendations').fetchall()
+    return {u: json.loads(ids) for u, ids in rows}
+
+
+def online_ids(user_id):
+    with app.app_context():
+        recs = server.rank_recommendations_for_user(user_id, top_n=20)
+    return [r['movie_id'] for r in recs]
+
+
+class TestPrecompute:
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_matches_online_compute(self, db_path, workers):
+        run_id, done, _ = precompute.run(db_path, top_n=20, workers=workers, batch_size=2, log=lambda msg: None)
+        assert done == 3
+        assert stored(db_path) == {u: online_ids(u) for u in ('u1', 'u2', 'u3')}
+
+    def test_missing_profiles_are_rebuilt_with_the_stored_lists(self, db_path):
+        with app.app_context():
+            db = get_db()
+            server.get_profile_store().add_title(db, 'u3', profile_store.SEEN, 'Inception')
+            server.get_profile_store().flush()
+            db.execute("DELETE FROM user_affinity WHERE user_id = 'u3'")
+            db.commit()
+        precompute.run(db_path, workers=1, log=lambda msg: None)
+        with app.app_context():
+            assert affinity.load_many(get_db(), ['u3'])['u3'].seen_titles == {'inception'}
+        data = json.loads(app.test_client().post('/recommend/user', data=json.dumps({'user_id': 'u3'}),
+                                                  content_type='application/json').data)
+        assert 'Inception' not in data['recommendations']
+
+    def test_resume_continues_after_checkpoint(self, db_path):
+        run_id, done, _ = precompute.run(db_path, workers=1, batch_size=1, max_users=2, log=lambda msg: None)
+        assert done == 2
+        assert set(stored(db_path)) == {'u1', 'u2'}
+
+        resumed_id, done, _ = precompute.run(db_path, workers=1, resume=True, log=lambda msg: None)
+        assert resumed_id == run_id
+        assert done == 1
+        assert set(stored(db_path)) == {'u1', 'u2', 'u3'}
+        with app.app_context():
+            finished = get_db().execute('SELECT finished_at, users_done FROM precompute_runs WHERE run_id = ?',
+                                        (run_id,)).fetchone()
+        assert finished[0] is not None and finished[1] == 3
+
+    def test_fresh_rows_are_served(self, db_path, monkeypatch):
+        precompute.run(db_path, workers=1, log=lambda msg: None)
+
+        def no_online(*args, **kwargs):
+            raise AssertionError('computed online despite a fresh precomputed row')
+        monkeypatch.setattr(server, 'rank_recommendations_for_user', no_online)
+
+        data = json.loads(app.test_client().get('/recommendations/u1').data)
+        assert [r['movie_title'] for r in data['recommendations']] == ['Inception', 'The Shawshank Redemption']
+
+    def test_stale_rows_fall_back_to_online(self, db_path, monkeypatch):
+        precompute.run(db_path, top_n=5, workers=1, log=lambda msg: None)
+        client = app.test_client()
+        client.post('/user/preferences', data=json.dumps({
+            'user_id': 'u2', 'preferences': {'genres': ['Sci-Fi']}
+        }), content_type='application/json')
+        data = json.loads(client.get('/recommendations/u2').data)
+        assert [r['movie_title'] for r in data['recommendations']] == ['Inception']
+
+        # asking for more than was precomputed also goes online
+        calls = []
+        original = server.rank_recommendations_for_user
+        monkeypatch.setattr(server, 'rank_recommendations_for_user',
+                            lambda *a, **kw: calls.append(1) or original(*a, **kw))
+        client.get('/recommendations/u3?top=10')
+        assert calls
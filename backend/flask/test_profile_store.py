@@ -0,0 +1,210 @@
+"""
+Tests for the shared user title-list store (profile_store.py).
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import profile_store
+import server
+from profile_store import SEEN, WATCHLIST, ProfileStore
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+
+@pytest.fixture
+def db_path():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    conn = sqlite3.connect(path)
+    profile_store.ensure_profile_store_schema(conn.cursor())
+    conn.commit()
+    conn.close()
+    yield path
+    os.close(fd)
+    os.unlink(path)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        for director, title in (('Christopher Nolan', 'Inception'), ('Christopher Nolan', 'The Dark Knight'),
+                                ('Christopher Nolan', 'Interstellar')):
+            db.execute('INSERT INTO movies_flat (director_name, movie_title, movie_title_lower) VALUES (?, ?, ?)',
+                       (director, title, title.lower()))
+        db.commit()
+
+    yield app.test_client()
+
+    server.get_profile_store().close()
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def post(client, url, payload):
+    return client.post(url, data=json.dumps(payload), content_type='application/json')
+
+
+class TestProfileStore:
+
+    def test_writes_are_visible_to_other_workers_after_flush(self, db_path):
+        worker_a, worker_b = ProfileStore(db_path), ProfileStore(db_path)
+        conn = sqlite3.connect(db_path)
+        try:
+            assert worker_b.get(conn, 'u1').watchlist == []
+            worker_a.add_title(conn, 'u1', WATCHLIST, 'Inception')
+            worker_a.add_title(conn, 'u1', WATCHLIST, ' inception ')  # deduped
+            worker_a.mark_seen(conn, 'u1', 'Heat')
+            # read-your-writes in the writing process before the flush
+            assert worker_a.get(conn, 'u1').watchlist == ['Inception']
+            worker_a.flush()
+            lists = worker_b.get(conn, 'u1')
+            assert (lists.watchlist, lists.seen) == (['Inception'], ['Heat'])
+
+            # concurrent writers apply operations, not whole lists
+            worker_b.add_title(conn, 'u1', WATCHLIST, 'Amelie')
+            worker_a.remove_title(conn, 'u1', WATCHLIST, 'INCEPTION')
+            worker_b.flush()
+            worker_a.flush()
+            assert worker_a.get(conn, 'u1').watchlist == worker_b.get(conn, 'u1').watchlist == ['Amelie']
+        finally:
+            worker_a.close()
+            worker_b.close()
+            conn.close()
+
+    def test_batches_flush_in_background(self, db_path):
+        store = ProfileStore(db_path, flush_interval=0.01)
+        conn = sqlite3.connect(db_path)
+        try:
+            for i in range(20):
+                store.add_title(conn, f'u{i % 2}', SEEN, f'Movie {i}')
+            store.add_note(conn, None, 'Heat', 4, 'anonymous')
+            deadline = time.time() + 2
+            while conn.execute('SELECT COUNT(*) FROM user_titles').fetchone()[0] < 20 and time.time() < deadline:
+                time.sleep(0.01)
+            assert conn.execute('SELECT COUNT(*) FROM user_titles').fetchone()[0] == 20
+            assert not store._pending
+            assert ProfileStore(db_path).get(conn, profile_store.ANONYMOUS).feedback == [
+                {'movie': 'Heat', 'rating': 4.0, 'text': 'anonymous'}]
+        finally:
+            store.close()
+            conn.close()
+
+    def test_cache_is_bounded(self, db_path):
+        store = ProfileStore(db_path, max_users=2)
+        conn = sqlite3.connect(db_path)
+        try:
+            for user_id in ('a', 'b', 'c'):
+                store.add_title(conn, user_id, WATCHLIST, 'Inception')
+            assert list(store._entries) == ['b', 'c']
+            # an evicted user's unflushed writes are still served
+            assert store.get(conn, 'a').watchlist == ['Inception']
+        finally:
+            store.close()
+            conn.close()
+
+    def test_writes_return_the_lists_without_a_cache(self, db_path):
+        store = ProfileStore(db_path, max_users=0)
+        conn = sqlite3.connect(db_path)
+        try:
+            assert store.add_title(conn, 'u1', WATCHLIST, 'Inception').watchlist == ['Inception']
+            lists = store.mark_seen(conn, 'u1', 'Inception')
+            assert (lists.watchlist, lists.seen) == ([], ['Inception'])
+            assert not store._entries
+        finally:
+            store.close()
+            conn.close()
+
+    def test_reads_during_a_flush_see_the_batch(self, db_path, monkeypatch):
+        store = ProfileStore(db_path, flush_interval=60, max_users=1)
+        conn = sqlite3.connect(db_path)
+        apply_ops, seen = profile_store.apply_ops, []
+
+        def read_before_commit(db, ops):
+            versions = apply_ops(db, ops)
+            store.get(conn, 'u2')  # evicts u1
+            seen.append(store.get(conn, 'u1').watchlist)
+            return versions
+        monkeypatch.setattr(profile_store, 'apply_ops', read_before_commit)
+        try:
+            store.add_title(conn, 'u1', WATCHLIST, 'Inception')
+            store.flush()
+            assert seen == [['Inception']]
+            assert store.get(conn, 'u1').watchlist == ['Inception']
+            assert ProfileStore(db_path).get(conn, 'u1').watchlist == ['Inception']
+        finally:
+            store.close()
+            conn.close()
+
+    def test_failed_batches_are_dropped_after_retries(self, db_path, monkeypatch):
+        store = ProfileStore(db_path, flush_interval=60)
+        conn = sqlite3.connect(db_path)
+
+        def failing(db, ops):
+            raise sqlite3.OperationalError('disk I/O error')
+        try:
+            store.add_title(conn, 'u1', WATCHLIST, 'Inception')
+            monkeypatch.setattr(profile_store, 'apply_ops', failing)
+            for _ in range(profile_store.MAX_FLUSH_ATTEMPTS - 1):
+                store.flush()
+                assert len(store._pending) == 1
+            store.flush()
+            assert not store._pending
+            monkeypatch.undo()
+            assert store.get(conn, 'u1').watchlist == []
+        finally:
+            store.close()
+            conn.close()
+
+
+class TestEndpoints:
+
+    def test_lists_survive_a_new_worker(self, client):
+        post(client, '/user/watchlist', {'user_id': 'u1', 'movie': 'Inception'})
+        post(client, '/user/watchlist', {'user_id': 'u1', 'movie': 'Interstellar'})
+        data = json.loads(post(client, '/user/seen', {'user_id': 'u1', 'movie': 'Inception'}).data)
+        assert (data['seen'], data['watchlist']) == (['Inception'], ['Interstellar'])
+        post(client, '/user/feedback', {'user_id': 'u1', 'movie': 'Inception', 'rating': 5, 'text': 'great'})
+        server.get_profile_store().flush()
+
+        # what another process would see: a fresh store over the same database
+        server._profile_store = None
+        assert json.loads(client.get('/user/watchlist/u1').data)['watchlist'] == ['Interstellar']
+        assert json.loads(client.get('/user/feedback/u1').data)['feedback'] == [
+            {'movie': 'Inception', 'rating': 5, 'text': 'great'}]
+
+    def test_recommend_user_excludes_stored_lists(self, client):
+        with app.app_context():
+            db = get_db()
+            db.execute('INSERT INTO users_preferences (user_id, preferences_json) VALUES (?, ?)',
+                       ('u2', json.dumps({'directors': ['Christopher Nolan']})))
+            db.commit()
+            server.get_profile_store().add_title(db, 'u2', SEEN, 'Inception')
+        data = json.loads(post(client, '/recommend/user', {'user_id': 'u2'}).data)
+        assert data['recommendations'] == ['Interstellar', 'The Dark Knight']
+
+    def test_queued_writes_are_flushed_at_exit(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'PROFILE_FLUSH_MS', 60000)
+        monkeypatch.setattr(server, '_trending_consumer', None)
+        server._profile_store = None
+        post(client, '/user/watchlist', {'user_id': 'u1', 'movie': 'Inception'})
+        server.close_profile_store()  # registered with atexit
+        with app.app_context():
+            assert [r[0] for r in get_db().execute('SELECT title FROM user_titles')] == ['Inception']
@@ -0,0 +1,162 @@
+"""
+Tests for the per-user /recommendations/<user_id> cache (rec_cache.py).
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import server
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        movies = [
+            ('Christopher Nolan', 'Leonardo DiCaprio', 'Ellen Page', 'Marion Cotillard',
+             'Sci-Fi, Thriller, Action', 'Inception', 'mind-bending, heist, dreams'),
+            ('Christopher Nolan', 'Christian Bale', 'Michael Caine', 'Gary Oldman',
+             'Action, Crime, Drama', 'The Dark Knight', 'superhero, dark, intense'),
+            ('Frank Darabont', 'Tim Robbins', 'Morgan Freeman', 'Bob Gunton',
+             'Drama, Crime', 'The Shawshank Redemption', 'redemption, prison, classic'),
+        ]
+        for m in movies:
+            db.execute('''
+                INSERT INTO movies_flat
+                (director_name, actor_1_name, actor_2_name, actor_3_name, genres, movie_title, tags, movie_title_lower)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (*m, m[5].lower()))
+        db.execute("INSERT INTO users_basic (user_id, display_name) VALUES ('u1', 'User One')")
+        db.commit()
+
+    c = app.test_client()
+    c.post('/user/preferences', data=json.dumps({
+        'user_id': 'u1', 'preferences': {'directors': ['Christopher Nolan'], 'genres': ['Drama']}
+    }), content_type='application/json')
+    yield c
+
+    server.get_profile_store().close()
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def titles(resp):
+    return [r['movie_title'] for r in json.loads(resp.data)['recommendations']]
+
+
+def count(table):
+    server.get_batch_writer().flush()
+    with app.app_context():
+        return get_db().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def rowid_of(title):
+    with app.app_context():
+        return get_db().execute('SELECT rowid FROM movies_flat WHERE movie_title = ?', (title,)).fetchone()[0]
+
+
+class TestRecommendationCache:
+
+    def test_repeat_hit_served_from_cache(self, client, monkeypatch):
+        first = client.get('/recommendations/u1')
+        assert titles(first) == ['The Dark Knight', 'Inception', 'The Shawshank Redemption']
+
+        def no_recompute(*args, **kwargs):
+            raise AssertionError('recommendations recomputed on a cache hit')
+        monkeypatch.setattr(server, 'rank_recommendations_for_user', no_recompute)
+
+        second = client.get('/recommendations/u1')
+        assert json.loads(second.data) == json.loads(first.data)
+        assert count('recommendation_records') == 1
+        assert count('recommendation_hits') == 1
+
+    def test_degraded_enrichment_expires(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'REC_CACHE_DEGRADED_TTL', 0)
+
+        def enrich(imdb_score):
+            def enrich_movie_info(movie):
+                movie.update(synopsis='A plot.', imdb_score=imdb_score)
+                return movie
+            return enrich_movie_info
+
+        def scores(resp):
+            return {r['imdb_score'] for r in json.loads(resp.data)['recommendations']}
+        monkeypatch.setattr(server, 'enrich_movie_info', enrich('N/A'))  # OMDB down
+        assert scores(client.get('/recommendations/u1')) == {'N/A'}
+        monkeypatch.setattr(server, 'enrich_movie_info', enrich('8.0'))
+        assert scores(client.get('/recommendations/u1')) == {'8.0'}
+        assert count('recommendation_records') == 2
+
+        # a complete response is served without enriching again
+        monkeypatch.setattr(server, 'enrich_movie_info', enrich('7.0'))
+        assert scores(client.get('/recommendations/u1')) == {'8.0'}
+        assert count('recommendation_records') == 2
+
+    def test_top_n_is_part_of_key(self, client):
+        client.get('/recommendations/u1')
+        assert len(titles(client.get('/recommendations/u1?top=1'))) == 1
+        assert count('recommendation_records') == 2
+
+    def test_preference_change_invalidates(self, client):
+        client.get('/recommendations/u1')
+        client.post('/user/preferences', data=json.dumps({
+            'user_id': 'u1', 'preferences': {'directors': ['Frank Darabont']}
+        }), content_type='application/json')
+        assert titles(client.get('/recommendations/u1')) == ['The Shawshank Redemption']
+
+    def test_settings_update_invalidates(self, client):
+        client.get('/recommendations/u1')
+        client.put('/users/u1/settings', data=json.dumps({'genres': ['Sci-Fi']}),
+                   content_type='application/json')
+        assert titles(client.get('/recommendations/u1')) == ['Inception']
+
+    def test_feedback_invalidates(self, client):
+        client.get('/recommendations/u1')
+        client.post(f"/movies/{rowid_of('The Dark Knight')}/feedback",
+                    data=json.dumps({'user_id': 'u1', 'rating': 5}), content_type='application/json')
+        assert 'The Dark Knight' not in titles(client.get('/recommendations/u1'))
+
+    def test_watchlist_add_invalidates(self, client):
+        client.get('/recommendations/u1')
+        list_id = json.loads(client.post('/users/u1/watchlists', data=json.dumps({}),
+                                         content_type='application/json').data)['list_id']
+        client.post(f'/watchlists/{list_id}/movies',
+                    data=json.dumps({'user_id': 'u1', 'movie_id': rowid_of('Inception')}),
+                    content_type='application/json')
+        assert 'Inception' not in titles(client.get('/recommendations/u1'))
+
+    def test_catalog_change_invalidates(self, client):
+        client.get('/recommendations/u1')
+        with app.app_context():
+            db = get_db()
+            db.execute("INSERT INTO movies_flat (director_name, genres, movie_title, movie_title_lower) "
+                       "VALUES ('Christopher Nolan', 'Sci-Fi', 'Interstellar', 'interstellar')")
+            db.commit()
+        assert 'Interstellar' in titles(client.get('/recommendations/u1'))
+
+    def test_lru_evicts_oldest(self):
+        cache = RecommendationCache(max_users=2)
+        cache.put('a', 1, None, {})
+        cache.put('b', 1, None, {})
+        cache.get('a', 1)
+        cache.put('c', 1, None, {})
+        assert cache.get('b', 1) is None
+        assert cache.get('a', 1) is not None
+        assert cache.get('c', 2) is None
@@ -0,0 +1,135 @@
+"""
+Tests for the two-stage candidate generation / re-ranking pipeline (rec_pipeline.py).
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import server
+from features import MovieFeatures, PreferenceProfile, rank_by_preference
+from rec_cache import RecommendationCache
+from rec_pipeline import run_pipeline
+from server import app, get_db, init_db_schema
+
+MOVIES = [
+    ('Christopher Nolan', 'Leonardo DiCaprio', 'Sci-Fi, Thriller', 'Inception'),
+    ('Christopher Nolan', 'Christian Bale', 'Action, Crime, Drama', 'The Dark Knight'),
+    ('Frank Darabont', 'Tim Robbins', 'Drama, Crime', 'The Shawshank Redemption'),
+    ('Michael Mann', 'Al Pacino', 'Crime, Thriller', 'Heat'),
+    ('Jean-Pierre Jeunet', 'Audrey Tautou', 'Comedy, Romance', 'Amelie'),
+]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        for director, actor, genres, title in MOVIES:
+            db.execute('INSERT INTO movies_flat (director_name, actor_1_name, genres, movie_title, movie_title_lower) '
+                       'VALUES (?, ?, ?, ?, ?)', (director, actor, genres, title, title.lower()))
+        for user_id in ('alice', 'bob'):
+            db.execute('INSERT INTO users_basic (user_id) VALUES (?)', (user_id,))
+        db.commit()
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def rowid(title):
+    return [m[3] for m in MOVIES].index(title) + 1
+
+
+def put_settings(client, user_id, prefs):
+    client.put(f'/users/{user_id}/settings', data=json.dumps(prefs), content_type='application/json')
+
+
+def recommend(client, user_id, debug=False):
+    return json.loads(client.get(f"/recommendations/{user_id}{'?debug=1' if debug else ''}").data)
+
+
+class TestRunPipeline:
+
+    def test_union_filter_and_trace(self):
+        movies = {i: MovieFeatures(i, f'M{i}', '', '', '', '', 'Drama', '') for i in range(1, 7)}
+        trace = []
+        got = run_pipeline(
+            [('a', lambda budget: [1, 2, 3][:budget]), ('b', lambda budget: [3, 4, 5][:budget])],
+            exclude=lambda r: r == 2,
+            load_movies=lambda rowids: {r: movies[r] for r in rowids},
+            rerank=lambda ms, n: rank_by_preference(ms, PreferenceProfile({'genres': ['drama']}), n),
+            budget=2, top_n=10, trace=trace,
+        )
+        # 3 comes from both generators; 2 is filtered; 5 and 6 are never proposed
+        assert [m.rowid for _, m in got] == [1, 3, 4]
+        assert [(t['stage'], t['count']) for t in trace] == [
+            ('candidates:a', 2), ('candidates:b', 2), ('filter', 3), ('load', 3), ('rerank', 3)]
+        assert all(t['ms'] >= 0 for t in trace)
+
+
+class TestTwoStageRecommendations:
+
+    def test_matches_full_scan_when_budget_covers_matches(self, client, monkeypatch):
+        put_settings(client, 'alice', {'directors': ['Christopher Nolan'], 'genres': ['Crime']})
+        client.post(f"/movies/{rowid('Inception')}/feedback", data=json.dumps({'user_id': 'alice', 'rating': 4}),
+                    content_type='application/json')
+        two_stage = [r['movie_title'] for r in recommend(client, 'alice', debug=True)['recommendations']]
+        monkeypatch.setattr(server, 'REC_PIPELINE', 'full')
+        full = [r['movie_title'] for r in recommend(client, 'alice', debug=True)['recommendations']]
+        assert two_stage == full
+        assert 'Inception' not in two_stage
+
+    def test_debug_output_times_each_stage(self, client):
+        put_settings(client, 'alice', {'genres': ['Drama']})
+        data = recommend(client, 'alice', debug=True)
+        debug = data['debug']
+        assert debug['pipeline'] == 'two_stage'
+        assert [s['stage'] for s in debug['stages']] == [
+            'candidates:preference', 'candidates:neighbours', 'candidates:popular', 'filter', 'load', 'rerank']
+        assert debug['stages'][-1]['count'] == data['count'] == 2
+        # stage 1 walks posting lists instead of ranking the catalog
+        preference = debug['stages'][0]
+        assert 0 < preference['visited'] <= preference['postings']
+
+    def test_candidate_budget_caps_generators(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'REC_CANDIDATES', 1)
+        put_settings(client, 'alice', {'genres': ['Crime']})
+        data = recommend(client, 'alice', debug=True)
+        stages = {s['stage']: s['count'] for s in data['debug']['stages']}
+        assert stages['candidates:preference'] == 1
+        assert [r['movie_title'] for r in data['recommendations']] == ['Heat']
+
+    def test_popular_candidates_need_popularity_weight(self, client, monkeypatch):
+        client.post(f"/movies/{rowid('Amelie')}/feedback", data=json.dumps({'user_id': 'bob', 'rating': 5}),
+                    content_type='application/json')
+        # preferences that match nothing: only the popularity prior can score
+        put_settings(client, 'alice', {'genres': ['Western']})
+        assert recommend(client, 'alice', debug=True)['recommendations'] == []
+        monkeypatch.setattr(server, 'REC_POPULARITY_WEIGHT', 1.0)
+        assert [r['movie_title'] for r in recommend(client, 'alice', debug=True)['recommendations']] == ['Amelie']
+
+    def test_favourite_titles_seed_neighbour_candidates(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'REC_GENERATORS', ['neighbours'])
+        for title in ('Amelie', 'Heat'):
+            client.post(f"/movies/{rowid(title)}/feedback", data=json.dumps({'user_id': 'bob', 'rating': 5}),
+                        content_type='application/json')
+        # Amelie is a favourite, so Heat (co-rated with it) becomes a candidate
+        put_settings(client, 'alice', {'movies': ['Amelie'], 'genres': ['Thriller']})
+        titles = [r['movie_title'] for r in recommend(client, 'alice', debug=True)['recommendations']]
+        assert titles == ['Heat']
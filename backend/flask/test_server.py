@@ -276,6 +276,72 @@ class TestAPIEndpoints:
         response = client.get('/similar?title=NonExistentMovie&top=5')
         assert response.status_code == 404
 
+    def test_similar_batch_matches_single_seed_calls(self, client, monkeypatch):
+        """Test batch similar returns each seed's /similar ranking plus a merged one."""
+        import server as server_module
+        enriched = []
+        monkeypatch.setattr(server_module, 'enrich_movie_info', lambda movie: enriched.append(movie) or movie)
+        response = client.post('/similar/batch', data=json.dumps({'seeds': ['inception', 5, 'Nope'], 'top': 5}),
+                               content_type='application/json')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        batch_enriched = [m['movie_id'] for m in enriched]
+        assert data['not_found'] == ['Nope']
+        assert [s['movie_title'] for s in data['seeds']] == ['Inception', 'V for Vendetta']
+
+        for seed in data['seeds']:
+            # the other seeds are left out of every seed's list
+            single = json.loads(client.get(f"/similar?title={seed['movie_title']}&top=5").data)
+            assert [(r['movie_title'], r['score']) for r in seed['recommendations']] == \
+                [(r['movie_title'], r['score']) for r in single['recommendations']
+                 if r['movie_title'] not in ('Inception', 'V for Vendetta')]
+
+        merged = data['recommendations']
+        # merged scores are summed across seeds
+        assert {'Inception', 'V for Vendetta'}.isdisjoint(r['movie_title'] for r in merged)
+        assert merged[0]['movie_title'] == 'The Dark Knight'
+        assert merged[0]['score'] == sum(merged[0]['seed_scores'].values())
+        # every movie returned by the batch call was enriched exactly once
+        returned = {r['movie_id'] for s in data['seeds'] for r in s['recommendations']} | {r['movie_id'] for r in merged}
+        assert sorted(batch_enriched) == sorted(returned)
+
+    def test_similar_batch_resolves_seeds_like_similar(self, client):
+        """Test batch seeds are found by normalized title, then partial match, as /similar finds them."""
+        with app.app_context():
+            db = get_db()
+            # the bundled CSV has titles whose movie_title_lower ends in a no-break space
+            db.execute("UPDATE movies_flat SET movie_title_lower = 'inception\u00a0' WHERE movie_title = 'Inception'")
+            db.commit()
+        response = client.post('/similar/batch', data=json.dumps({'seeds': ['Inception', 'shawshank'], 'top': 5}),
+                               content_type='application/json')
+        data = json.loads(response.data)
+        assert data['not_found'] == []
+        assert [s['movie_title'] for s in data['seeds']] == ['Inception', 'The Shawshank Redemption']
+
+    def test_similar_batch_reads_candidates_in_one_query(self, client, monkeypatch):
+        """Test batch seeds are resolved in one query and their candidates read in another."""
+        import database
+        import server as server_module
+        monkeypatch.setattr(server_module, 'enrich_movie_info', lambda movie: movie)
+        payload = json.dumps({'seeds': ['Inception', 'The Dark Knight', 3], 'top': 5})
+        client.post('/similar/batch', data=payload, content_type='application/json')  # loads the caches
+        conn = database.connection(server_module.DATABASE, readonly=True)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            response = client.post('/similar/batch', data=payload, content_type='application/json')
+        finally:
+            conn.set_trace_callback(None)
+        assert len(json.loads(response.data)['seeds']) == 3
+        assert len([sql for sql in statements if 'FROM movies_flat WHERE' in sql]) == 2
+
+    def test_similar_batch_rejects_bad_seeds(self, client):
+        """Test batch similar input validation."""
+        assert client.post('/similar/batch', data=json.dumps({'seeds': []}),
+                           content_type='application/json').status_code == 400
+        assert client.post('/similar/batch', data=json.dumps({'seeds': ['Nope']}),
+                           content_type='application/json').status_code == 404
+
     def test_movie_details_endpoint(self, client):
         """Test movie details endpoint."""
         response = client.get('/movie?title=inception')
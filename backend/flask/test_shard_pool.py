@@ -0,0 +1,101 @@
+"""
+Tests for scatter-gather scoring across shard worker processes (shard_pool.py).
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import server
+from bench_data import create_catalog_db
+from catalog import ensure_catalog_state, get_catalog_version
+from features import PreferenceProfile, load_feature_cache, rank_by_preference
+from shard_pool import ShardPool
+
+
+@pytest.fixture
+def catalog():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    conn = create_catalog_db(path, 600, seed=5)
+    conn.row_factory = sqlite3.Row
+    ensure_catalog_state(conn.cursor())
+    conn.commit()
+    pool = ShardPool(path, 3)
+    yield path, conn, pool
+    pool.close()
+    conn.close()
+    os.unlink(path)
+
+
+def reference(conn, profile, top_n, exclude_rowids=(), exclude_titles=(), bonus=None):
+    movies = load_feature_cache(conn).movies
+    return rank_by_preference(
+        movies, profile, top_n,
+        skip=lambda m: str(m.rowid) in exclude_rowids or m.title_key in exclude_titles, bonus=bonus
+    )
+
+
+def ranking(top):
+    return [(s, m.rowid) for s, m in top]
+
+
+class TestShardPool:
+
+    def test_merged_top_matches_full_scan(self, catalog):
+        path, conn, pool = catalog
+        movies = load_feature_cache(conn).movies
+        version = get_catalog_version(conn)
+        for i, m in enumerate(movies[:50:5]):
+            profile = PreferenceProfile({'directors': [m.director], 'actors': sorted(m.actors)[:2],
+                                         'genres': sorted(m.genres)})
+            excluded = {str(m.rowid), str(movies[i + 1].rowid)}
+            titles = {movies[i + 2].title_key}
+            bonus = {movies[i + 100].rowid: 3.0}
+            for maxscore in (False, True):
+                got = pool.top(profile, 10, version, excluded, titles, bonus, maxscore=maxscore)
+                assert ranking(got) == ranking(reference(conn, profile, 10, excluded, titles, bonus))
+
+    def test_workers_pick_up_catalog_changes(self, catalog):
+        path, conn, pool = catalog
+        profile = PreferenceProfile({'directors': ['Shard Test Director']})
+        assert pool.top(profile, 5, get_catalog_version(conn)) == []
+
+        conn.execute("INSERT INTO movies_flat (movie_title, director_name) VALUES ('Appended', 'Shard Test Director')")
+        conn.commit()
+        assert [m.title for _, m in pool.top(profile, 5, get_catalog_version(conn))] == ['Appended']
+
+        conn.execute("UPDATE movies_flat SET movie_title = 'Renamed' WHERE movie_title = 'Appended'")
+        conn.commit()
+        assert [m.title for _, m in pool.top(profile, 5, get_catalog_version(conn))] == ['Renamed']
+
+
+class TestServerUsesShards:
+
+    def test_recommend_user_scatters_to_shards(self, catalog, monkeypatch):
+        path, conn, pool = catalog
+        monkeypatch.setattr(server, 'DATABASE', path)
+        monkeypatch.setattr(server, 'SCORING_SHARDS', 3)
+        monkeypatch.setattr(server, 'SHARD_MIN_CATALOG_SIZE', 0)
+        monkeypatch.setattr(server, 'get_shard_pool', lambda db_path, n: pool)
+        # the in-process scorers are only the fallback
+        monkeypatch.setattr(server, 'use_feature_cache', lambda db: pytest.fail('scored in process'))
+        with server.app.app_context():
+            server.init_db_schema()
+        m = load_feature_cache(conn).movies[3]
+        prefs = {'movies': [m.title], 'directors': [m.director], 'actors': [], 'genres': sorted(m.genres)}
+        conn.execute('INSERT INTO users_preferences (user_id, preferences_json) VALUES (?, ?)',
+                     ('shard-user', json.dumps(prefs)))
+        conn.commit()
+        resp = server.app.test_client().post('/recommend/user', data=json.dumps({'user_id': 'shard-user'}),
+                                             content_type='application/json')
+        got = json.loads(resp.data)['recommendations']
+        profile = PreferenceProfile(prefs)
+        expected = reference(conn, profile, 10, exclude_titles=profile.movies)
+        assert got == [x.title for _, x in expected]
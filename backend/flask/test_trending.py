@@ -0,0 +1,145 @@
+"""
+Tests for the event-fed popularity / trending counters (trending.py).
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import server
+import trending
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+
+TITLES = ['Inception', 'The Dark Knight', 'Heat', 'Amelie']
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        for title in TITLES:
+            db.execute('INSERT INTO movies_flat (movie_title, movie_title_lower, genres) VALUES (?, ?, ?)',
+                       (title, title.lower(), 'Drama'))
+        for user_id in ('bob', 'newbie'):
+            db.execute('INSERT INTO users_basic (user_id) VALUES (?)', (user_id,))
+        db.commit()
+
+    yield app.test_client()
+
+    server.get_trending_consumer().stop()
+    server.get_profile_store().close()
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def post(client, url, payload):
+    return client.post(url, data=json.dumps(payload), content_type='application/json')
+
+
+def rowid(title):
+    return TITLES.index(title) + 1
+
+
+def generate_activity(client):
+    post(client, '/user/favorites', {'user_id': 'bob', 'movie': 'Heat'})                   # 4
+    post(client, f"/movies/{rowid('Amelie')}/feedback", {'user_id': 'bob', 'rating': 5})    # 2
+    list_id = json.loads(post(client, '/users/bob/watchlists', {}).data)['list_id']
+    post(client, f'/watchlists/{list_id}/movies', {'user_id': 'bob', 'movie_id': rowid('Amelie')})  # 3
+    client.get('/similar?title=Inception&top=2')                                            # 1
+    server.get_trending_consumer().drain()
+
+
+class TestCounters:
+
+    def test_window_ring_buffer_expires_buckets(self):
+        counter = trending.WindowCounter(3600, 60)
+        counter.add(1, 1.0, at=0)
+        counter.add(1, 2.0, at=1800)
+        counter.add(2, 1.0, at=1800)
+        counter.advance(3599)
+        assert counter.totals == {1: 3.0, 2: 1.0}
+        counter.advance(3600)  # the bucket starting at t=0 has left the window
+        assert counter.totals == {1: 2.0, 2: 1.0}
+        counter.add(3, 1.0, at=5400)  # reuses the slot of t=1800
+        counter.advance(5400)
+        assert counter.totals == {3: 1.0}
+
+    def test_decayed_score_halves_per_half_life(self):
+        t = trending.Trending(half_life_hours=1, now=0)
+        t.add(1, 4.0, at=0)
+        t.add(2, 4.0, at=3600)
+        assert t.decayed_score(1, 3600) == pytest.approx(2.0)
+        t.refresh(now=3600)
+        assert t.top(trending.DECAYED, 2) == [(2, pytest.approx(4.0)), (1, pytest.approx(2.0))]
+        # far-future hits rebase the reference time without changing scores
+        t.add(3, 1.0, at=3600 * 100)
+        assert t.decayed_score(2, 3600 * 100) == pytest.approx(4.0 * 2.0 ** -99)
+
+    def test_checkpoint_round_trip(self):
+        conn = sqlite3.connect(':memory:')
+        trending.ensure_trending_schema(conn.cursor())
+        t = trending.Trending(now=0)
+        t.add(1, 1.0, at=100)
+        t.add(2, 3.0, at=200)
+        t.add(2, 1.0, at=4000)
+        t.checkpoint(conn, now=4000)
+
+        restored = trending.Trending(now=0)
+        restored.restore(conn, now=4000)
+        assert restored.top('24h', 5) == [(2, 4.0), (1, 1.0)]
+        assert restored.top('1h', 5) == [(2, 1.0)]
+        assert restored.decayed_score(2, 4000) == pytest.approx(t.decayed_score(2, 4000))
+
+
+class TestTrendingEndpoint:
+
+    def test_events_feed_trending(self, client):
+        generate_activity(client)
+        data = json.loads(client.get('/movies/trending?window=1h').data)
+        assert [(m['movie_title'], m['trending_score']) for m in data['movies']] == \
+            [('Amelie', 5.0), ('Heat', 4.0), ('Inception', 1.0)]
+
+    def test_unknown_window_rejected(self, client):
+        assert client.get('/movies/trending?window=1y').status_code == 400
+
+    def test_counters_survive_restart(self, client):
+        generate_activity(client)
+        consumer = server.get_trending_consumer()
+        consumer.stop()  # checkpoints on the way out
+        restarted = trending.TrendingConsumer(server.DATABASE).start()
+        try:
+            assert [k for k, _ in restarted.trending.top('7d', 5)] == [rowid('Amelie'), rowid('Heat'),
+                                                                       rowid('Inception')]
+        finally:
+            restarted.stop()
+
+
+class TestColdStart:
+
+    def test_recommendations_fall_back_to_trending(self, client):
+        generate_activity(client)
+        data = json.loads(client.get('/recommendations/newbie').data)
+        assert [m['movie_title'] for m in data['recommendations']] == ['Amelie', 'Heat', 'Inception']
+
+    def test_recommend_user_without_preferences(self, client):
+        assert post(client, '/recommend/user', {'user_id': 'newbie'}).status_code == 404
+        generate_activity(client)
+        data = json.loads(post(client, '/recommend/user', {'user_id': 'newbie'}).data)
+        assert data['fallback'] == 'trending'
+        assert data['recommendations'] == ['Amelie', 'Heat', 'Inception']
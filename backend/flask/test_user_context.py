@@ -0,0 +1,117 @@
+"""
+Tests for the request-scoped user lookups and the preferences cache (user_context.py).
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import server
+from rec_cache import RecommendationCache
+from server import app, get_db, init_db_schema
+from user_context import PreferencesCache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app.config['TESTING'] = True
+    original_db = server.DATABASE
+    server.DATABASE = db_path
+    monkeypatch.setattr(server, 'enrich_movie_info', lambda movie: movie)
+    monkeypatch.setattr(server, 'rec_cache', RecommendationCache())
+
+    with app.app_context():
+        init_db_schema()
+        db = get_db()
+        db.execute("INSERT INTO users_basic (user_id, display_name) VALUES ('u1', 'Ann')")
+        db.execute('INSERT INTO users_preferences (user_id, preferences_json) VALUES (?, ?)',
+                   ('u1', json.dumps({'genres': ['Crime'], 'favorites': ['Heat']})))
+        db.commit()
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+    server.DATABASE = original_db
+
+
+def statements_run(fn):
+    """(result of fn(), SQL statements it ran), inside one request context."""
+    with app.test_request_context():
+        db = get_db()
+        statements = []
+        db.set_trace_callback(statements.append)
+        try:
+            return fn(), statements
+        finally:
+            db.set_trace_callback(None)
+
+
+class TestUserContext:
+
+    def test_helpers_share_one_query_per_request(self, client):
+        result, statements = statements_run(lambda: (
+            server.get_user_basic('u1')['display_name'],
+            server.get_user_preferences('u1')['genres'],
+            server.get_user_favorites_set('u1'),
+            server.get_user_basic('u1') is not None,
+        ))
+        assert result == ('Ann', ['Crime'], {'heat'}, True)
+        assert len(statements) == 1
+
+    def test_preferences_are_cached_until_written(self, client):
+        statements_run(lambda: server.get_user_preferences('u1'))
+
+        def modify():
+            prefs = server.get_user_preferences('u1')
+            prefs['genres'].append('Drama')  # callers get their own copy
+            return server.get_user_preferences('u1')['genres']
+        assert statements_run(modify) == (['Crime'], [])
+
+        client.post('/user/preferences', data=json.dumps({'user_id': 'u1', 'preferences': {'genres': ['Western']}}),
+                    content_type='application/json')
+        assert json.loads(client.get('/user/preferences/u1').data)['preferences']['genres'] == ['Western']
+
+    def test_favorite_is_added_to_the_stored_preferences(self, client):
+        assert json.loads(client.get('/user/preferences/u1').data)['preferences']['genres'] == ['Crime']
+        # another worker saves new preferences; this process still has the old ones cached
+        conn = sqlite3.connect(server.DATABASE)
+        conn.execute('UPDATE users_preferences SET preferences_json = ? WHERE user_id = ?',
+                     (json.dumps({'genres': ['Western'], 'favorites': ['Heat']}), 'u1'))
+        conn.commit()
+        conn.close()
+
+        client.post('/user/favorites', data=json.dumps({'user_id': 'u1', 'movie': 'Ronin'}),
+                    content_type='application/json')
+        prefs = json.loads(client.get('/user/preferences/u1').data)['preferences']
+        assert prefs['genres'] == ['Western']
+        assert prefs['favorites'] == ['Heat', 'Ronin']
+
+    def test_unknown_user(self, client):
+        result, statements = statements_run(lambda: (server.get_user_basic('nobody'), server.get_user_preferences('nobody')))
+        assert result == (None, {})
+        assert len([s for s in statements if 'users_basic' in s]) == 1
+
+
+class TestPreferencesCache:
+
+    def test_entries_expire_and_stale_puts_are_dropped(self):
+        cache = PreferencesCache(':memory:', ttl=0.05)
+        generation = cache.generation()
+        cache.put('u1', {'genres': ['Crime']}, generation)
+        assert cache.get('u1') == {'genres': ['Crime']}
+        time.sleep(0.06)
+        assert cache.get('u1') is None
+
+        generation = cache.generation()
+        cache.invalidate('u2')  # a write while u1 was being read
+        cache.put('u1', {'genres': ['Crime']}, generation)
+        assert cache.get('u1') is None
@@ -0,0 +1,315 @@
+# trending.py - popularity and trending counters fed by the event stream
+#
+# publish_event() (server.py) hands every event to a TrendingConsumer, either
+# through a local queue or, with TRENDING_SOURCE=kafka, by reading the
+# nextflix-events topic.  A single consumer thread turns the events that name
+# a movie into weighted hits and keeps, in memory:
+#
+#   windows   one ring buffer of time buckets per window (1h of minutes, 24h
+#             and 7d of hours) plus a running total per movie; adding a hit
+#             or expiring a bucket is O(1) per movie touched
+#   decayed   an exponentially decayed score per movie (TRENDING_HALF_LIFE_HOURS),
+#             stored relative to a reference time so that ordering never
+#             needs the clock
+#
+# The top lists are re-ranked by the consumer every `refresh_every` seconds,
+# so /movies/trending only reads a prepared list.  The counters are
+# checkpointed to SQLite every `checkpoint_every` seconds and restored on
+# start, dropping buckets that expired in between.
+import heapq
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from catalog import MOVIES_TABLE
+
+logger = logging.getLogger(__name__)
+
+# event type -> weight of one hit on the movie it names
+EVENT_WEIGHTS = {
+    'similar_movies_requested': 1.0,
+    'search_performed': 0.5,
+    'movie_seen': 1.0,
+    'feedback_created': 2.0,
+    'watchlist_movie_added': 3.0,
+    'favorite_added': 4.0,
+}
+# window name -> (span seconds, number of ring-buffer buckets)
+WINDOWS = {
+    '1h': (3600, 60),
+    '24h': (86400, 24),
+    '7d': (7 * 86400, 7 * 24),
+}
+DECAYED = 'decayed'
+HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 24))
+# movies kept in each prepared top list
+TOP_SIZE = 200
+
+
+def ensure_trending_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS trending_buckets (
+            window_name TEXT,
+            epoch INTEGER,
+            movie_rowid INTEGER,
+            hits REAL,
+            PRIMARY KEY (window_name, epoch, movie_rowid)
+        ) WITHOUT ROWID
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS trending_decayed (
+            movie_rowid INTEGER PRIMARY KEY,
+            score REAL,
+            as_of REAL
+        )
+    ''')
+
+
+class WindowCounter:
+    """Hits per movie over the last `span` seconds, in `n` ring-buffer buckets."""
+    __slots__ = ('span', 'n', 'width', 'epochs', 'buckets', 'totals')
+
+    def __init__(self, span, n):
+        self.span, self.n, self.width = span, n, span / n
+        self.epochs = [None] * n
+        self.buckets = [{} for _ in range(n)]
+        self.totals = {}
+
+    def _expire(self, slot):
+        totals = self.totals
+        for key, hits in self.buckets[slot].items():
+            left = totals[key] - hits
+            if left > 1e-9:
+                totals[key] = left
+            else:
+                del totals[key]
+        self.buckets[slot] = {}
+        self.epochs[slot] = None
+
+    def advance(self, now):
+        """Drop every bucket that has fallen out of the window."""
+        oldest = int(now // self.width) - self.n + 1
+        for slot, epoch in enumerate(self.epochs):
+            if epoch is not None and epoch < oldest:
+                self._expire(slot)
+
+    def add(self, key, hits, at):
+        epoch = int(at // self.width)
+        slot = epoch % self.n
+        if self.epochs[slot] != epoch:
+            if self.epochs[slot] is not None and self.epochs[slot] > epoch:
+                return  # older than the window
+            self._expire(slot)
+            self.epochs[slot] = epoch
+        bucket = self.buckets[slot]
+        bucket[key] = bucket.get(key, 0.0) + hits
+        self.totals[key] = self.totals.get(key, 0.0) + hits
+
+
+class Trending:
+    """In-memory counters for every window plus the decayed score."""
+
+    def __init__(self, windows=None, half_life_hours=HALF_LIFE_HOURS, now=None):
+        self.windows = {name: WindowCounter(span, n) for name, (span, n) in (windows or WINDOWS).items()}
+        self.half_life = half_life_hours * 3600.0
+        # decayed[key] is the score as of self.ref; it is never decayed in place
+        self.ref = time.time() if now is None else now
+        self.decayed = {}
+        self.tops = {}
+        # the consumer thread adds while refresh() may run from another thread
+        self.lock = threading.Lock()
+
+    def add(self, key, hits, at):
+        with self.lock:
+            self._add(key, hits, at)
+
+    def _add(self, key, hits, at):
+        for counter in self.windows.values():
+            counter.add(key, hits, at)
+        exponent = (at - self.ref) / self.half_life
+        if exponent > 64:
+            self._rebase(at)
+            exponent = 0.0
+        self.decayed[key] = self.decayed.get(key, 0.0) + hits * 2.0 ** exponent
+
+    def _rebase(self, now):
+        factor = 2.0 ** (-(now - self.ref) / self.half_life)
+        self.decayed = {k: v * factor for k, v in self.decayed.items() if v * factor > 1e-6}
+        self.ref = now
+
+    def decayed_score(self, key, now):
+        return self.decayed.get(key, 0.0) * 2.0 ** (-(now - self.ref) / self.half_life)
+
+    def refresh(self, now=None, size=TOP_SIZE):
+        """Expire old buckets and re-rank the top lists served by top()."""
+        now = time.time() if now is None else now
+        tops = {}
+        with self.lock:
+            for name, counter in self.windows.items():
+                counter.advance(now)
+                tops[name] = heapq.nlargest(size, counter.totals.items(), key=lambda x: (x[1], -x[0]))
+            factor = 2.0 ** (-(now - self.ref) / self.half_life)
+            tops[DECAYED] = [(k, v * factor) for k, v in
+                             heapq.nlargest(size, self.decayed.items(), key=lambda x: (x[1], -x[0]))]
+        self.tops = tops
+
+    def top(self, window, n):
+        """[(movie_rowid, score)] from the last refresh(); O(n)."""
+        return self.tops.get(window, [])[:n]
+
+    def checkpoint(self, conn, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            rows = [(name, epoch, key, hits)
+                    for name, counter in self.windows.items()
+                    for epoch, bucket in zip(counter.epochs, counter.buckets) if epoch is not None
+                    for key, hits in bucket.items()]
+            decayed = [(k, self.decayed_score(k, now), now) for k in self.decayed]
+        with conn:
+            conn.execute('DELETE FROM trending_buckets')
+            conn.executemany('INSERT INTO trending_buckets (window_name, epoch, movie_rowid, hits) VALUES (?, ?, ?, ?)',
+                             rows)
+            conn.execute('DELETE FROM trending_decayed')
+            conn.executemany('INSERT INTO trending_decayed (movie_rowid, score, as_of) VALUES (?, ?, ?)', decayed)
+
+    def restore(self, conn, now=None):
+        now = time.time() if now is None else now
+        rows = conn.execute('SELECT window_name, epoch, movie_rowid, hits FROM trending_buckets')
+        for name, epoch, key, hits in rows:
+            counter = self.windows.get(name)
+            if counter is not None:
+                counter.add(key, hits, epoch * counter.width)  # restore runs before the consumer starts
+        for counter in self.windows.values():
+            counter.advance(now)
+        self.ref = now
+        self.decayed = {k: score * 2.0 ** (-(now - as_of) / self.half_life)
+                        for k, score, as_of in conn.execute('SELECT movie_rowid, score, as_of FROM trending_decayed')}
+        self.refresh(now)
+
+
+def event_movie(event):
+    """(movie_id or None, title or None) named by an event payload."""
+    payload = event.get('payload') or {}
+    movie_id = payload.get('movie_id')
+    title = payload.get('movie') or payload.get('target_title') or payload.get('title')
+    return movie_id, title if isinstance(title, str) else None
+
+
+class TrendingConsumer:
+    """Feeds events into a Trending on a background thread."""
+
+    def __init__(self, db_path, refresh_every=5.0, checkpoint_every=60.0, trending=None):
+        self.db_path = db_path
+        self.refresh_every, self.checkpoint_every = refresh_every, checkpoint_every
+        self.trending = trending or Trending()
+        self.queue = queue.Queue()
+        self._titles = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            ensure_trending_schema(conn.cursor())
+            self.trending.restore(conn)
+        except sqlite3.Error as e:
+            logger.warning("Trending checkpoint not restored: %s", e)
+        finally:
+            conn.close()
+        self._thread = threading.Thread(target=self._run, name='trending-consumer', daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, event):
+        if EVENT_WEIGHTS.get(event.get('type')):
+            self.queue.put(event)
+
+    def drain(self):
+        """Block until every submitted event is counted, then re-rank."""
+        self.queue.join()
+        self.trending.refresh()
+
+    def stop(self):
+        self._stop.set()
+        self.queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def resolve(self, conn, event):
+        movie_id, title = event_movie(event)
+        if movie_id is not None:
+            try:
+                return int(movie_id)
+            except (TypeError, ValueError):
+                return None
+        if not title:
+            return None
+        key = title.strip().lower()
+        if key not in self._titles:
+            if len(self._titles) > 100000:
+                self._titles.clear()
+            row = conn.execute(f'SELECT rowid FROM {MOVIES_TABLE} WHERE movie_title_lower = ? LIMIT 1',
+                               (key,)).fetchone()
+            self._titles[key] = row[0] if row else None
+        return self._titles[key]
+
+    def handle(self, conn, event):
+        rowid = self.resolve(conn, event)
+        if rowid is not None:
+            self.trending.add(rowid, EVENT_WEIGHTS[event['type']], event.get('timestamp') or time.time())
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        last_refresh = last_checkpoint = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                event = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                event = None
+            else:
+                try:
+                    if event is not None:
+                        self.handle(conn, event)
+                except Exception as e:
+                    logger.error("Trending consumer failed on %s: %s", event.get('type'), e)
+                finally:
+                    self.queue.task_done()
+            tick = time.monotonic()
+            if tick - last_refresh >= self.refresh_every:
+                self.trending.refresh()
+                last_refresh = tick
+            if tick - last_checkpoint >= self.checkpoint_every:
+                try:
+                    self.trending.checkpoint(conn)
+                except sqlite3.Error as e:
+                    logger.error("Trending checkpoint failed: %s", e)
+                last_checkpoint = tick
+        try:
+            self.trending.checkpoint(conn)
+        except sqlite3.Error as e:
+            logger.error("Trending checkpoint failed: %s", e)
+        conn.close()
+
+
+def consume_kafka(consumer, bootstrap):
+    """Feed `consumer` from the nextflix-events topic (one consumer group per process)."""
+    from kafka import KafkaConsumer
+
+    def run():
+        kafka = KafkaConsumer(
+            'nextflix-events',
+            bootstrap_servers=[h.strip() for h in bootstrap.split(',')],
+            group_id=f'nextflix-trending-{os.getpid()}',
+            auto_offset_reset='latest',
+            value_deserializer=lambda v: json.loads(v.decode('utf-8')),
+        )
+        for message in kafka:
+            consumer.submit(message.value)
+
+    thread = threading.Thread(target=run, name='trending-kafka', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,150 @@
+# user_context.py - per-request user lookups and a short-lived preferences cache
+#
+# Handlers used to query users_basic and users_preferences separately, often
+# more than once per request (get_user_basic, then get_user_preferences, then
+# get_user_favorites_set re-reading and re-parsing the same JSON).
+# UserContext loads a user's users_basic row and preferences blob with one
+# query, the first time either is needed; the watchlist and seen sets are
+# loaded on first use.  server.get_user_context() keeps one per user for the
+# duration of a request.
+#
+# Parsed preferences are also kept across requests by PreferencesCache for
+# `ttl` seconds.  Writes in this process invalidate the entry at once; other
+# workers see the change when their entry expires.  The cache is for reads
+# only: a handler that changes part of the preferences and writes them back
+# (add_favorite) reads users_preferences itself, under the write lock.
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# users_basic row and preferences blob in one query; b.user_id is NULL when
+# there is no users_basic row
+LOAD_SQL = '''
+    SELECT p.preferences_json AS _preferences_json, b.*
+    FROM (SELECT ? AS user_id) AS u
+    LEFT JOIN users_basic b ON b.user_id = u.user_id
+    LEFT JOIN users_preferences p ON p.user_id = u.user_id
+'''
+
+
+def parse_preferences(preferences_json):
+    if not preferences_json:
+        return {}
+    try:
+        prefs = json.loads(preferences_json)
+    except ValueError:
+        return {}
+    return prefs if isinstance(prefs, dict) else {}
+
+
+def copy_preferences(prefs):
+    """A copy the caller may modify: a new dict with new lists."""
+    return {k: list(v) if isinstance(v, list) else v for k, v in prefs.items()}
+
+
+class PreferencesCache:
+    """Thread-safe LRU of user_id -> parsed preferences, each kept for `ttl` seconds."""
+
+    def __init__(self, db_path, ttl=5.0, max_users=10000):
+        self.db_path = db_path
+        self.ttl, self.max_users = ttl, max_users
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        """Pass to put(); a put is dropped if anything was invalidated in between."""
+        return self._generation
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, prefs, generation):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            # a write since the value was read: it may be stale already
+            if generation != self._generation:
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, prefs)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """Forget `user_id`'s entry, or every entry when None."""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+class UserContext:
+    """One user's lookups, each made at most once.
+
+    `basic` (the users_basic row as a dict, None if absent) and `prefs` (the
+    parsed preferences, {} if absent) are shared: callers must not modify
+    them.
+    """
+    __slots__ = ('db', 'user_id', 'prefs_cache', '_loaded', '_basic', '_prefs', '_watchlist', '_seen')
+
+    def __init__(self, db, user_id, prefs_cache=None):
+        self.db, self.user_id, self.prefs_cache = db, user_id, prefs_cache
+        self._loaded = False
+        self._basic = self._prefs = self._watchlist = self._seen = None
+
+    def _load(self):
+        generation = self.prefs_cache.generation() if self.prefs_cache is not None else None
+        cur = self.db.execute(LOAD_SQL, (self.user_id,))
+        row = dict(zip([d[0] for d in cur.description], cur.fetchone()))
+        preferences_json = row.pop('_preferences_json')
+        self._basic = row if row.get('user_id') is not None else None
+        if self._prefs is None:
+            self._prefs = parse_preferences(preferences_json)
+            if self.prefs_cache is not None:
+                self.prefs_cache.put(self.user_id, self._prefs, generation)
+        self._loaded = True
+
+    @property
+    def basic(self):
+        if not self._loaded:
+            self._load()
+        return self._basic
+
+    @property
+    def prefs(self):
+        if self._prefs is None and self.prefs_cache is not None:
+            self._prefs = self.prefs_cache.get(self.user_id)
+        if self._prefs is None:
+            self._load()
+        return self._prefs
+
+    def watchlist_set(self):
+        """Movie rowids (as str) on the user's watchlists."""
+        if self._watchlist is None:
+            self._watchlist = {str(r[0]) for r in self.db.execute(
+                'SELECT movie_rowid FROM user_watchlist_map m JOIN users_watchlist w ON m.list_id = w.list_id '
+                'WHERE w.user_id = ?', (self.user_id,))}
+        return self._watchlist
+
+    def seen_set(self):
+        """Movie rowids (as str) the user has rated."""
+        if self._seen is None:
+            self._seen = {str(r[0]) for r in self.db.execute(
+                'SELECT movie_rowid FROM users_feedback WHERE user_id = ? AND rating IS NOT NULL', (self.user_id,))}
+        return self._seen
+
+    def favorites_set(self):
+        """Normalized titles under the 'favorites' key of the preferences."""
+        return {f.strip().lower() for f in (self.prefs.get('favorites') or []) if f}
@@ -0,0 +1,250 @@
+# vector_scorer.py - vectorized preference scoring for the user recommenders
+#
+# The catalog is held as a sparse movie x feature incidence matrix in
+# compressed-column form: one column per distinct (kind, token) where kind is
+# title / director / actor / genre, and each column lists the movie positions
+# that carry it.  A user's preferences become a sparse weight vector over the
+# same columns (title 6, director 5, actor token 3, genre token 1), so scoring
+# the whole catalog is one sparse mat-vec that only touches the columns the
+# user actually prefers.  Excluded movies are masked out and the top N is
+# taken with argpartition; ties at the cut-off are kept and ordered by title,
+# so results are identical to features.preference_score + sorted() (up to
+# float rounding once learned affinity weights are summed in).
+#
+# top_maxscore() is the max-score variant: instead of scoring every movie it
+# walks the posting lists (matrix columns) of the heaviest features first and
+# stops admitting new movies once the weights still to come cannot lift an
+# unseen movie to the current N-th score; the remaining lists are only probed
+# for the movies already admitted.  Same results as top().
+#
+# Built from the FeatureCache (features.py), so tokenization is shared with
+# /similar and never repeated here.
+import threading
+
+import numpy as np
+
+from features import PREFERENCE_WEIGHTS, get_feature_cache, movie_keys
+
+
+class VectorScorer:
+    """Incidence matrix over a list of MovieFeatures in rowid order.
+
+    `base` is an older scorer whose movies are a prefix of `movies` (catalog
+    appends); its vocabulary and entries are reused and only the new movies
+    are walked.
+    """
+
+    def __init__(self, movies, base=None):
+        self.movies = movies
+        if base is not None:
+            self.vocab = dict(base.vocab)
+            rows, cols = list(base._rows), list(base._cols)
+            start = len(base.movies)
+        else:
+            self.vocab, rows, cols, start = {}, [], [], 0
+        vocab = self.vocab
+        for pos in range(start, len(movies)):
+            for key in movie_keys(movies[pos]):
+                col = vocab.get(key)
+                if col is None:
+                    col = vocab[key] = len(vocab)
+                rows.append(pos)
+                cols.append(col)
+        self._rows, self._cols = rows, cols
+
+        n = len(movies)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        self.row_idx = rows[np.argsort(cols, kind='stable')]
+        self.col_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols, minlength=len(vocab)), out=self.col_ptr[1:])
+        self.rowids = np.fromiter((m.rowid for m in movies), dtype=np.int64, count=n)
+        self.title_col = np.fromiter((vocab['title', m.title_key] for m in movies), dtype=np.int64, count=n)
+        # rank of each movie in (title or '') order; stable, so equal titles keep rowid order
+        self.title_rank = np.empty(n, dtype=np.int64)
+        self.title_rank[sorted(range(n), key=lambda i: movies[i].title or '')] = np.arange(n, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.movies)
+
+    def weight_vector(self, profile):
+        """Sparse (columns, weights) for a features.PreferenceProfile."""
+        cols, weights = [], []
+        for kind, keys in (('title', profile.movies), ('director', profile.directors),
+                           ('actor', profile.actors), ('genre', profile.genres)):
+            for key in keys:
+                col = self.vocab.get((kind, key))
+                if col is not None:
+                    cols.append(col)
+                    weights.append(PREFERENCE_WEIGHTS[kind])
+        # learned affinity weights (affinity.py) are extra entries of the same vector
+        for key, weight in profile.affinity.items():
+            col = self.vocab.get(key)
+            if col is not None and weight:
+                cols.append(col)
+                weights.append(weight)
+        return cols, weights
+
+    def scores(self, profile):
+        """Score every movie: incidence matrix times the preference weight vector."""
+        out = np.zeros(len(self.movies), dtype=np.float64)
+        for col, w in zip(*self.weight_vector(profile)):
+            # a column lists each movie at most once, so fancy-index += is safe
+            out[self.row_idx[self.col_ptr[col]:self.col_ptr[col + 1]]] += w
+        return out
+
+    def positions_for_rowids(self, rowids):
+        """Positions of the given rowids (str or int, as the DB helpers return them)."""
+        ids = []
+        for r in rowids:
+            try:
+                ids.append(int(r))
+            except (TypeError, ValueError):
+                continue
+        if not ids or not len(self.rowids):
+            return np.empty(0, dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.rowids, ids), len(self.rowids) - 1)
+        return pos[self.rowids[pos] == ids]
+
+    def bonus_vector(self, bonus):
+        """({rowid: score}) -> (positions, scores) for the rowids in the catalog."""
+        if not bonus or not len(self.rowids):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        ids = np.fromiter(bonus.keys(), dtype=np.int64, count=len(bonus))
+        vals = np.fromiter(bonus.values(), dtype=np.float64, count=len(bonus))
+        pos = np.minimum(np.searchsorted(self.rowids, ids), len(self.rowids) - 1)
+        found = self.rowids[pos] == ids
+        return pos[found], vals[found]
+
+    def positions_for_titles(self, title_keys):
+        cols = [self.vocab[k] for k in (('title', t) for t in title_keys) if k in self.vocab]
+        if not cols:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(np.isin(self.title_col, cols))
+
+    def top(self, profile, top_n, exclude=None, bonus=None):
+        """Top `top_n` (score, MovieFeatures) with score > 0, ordered (-score, title).
+
+        `exclude` is an array of positions (positions_for_rowids/_titles);
+        `bonus` is a (positions, scores) pair from bonus_vector, added to the
+        preference scores.
+        """
+        scores = self.scores(profile)
+        if bonus is not None and len(bonus[0]):
+            scores[bonus[0]] += bonus[1]
+        if exclude is not None and len(exclude):
+            scores[exclude] = 0.0
+        return self._select(np.flatnonzero(scores > 0), scores, top_n)
+
+    def _select(self, cand, scores, top_n):
+        """Order candidate positions with score > 0 by (-score, title) and keep `top_n`."""
+        cand = cand[scores[cand] > 0]
+        if top_n <= 0 or not len(cand):
+            return []
+        if len(cand) > top_n:
+            cand_scores = scores[cand]
+            kth = cand_scores[np.argpartition(-cand_scores, top_n - 1)[top_n - 1]]
+            # keep every tie with the N-th score so the title tie-break decides
+            cand = cand[cand_scores >= kth]
+        order = np.lexsort((self.title_rank[cand], -scores[cand]))[:top_n]
+        return [(float(scores[p]), self.movies[p]) for p in cand[order]]
+
+    def _terms(self, profile, bonus):
+        """[(low, high, positions, weights)] - one posting list per feature, plus the bonus.
+
+        `low`/`high` bound what the list can add to one movie's score.
+        """
+        merged = {}
+        for col, w in zip(*self.weight_vector(profile)):
+            merged[col] = merged.get(col, 0.0) + w
+        terms = [(min(w, 0.0), max(w, 0.0), self.row_idx[self.col_ptr[col]:self.col_ptr[col + 1]], w)
+                 for col, w in merged.items() if w]
+        if bonus is not None and len(bonus[0]):
+            order = np.argsort(bonus[0], kind='stable')
+            vals = bonus[1][order]
+            terms.append((min(float(vals.min()), 0.0), max(float(vals.max()), 0.0), bonus[0][order], vals))
+        return terms
+
+    def top_maxscore(self, profile, top_n, exclude=None, bonus=None, stats=None):
+        """top() by max-score early termination over the feature posting lists.
+
+        `stats`, if given, is a dict that receives 'postings' (entries a full
+        scan reads), 'visited' (entries and probes actually touched) and
+        'candidates' (movies admitted).
+        """
+        terms = self._terms(profile, bonus)
+        positive = sorted((t for t in terms if t[1] > 0), key=lambda t: -t[1])
+        # lists that can only lower a score (down-voted affinity) never admit
+        # a movie; they are applied to the candidates at the end
+        negative = [t for t in terms if t[1] <= 0]
+        floor = sum(t[0] for t in terms)
+
+        n = len(self.movies)
+        scores = np.zeros(n, dtype=np.float64)
+        admitted = np.zeros(n, dtype=bool)
+        if exclude is not None and len(exclude):
+            admitted[exclude] = True  # never becomes a candidate
+        found, visited = [], 0
+        remaining = sum(t[1] for t in positive)
+        probe = []
+        for i, (_, bound, post, w) in enumerate(positive):
+            if found and top_n > 0:
+                cand = np.concatenate(found)
+                if len(cand) >= top_n:
+                    lower = scores[cand] + floor
+                    kth = lower[np.argpartition(-lower, top_n - 1)[top_n - 1]]
+                    if remaining < kth:
+                        # no movie outside `cand` can reach (or tie) the N-th score
+                        probe = positive[i:]
+                        break
+            new = post[~admitted[post]]
+            admitted[new] = True
+            found.append(new)
+            scores[post] += w
+            visited += len(post)
+            remaining -= bound
+        cand = np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+        for _, _, post, w in probe + negative:
+            if len(post) <= len(cand):
+                scores[post] += w
+                visited += len(post)
+                continue
+            if not len(cand):
+                continue
+            idx = np.minimum(np.searchsorted(post, cand), len(post) - 1)
+            hit = post[idx] == cand
+            scores[cand[hit]] += w[idx[hit]] if np.ndim(w) else w
+            visited += len(cand)
+
+        if stats is not None:
+            stats['postings'] = sum(len(t[2]) for t in terms)
+            stats['visited'] = visited
+            stats['candidates'] = len(cand)
+        return self._select(cand, scores, top_n)
+
+
+_scorer_lock = threading.Lock()
+_scorer = None
+
+
+def get_vector_scorer(db):
+    """Return the process-wide VectorScorer for the current FeatureCache."""
+    global _scorer
+    catalog = get_feature_cache(db)
+    scorer = _scorer
+    if scorer is not None and scorer.movies is catalog.movies:
+        return scorer
+    with _scorer_lock:
+        scorer = _scorer
+        if scorer is not None and scorer.movies is catalog.movies:
+            return scorer
+        n = len(scorer.movies) if scorer is not None else 0
+        # appends only: the old movies (the same objects) are a prefix of the new list
+        if 0 < n <= len(catalog.movies) and catalog.movies[:n] == scorer.movies:
+            scorer = VectorScorer(catalog.movies, base=scorer)
+        else:
+            scorer = VectorScorer(catalog.movies)
+        _scorer = scorer
+        return scorer
@@ -15,7 +15,7 @@ fi
 echo "Running SQLite import..."
 cd backend/flask
 if [ -f "import_sqlite.py" ]; then
-    python3 import_sqlite.py
+    python3 import_sqlite.py --sync
 fi
 
 # --- 3. Start Flask server in background ---